@@ -0,0 +1,332 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Batch Simulation
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""Steps many matches at once with NumPy.
+
+BatchMatch keeps N matches as flat arrays (one entry per match) and applies
+exactly the same rules as simulation.Match, so the results of a batch are
+identical to running each match on its own. cross_check() proves it.
+
+Run this file directly to cross check the batch against the scalar rules.
+"""
+
+import collections
+import time
+import numpy as np
+import simulation
+from simulation import (SCREEN_WIDTH, PADDLE_WIDTH, PADDLE_HEIGHT,
+                        PADDLE_BUFFER, PADDLE1_POS, PADDLE2_POS, BALL_SIZE,
+                        COURT_TOP, COURT_BOTTOM, MAX_SCORE,
+                        AI_MAXSPEED, Ball, Paddle)
+
+# pygame.Rect stores C ints, so the batch does too
+DTYPE = np.int32
+
+# Paddles never move sideways, so their x position is a constant
+PADDLE1_X = int(PADDLE1_POS['x'])
+PADDLE2_X = int(PADDLE2_POS['x'])
+
+# Order of the values returned by BatchMatch.state() and match_state()
+STATE_FIELDS = ('ball_x', 'ball_y', 'ball_movex', 'ball_movey', 'paddle1_y',
+                'paddle2_y', 'paddle1_moving', 'paddle1_speed',
+                'paddle2_moving', 'paddle2_speed', 'player1_score',
+                'player2_score', 'winner')
+
+# Per match events of a single tick. wall_hit is a bool array, the others
+# hold the player concerned or 0 if nothing happened.
+BatchEvents = collections.namedtuple('BatchEvents', ['wall_hit', 'paddle_hit',
+                                                     'score', 'match_over'])
+
+
+class BatchMatch:
+    """A batch of matches stored as a struct of arrays."""
+    def __init__(self, count, numplayers=1):
+        """count: how many matches to run side by side
+           numplayers: 1 for player versus computer, 2 for player versus
+           player; the same for every match in the batch"""
+        self.count = count
+        self.numplayers = numplayers
+        self.ball_x = np.empty(count, DTYPE)
+        self.ball_y = np.empty(count, DTYPE)
+        self.ball_movex = np.empty(count, DTYPE)
+        self.ball_movey = np.empty(count, DTYPE)
+        self.paddle1_y = np.empty(count, DTYPE)
+        self.paddle2_y = np.empty(count, DTYPE)
+        self.paddle1_moving = np.empty(count, bool)
+        self.paddle2_moving = np.empty(count, bool)
+        self.paddle1_speed = np.empty(count, DTYPE)
+        self.paddle2_speed = np.empty(count, DTYPE)
+        self.player1_score = np.empty(count, DTYPE)
+        self.player2_score = np.empty(count, DTYPE)
+        self.winner = np.empty(count, DTYPE)  # 0 while the match is running
+        self.ticks = np.empty(count, np.int64)
+        # Starting values, taken from the scalar objects so the two can't
+        # drift apart
+        ball = Ball()
+        paddle = Paddle(PADDLE1_POS['x'], PADDLE1_POS['y'])
+        self.origspeed = ball.origspeed
+        self.y_speed = ball.Y_SPEED
+        self.acceleration = ball.ACCELERATION
+        self.paddle1_max = paddle.maxspeed
+        if numplayers == 1:
+            self.paddle2_max = AI_MAXSPEED
+        else:
+            self.paddle2_max = paddle.maxspeed
+        self._start = {'ball_x': ball.ball_rect.x, 'ball_y': ball.ball_rect.y,
+                       'ball_movex': ball.movex, 'ball_movey': ball.movey,
+                       'paddle1_y': paddle.paddle_rect.y,
+                       'paddle2_y': paddle.paddle_rect.y,
+                       'paddle1_moving': False, 'paddle2_moving': False,
+                       'paddle1_speed': self.paddle1_max,
+                       'paddle2_speed': self.paddle2_max,
+                       'player1_score': 0, 'player2_score': 0, 'winner': 0,
+                       'ticks': 0}
+        self.reset()
+
+    def reset(self, mask=None):
+        """Restarts matches from the kick off.
+
+            mask selects which matches to restart; all of them if None"""
+        if mask is None:
+            mask = slice(None)
+        for name, value in self._start.items():
+            getattr(self, name)[mask] = value
+
+    def state(self, index):
+        """Returns the state of one match in STATE_FIELDS order."""
+        return tuple(int(getattr(self, name)[index]) for name in STATE_FIELDS)
+
+    def step(self, player1_input=None, player2_input=None):
+        """Advances every running match by one tick.
+
+            player1_input and player2_input are arrays of directions (UP, DOWN
+            or STOP), one per match, or None to leave the paddles as they are.
+            In 1 player mode player 2 is always steered by the computer.
+            Returns the BatchEvents of the tick."""
+        running = self.winner == 0
+        for moving, speed, maxspeed, direction in (
+                (self.paddle1_moving, self.paddle1_speed, self.paddle1_max,
+                 player1_input),
+                (self.paddle2_moving, self.paddle2_speed, self.paddle2_max,
+                 player2_input)):
+            if direction is not None:
+                direction = np.asarray(direction, DTYPE)
+                moving[running] = direction[running] != 0
+                steer = running & (direction != 0)
+                speed[steer] = direction[steer] * maxspeed
+        if self.numplayers == 1:
+            self._handle_AI(running)
+        self._move_paddle(self.paddle1_y, self.paddle1_moving,
+                          self.paddle1_speed, running)
+        wall_hit, paddle_hit, score = self._move_ball(running)
+        match_over = self._increase_score(score)
+        self.ball_x[running] += self.ball_movex[running]
+        self.ball_y[running] += self.ball_movey[running]
+        self._move_paddle(self.paddle2_y, self.paddle2_moving,
+                          self.paddle2_speed, running)
+        self.ticks[running] += 1
+        return BatchEvents(wall_hit, paddle_hit, score, match_over)
+
+    def _handle_AI(self, running):
+        """Steers player 2 towards the ball, see simulation.handle_AI."""
+        y = self.paddle2_y
+        speed = self.paddle2_speed
+        self.paddle2_moving[running] = self.ball_movex[running] < 0
+        below = running & (self.ball_y > y + PADDLE_HEIGHT + speed)
+        above = running & ~below & (self.ball_y < y - speed)
+        speed[below] = self.paddle2_max
+        speed[above] = -self.paddle2_max
+
+    @staticmethod
+    def _move_paddle(y, moving, speed, running):
+        """Moves the paddles that should be moving, see Paddle.move."""
+        moving = running & moving
+        newy = y + speed
+        top = moving & (newy <= COURT_TOP)
+        bottom = moving & ~top & (newy + PADDLE_HEIGHT >= COURT_BOTTOM)
+        free = moving & ~top & ~bottom
+        y[top] = COURT_TOP + PADDLE_BUFFER
+        y[bottom] = COURT_BOTTOM - PADDLE_HEIGHT - PADDLE_BUFFER
+        y[free] = newy[free]
+
+    def _move_ball(self, running):
+        """Bounces the ball off walls and paddles, see Ball.move.
+
+            Returns the wall hit, paddle hit and score arrays. The ball
+            itself is moved after the score has been dealt with."""
+        x, y = self.ball_x, self.ball_y
+        movex, movey = self.ball_movex, self.ball_movey
+        # Bounces the ball off the walls
+        newy = y + movey
+        top = running & (newy <= COURT_TOP)
+        bottom = running & ~top & (newy + BALL_SIZE >= COURT_BOTTOM)
+        y[top] = COURT_TOP
+        y[bottom] = COURT_BOTTOM - BALL_SIZE
+        wall = top | bottom
+        movey[wall] *= -1
+        # Bounces the ball off paddles
+        newx = x + movex
+        hit1 = running & (movex > 0) & (
+            self._colliding(PADDLE1_X - movex, self.paddle1_y) |
+            self._phased(newx >= PADDLE1_X, self.paddle1_y))
+        hit2 = running & ~hit1 & (movex < 0) & (
+            self._colliding(PADDLE2_X + movex + PADDLE_WIDTH,
+                            self.paddle2_y) |
+            self._phased(newx <= PADDLE2_X, self.paddle2_y))
+        x[hit1] = PADDLE1_X - BALL_SIZE
+        x[hit2] = PADDLE2_X + PADDLE_WIDTH
+        movex[hit1 | hit2] *= -1
+        movex[hit1] -= self.acceleration
+        movex[hit2] += self.acceleration
+        paddle_hit = np.zeros(self.count, np.int8)
+        paddle_hit[hit1] = 1
+        paddle_hit[hit2] = 2
+        # Check for a score
+        newx = x + movex
+        score1 = running & (newx <= 0)
+        score2 = running & ~score1 & (newx + BALL_SIZE >= SCREEN_WIDTH)
+        score = np.zeros(self.count, np.int8)
+        score[score1] = 1
+        score[score2] = 2
+        return wall, paddle_hit, score
+
+    def _colliding(self, paddle_x, paddle_y):
+        """Vectorized pygame.Rect.colliderect of the ball and a paddle."""
+        return ((self.ball_x < paddle_x + PADDLE_WIDTH) &
+                (self.ball_x + BALL_SIZE > paddle_x) &
+                (self.ball_y < paddle_y + PADDLE_HEIGHT) &
+                (self.ball_y + BALL_SIZE > paddle_y))
+
+    def _phased(self, past_paddle, paddle_y):
+        """Vectorized Ball.ball_phased; past_paddle is the x comparison."""
+        return (past_paddle & (self.ball_y + BALL_SIZE >= paddle_y) &
+                (self.ball_y <= paddle_y + PADDLE_HEIGHT))
+
+    def _increase_score(self, score):
+        """Scores points and resets the ball, see Match.increase_score.
+
+            Returns the match over array."""
+        score1 = score == 1
+        score2 = score == 2
+        match_over = np.zeros(self.count, np.int8)
+        match_over[score1 & (self.player1_score >= MAX_SCORE)] = 1
+        match_over[score2 & (self.player2_score >= MAX_SCORE)] = 2
+        self.winner[match_over != 0] = match_over[match_over != 0]
+        self.player1_score[score1] += 1
+        self.player2_score[score2] += 1
+        self.ball_movex[score1] = self.origspeed
+        self.ball_movex[score2] = -self.origspeed
+        self.ball_x[score1] = PADDLE1_X - BALL_SIZE
+        self.ball_x[score2] = PADDLE2_X + PADDLE_WIDTH
+        # The ball spawns level with the middle of the scorer's paddle
+        self.ball_y[score1] = self.paddle1_y[score1] + PADDLE_HEIGHT // 2
+        self.ball_y[score2] = self.paddle2_y[score2] + PADDLE_HEIGHT // 2
+        self.ball_movey[score != 0] = self.y_speed
+        return match_over
+
+
+def match_state(match):
+    """Returns the state of a simulation.Match in STATE_FIELDS order."""
+    ball = match.ball
+    return (ball.ball_rect.x, ball.ball_rect.y, ball.movex, ball.movey,
+            match.player1.paddle_rect.y, match.player2.paddle_rect.y,
+            int(bool(match.player1.moving)), match.player1.movespeed,
+            int(bool(match.player2.moving)), match.player2.movespeed,
+            match.player1_score, match.player2_score, match.winner or 0)
+
+
+def match_events(events):
+    """Converts a list of simulation events into a BatchEvents row."""
+    row = {'wall_hit': 0, 'paddle_hit': 0, 'score': 0, 'match_over': 0}
+    for event in events:
+        if event.kind == simulation.WALL_HIT:
+            row['wall_hit'] = 1
+        elif event.kind == simulation.PADDLE_HIT:
+            row['paddle_hit'] = event.player
+        elif event.kind == simulation.SCORE:
+            row['score'] = event.player
+        elif event.kind == simulation.MATCH_OVER:
+            row['match_over'] = event.player
+    return BatchEvents(**row)
+
+
+def random_inputs(rng, count, hold=0.8):
+    """Random paddle directions for a batch.
+
+        Returns an array of directions and a mask of the matches that should
+        use them; the others (a fraction hold of them) keep their paddle as
+        it is."""
+    directions = rng.integers(-1, 2, count).astype(DTYPE)
+    change = rng.random(count) >= hold
+    return directions, change
+
+
+def cross_check(count=256, ticks=3000, numplayers=1, seed=0):
+    """Runs a batch next to the same matches on the scalar rules.
+
+        Both get the same random inputs; every value of every match is
+        compared after every tick. Raises AssertionError on the first
+        difference and returns the number of match ticks compared."""
+    rng = np.random.default_rng(seed)
+    batch = BatchMatch(count, numplayers)
+    matches = [simulation.Match(numplayers) for _ in range(count)]
+    compared = 0
+    for tick in range(ticks):
+        inputs = []
+        for player in range(numplayers):
+            directions, change = random_inputs(rng, count)
+            inputs.append((directions, change))
+        # A match that keeps its input simply gets its current direction
+        batch_inputs = []
+        for player, (directions, change) in enumerate(inputs):
+            if player == 0:
+                moving, speed = batch.paddle1_moving, batch.paddle1_speed
+            else:
+                moving, speed = batch.paddle2_moving, batch.paddle2_speed
+            current = np.where(moving, np.sign(speed), 0).astype(DTYPE)
+            batch_inputs.append(np.where(change, directions, current))
+        batch_events = batch.step(*batch_inputs)
+        for i, match in enumerate(matches):
+            scalar_inputs = [int(directions[i]) if change[i] else None
+                             for directions, change in inputs]
+            scalar_inputs += [None] * (2 - len(scalar_inputs))
+            events = match_events(match.step(scalar_inputs))
+            batch_row = BatchEvents(*(int(a[i]) for a in batch_events))
+            if (match_state(match) != batch.state(i) or
+                    events != batch_row):
+                raise AssertionError(
+                    'Match {} differs at tick {}:\n scalar {} {}\n batch  {} '
+                    '{}'.format(i, tick, match_state(match), events,
+                                batch.state(i), batch_row))
+        compared += count
+        if not (batch.winner == 0).any():
+            break
+    return compared
+
+
+def benchmark(count=10000, ticks=1000, numplayers=1, seed=0):
+    """Returns how many match ticks per second the batch runs."""
+    rng = np.random.default_rng(seed)
+    batch = BatchMatch(count, numplayers)
+    inputs = rng.integers(-1, 2, (ticks, count)).astype(DTYPE)
+    start = time.perf_counter()
+    for tick in range(ticks):
+        batch.step(inputs[tick])
+        finished = batch.winner != 0
+        if finished.any():
+            batch.reset(finished)
+    return count * ticks / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    for numplayers in (1, 2):
+        compared = cross_check(numplayers=numplayers)
+        print('{} player: batch matches scalar rules over {} match ticks'
+              .format(numplayers, compared))
+    print('{:.0f} match ticks per second'.format(benchmark()))
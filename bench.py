@@ -0,0 +1,394 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Benchmarks
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""Times the physics, the drawing and whole frames of the game.
+
+Everything runs headless on SDL's dummy video and audio drivers. Each
+benchmark is run a number of rounds and the median time per call is kept,
+which is steadier than the mean when something else on the machine gets in
+the way. Startup is timed by starting the game in a new process, and
+importing it by python -X importtime, which shows whether importing has
+stayed free of side effects. Results can be saved as JSON, and compared
+against an earlier results file to flag anything that got slower:
+    python3 bench.py -o baseline.json
+    python3 bench.py --baseline baseline.json
+"""
+
+import os
+# Must be set before pygame starts up
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import pygame
+import simulation
+import sounds
+
+RESULTS_VERSION = 1
+ROUNDS = 7
+ROUND_TIME = 0.1  # Seconds each round should take, roughly
+THRESHOLD = 0.1  # How much slower counts as a regression
+STARTUP_RUNS = 5
+IMPORT_MODULES = ('simulation', 'plink')  # Timed with python -X importtime
+
+
+def load_game():
+    """Imports the game and sets it up without starting its main loop."""
+    import plink
+    plink.setup([])  # The game has its own command line
+    return plink
+
+
+# Benchmarks; each sets up what it needs and returns a function to time,
+# or a tuple of it, how many things a call does and optionally a function
+# that undoes the setup once timing is done
+def bench_physics_step(game):
+    """Ball.move and Paddle.move for one tick, as Match.step does them."""
+    match = simulation.Match()
+    ball = match.ball
+
+    def step():
+        simulation.handle_AI(ball, match.player2)
+        match.player1.move()
+        for event in ball.move(match.player1, match.player2):
+            if event.kind == simulation.SCORE:
+                # Serve again, without keeping score
+                if event.player == 1:
+                    ball.reset(event.player, match.player1)
+                else:
+                    ball.reset(event.player, match.player2)
+        ball.advance()
+        match.player2.move()
+    return step
+
+
+def bench_match_step(game):
+    """A whole tick of a 1 player match, scoring included."""
+    match = simulation.Match()
+
+    def step():
+        nonlocal match
+        if match.winner:
+            match = simulation.Match()
+        match.step()
+    return step
+
+
+def bench_fixed_match_step(game):
+    """A tick of a 1 player match with fixed-point physics, hashing the
+       state afterwards as a lockstep game would."""
+    match = simulation.Match(fixed=True)
+
+    def step():
+        nonlocal match
+        if match.winner:
+            match = simulation.Match(fixed=True)
+        match.step()
+        match.get_hash()
+    return step
+
+
+def bench_batch_step(game):
+    """A tick of 1000 matches at once with NumPy, per match."""
+    try:
+        import batchsim
+    except ImportError:
+        return None  # No NumPy
+    batch = batchsim.BatchMatch(1000, numplayers=1)
+
+    def step():
+        batch.reset(batch.winner != 0)
+        batch.step()
+    return step, 1000
+
+
+def bench_multiball_step(game):
+    """A tick of a match with 1000 balls, per ball."""
+    try:
+        import multiball
+    except ImportError:
+        return None  # No NumPy
+    rng = random.Random(0)
+    match = multiball.MultiBallMatch(1000, rng=rng)
+
+    def step():
+        nonlocal match
+        if match.winner:
+            match = multiball.MultiBallMatch(1000, rng=rng)
+        match.step()
+    return step, 1000
+
+
+def bench_draw_character(game):
+    """A score digit, already rendered once."""
+    score = game.PixelChar(game.P1_SCOREPOS['x'], game.P1_SCOREPOS['y'])
+
+    def draw():
+        score.draw_character(7, game.DIGIT_BLOCK_SIZE)
+    return draw
+
+
+def bench_draw_character_uncached(game):
+    """A score digit rendered from scratch."""
+    score = game.PixelChar(game.P1_SCOREPOS['x'], game.P1_SCOREPOS['y'])
+
+    def draw():
+        game.PixelChar.glyphs.clear()
+        score.draw_character(7, game.DIGIT_BLOCK_SIZE)
+    return draw
+
+
+def bench_draw_word(game):
+    """The game over message."""
+    def draw():
+        game.draw_gameover()
+    return draw
+
+
+def bench_fps_counter(game):
+    """The FPS counter, with the frame rate changing now and then."""
+    rates = [str(rate) for rate in range(230, 250)] * 10
+    rates.sort()  # Like a real frame rate, it stays put for a while
+
+    def draw():
+        counter = game.fps_counter
+        counter.fps_counter.set_value(rates[draw.calls % len(rates)])
+        counter.fpslabel.draw()
+        draw.calls += 1
+    draw.calls = 0
+    return draw
+
+
+def bench_play_frame(game):
+    """A tick and a frame of a 1 player match."""
+    game.RECORD_REPLAYS = False  # Don't fill the disk with replays
+    game.reset_game(1)
+    game.game_state = game.PLAY
+
+    def frame():
+        if game.game_state != game.PLAY:
+            game.reset_game(1)
+            game.game_state = game.PLAY
+        game.game_state_play()
+        game.voice_pool.dispatch()
+        game.draw_game(1.0)
+    return frame
+
+
+def bench_play_frame_telemetry(game):
+    """A tick and a frame of a 1 player match, recording telemetry."""
+    import telemetry
+    game.RECORD_REPLAYS = False
+    game.telemetry_log = telemetry.Telemetry(
+        telemetry.SQLiteWriter(':memory:'))
+    game.reset_game(1)
+    game.game_state = game.PLAY
+
+    def frame():
+        if game.game_state != game.PLAY:
+            game.reset_game(1)
+            game.game_state = game.PLAY
+        game.game_state_play()
+        game.voice_pool.dispatch()
+        game.draw_game(1.0)
+
+    def teardown():
+        # So the benchmarks after this don't record telemetry too
+        game.telemetry_log.close()
+        game.telemetry_log = None
+    return frame, 1, teardown
+
+
+def bench_menu_frame(game):
+    """A tick and a frame of the menu."""
+    game.reset_game(1)
+
+    def frame():
+        game.game_state_menu()
+        game.draw_menu()
+    return frame
+
+
+BENCHMARKS = [bench_physics_step, bench_match_step, bench_fixed_match_step,
+              bench_batch_step,
+              bench_multiball_step,
+              bench_draw_character, bench_draw_character_uncached,
+              bench_draw_word, bench_fps_counter, bench_play_frame,
+              bench_play_frame_telemetry, bench_menu_frame]
+
+
+def time_benchmark(function, per_call=1, rounds=ROUNDS):
+    """Times a function, returning the median and fastest seconds per call
+       over some rounds.
+
+        per_call is how many things one call does, to time each of them."""
+    # Pick enough calls per round for it to take about ROUND_TIME
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for call in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed > ROUND_TIME / 10:
+            break
+        calls *= 10
+    calls = max(1, int(calls * ROUND_TIME / elapsed))
+    times = []
+    for round_number in range(rounds):
+        start = time.perf_counter()
+        for call in range(calls):
+            function()
+        times.append((time.perf_counter() - start) / calls / per_call)
+    times.sort()
+    return times[len(times) // 2], times[0], calls
+
+
+def time_import(module):
+    """Imports a module in a new Python and returns how many seconds it
+       took, including the modules it imports, as -X importtime reports
+       it."""
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True).stderr
+    # Lines go "import time: self [us] | cumulative | module", indented by
+    # depth, with the module imported last
+    for line in reversed(output.splitlines()):
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1e6
+    raise ValueError('No import time for ' + module)
+
+
+def run_benchmarks(names=None, startup=True, rounds=ROUNDS):
+    """Runs the benchmarks and returns their results.
+
+        names limits which benchmarks run; all of them if None."""
+    game = load_game()
+    results = {}
+    for benchmark in BENCHMARKS:
+        name = benchmark.__name__[len('bench_'):]
+        if names and name not in names:
+            continue
+        setup = benchmark(game)
+        if setup is None:
+            continue
+        teardown = None
+        if isinstance(setup, tuple):
+            function, per_call = setup[:2]
+            if len(setup) > 2:
+                teardown = setup[2]
+        else:
+            function, per_call = setup, 1
+        try:
+            median, fastest, calls = time_benchmark(function, per_call,
+                                                    rounds)
+        finally:
+            if teardown:
+                teardown()
+        results[name] = {'median_us': median * 1e6, 'min_us': fastest * 1e6,
+                         'calls': calls, 'rounds': rounds,
+                         'description': benchmark.__doc__}
+    if startup and (not names or 'startup' in names):
+        runs = sorted(sounds.time_startup()[0] for run in range(STARTUP_RUNS))
+        results['startup'] = {'median_us': runs[len(runs) // 2] * 1e6,
+                              'min_us': runs[0] * 1e6, 'calls': 1,
+                              'rounds': STARTUP_RUNS,
+                              'description': 'Starting the game up to its '
+                                             'first frame.'}
+    for module in IMPORT_MODULES:
+        name = 'import_' + module
+        if not startup or (names and name not in names):
+            continue
+        runs = sorted(time_import(module) for run in range(STARTUP_RUNS))
+        results[name] = {'median_us': runs[len(runs) // 2] * 1e6,
+                         'min_us': runs[0] * 1e6, 'calls': 1,
+                         'rounds': STARTUP_RUNS,
+                         'description': 'Importing {} in a new Python, '
+                                        'from -X importtime.'.format(module)}
+    return {'version': RESULTS_VERSION,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'machine': platform.platform(),
+            'results': results}
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Compares results against a baseline.
+
+        Returns (name, baseline median, median, change) for every benchmark
+        in both, and the names of those that got slower by more than
+        threshold. To keep noise from crying wolf, a benchmark only counts
+        as slower if even its fastest round was."""
+    rows = []
+    regressions = []
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['median_us']
+        change = result['median_us'] / before - 1
+        rows.append((name, before, result['median_us'], change))
+        if result['min_us'] > before * (1 + threshold):
+            regressions.append(name)
+    return rows, regressions
+
+
+def format_time(microseconds):
+    """Formats a time for printing."""
+    if microseconds >= 1000:
+        return '{:.2f} ms'.format(microseconds / 1000)
+    return '{:.2f} us'.format(microseconds)
+
+
+def main():
+    """Runs the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('names', nargs='*',
+                        help='benchmarks to run; all of them by default')
+    parser.add_argument('-o', '--output', help='save the results as JSON')
+    parser.add_argument('-b', '--baseline',
+                        help='compare against results saved earlier')
+    parser.add_argument('-t', '--threshold', type=float, default=THRESHOLD,
+                        help='fraction slower that counts as a regression')
+    parser.add_argument('-r', '--rounds', type=int, default=ROUNDS)
+    parser.add_argument('--no-startup', action='store_true',
+                        help="don't time starting or importing the game")
+    args = parser.parse_args()
+    results = run_benchmarks(args.names, not args.no_startup, args.rounds)
+    for name, result in results['results'].items():
+        print('{:<24} {:>12}  (fastest {})'.format(
+            name, format_time(result['median_us']),
+            format_time(result['min_us'])))
+    if args.output:
+        with open(args.output, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        rows, regressions = compare(results, baseline, args.threshold)
+        print()
+        print('Against {} from {}:'.format(args.baseline, baseline['time']))
+        for name, before, after, change in rows:
+            print('{:<24} {:>12} -> {:>12}  {:+.1%}{}'.format(
+                name, format_time(before), format_time(after), change,
+                '  SLOWER' if name in regressions else ''))
+        if regressions:
+            print('{} regression(s)'.format(len(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Environment
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""Many matches at once as an environment for training paddle agents.
+
+VectorEnv follows the Gymnasium vector environment API without needing
+Gymnasium: reset() and step(actions) over a batch of matches, played by the
+same rules as the game with batchsim.BatchMatch. An action is 0 to move up,
+1 to stay still or 2 to move down. Scoring is worth 1 and being scored on
+-1. A match that finishes is started again where it is, and what it looked
+like when it ended is kept in the info returned by step().
+
+Observations are either a vector of positions and speeds per match, or
+frames of the court. The frames are drawn straight into a pygame surface
+and the observation is a NumPy view of its pixels from pygame.surfarray,
+so nothing is copied. Every step writes over the same arrays, so copy an
+observation to keep it.
+
+Run this file directly to see how many steps per second it runs:
+    python3 environment.py --pixels
+"""
+
+import argparse
+import time
+import numpy as np
+import pygame
+import batchsim
+from simulation import (SCREEN_WIDTH, SCREEN_HEIGHT, PADDLE_WIDTH,
+                        PADDLE_HEIGHT, BALL_SIZE, BARRIER_HEIGHT,
+                        BARRIER_OFFSET, TICK_RATE)
+
+ACTIONS = 3  # Up, stay still, down
+# What each number of a state observation is; positions are scaled to 0-1
+# over the screen, speeds by the ball's starting speed
+STATE_FIELDS = ('ball_x', 'ball_y', 'ball_movex', 'ball_movey', 'paddle1_y',
+                'paddle2_y', 'paddle1_moving', 'paddle2_moving')
+SCALE = 10  # Frames are the screen shrunk this many times each way
+BACKGROUND = 0
+FOREGROUND = 255
+
+
+class VectorEnv:
+    """A batch of matches stepped together."""
+    def __init__(self, count, numplayers=1, pixels=False, scale=SCALE,
+                 max_ticks=None):
+        """count: how many matches to play at once
+           numplayers: 1 to play against the computer, 2 for an agent on
+           each side
+           pixels: observe frames of the court rather than the state
+           scale: how many times smaller than the screen frames are
+           max_ticks: cut matches off after this many ticks; never if None"""
+        self.count = count
+        self.numplayers = numplayers
+        self.pixels = pixels
+        self.scale = scale
+        self.max_ticks = max_ticks
+        self.batch = batchsim.BatchMatch(count, numplayers)
+        self.origspeed = self.batch.origspeed
+        if numplayers == 1:
+            self.action_shape = (count,)
+        else:
+            self.action_shape = (count, 2)
+        self.directions = np.zeros(self.action_shape, batchsim.DTYPE)
+        self.rewards = np.zeros(self.action_shape, np.float32)
+        self.terminated = np.zeros(count, bool)
+        self.truncated = np.zeros(count, bool)
+        self.done = np.zeros(count, bool)
+        self.states = np.zeros((count, len(STATE_FIELDS)), np.float32)
+        self.surface = None
+        if pixels:
+            self.frames = self.get_frames()
+            self.observations = self.frames
+        else:
+            self.observations = self.states
+        self.final_observations = np.zeros_like(self.observations)
+        # A view of done that lines up with the observations, to copy the
+        # final ones without making new arrays
+        self.done_mask = self.done.reshape(
+            (count,) + (1,) * (self.observations.ndim - 1))
+
+    def get_frames(self):
+        """Returns frames of every match, making the surface they are drawn
+           on the first time.
+
+            The frames are one surface high, the first match at the top, and
+            the returned array of (match, y, x) is a view of its pixels."""
+        if self.surface is None:
+            self.width = SCREEN_WIDTH // self.scale
+            self.height = SCREEN_HEIGHT // self.scale
+            self.surface = pygame.Surface(
+                (self.width, self.height * self.count), depth=8)
+            self.surface.set_palette([(level, level, level)
+                                      for level in range(256)])
+            # surfarray indexes pixels by x then y, so swap them around
+            self._pixels = pygame.surfarray.pixels2d(self.surface)
+            self._frames = self._pixels.reshape(
+                self.width, self.count, self.height).transpose(1, 2, 0)
+            # The barriers, which never move
+            self.court = np.full((self.height, self.width), BACKGROUND,
+                                 np.uint8)
+            barrier = self.to_pixels(BARRIER_HEIGHT + BARRIER_OFFSET)
+            self.court[self.to_pixels(BARRIER_OFFSET):barrier] = FOREGROUND
+            self.court[self.height - barrier:
+                       self.height - self.to_pixels(BARRIER_OFFSET)] = \
+                FOREGROUND
+            self.match_index = np.arange(self.count)[:, None, None]
+        return self._frames
+
+    def to_pixels(self, value):
+        """Converts screen coordinates to frame pixels."""
+        return value // self.scale
+
+    def reset(self):
+        """Starts every match again.
+
+            Returns (observations, info)."""
+        self.batch.reset()
+        return self.observe(), {}
+
+    def step(self, actions):
+        """Plays one tick of every match.
+
+            actions holds an action per match, or with 2 players a pair
+            of them. Returns (observations, rewards, terminated, truncated,
+            info) like a Gymnasium vector environment. Matches that ended
+            are started again; info['final_observation'] holds their last
+            observations and info['done'] says which they are."""
+        batch = self.batch
+        np.subtract(actions, 1, out=self.directions)
+        if self.numplayers == 1:
+            score = batch.step(self.directions).score
+            rewards = self.rewards
+        else:
+            score = batch.step(self.directions[:, 0],
+                               self.directions[:, 1]).score
+            rewards = self.rewards[:, 0]
+        rewards[:] = score == 1
+        rewards -= score == 2
+        if self.numplayers == 2:
+            np.negative(rewards, out=self.rewards[:, 1])
+        np.not_equal(batch.winner, 0, out=self.terminated)
+        if self.max_ticks is None:
+            self.truncated[:] = False
+        else:
+            np.greater_equal(batch.ticks, self.max_ticks, out=self.truncated)
+            self.truncated &= ~self.terminated
+        np.logical_or(self.terminated, self.truncated, out=self.done)
+        observations = self.observe()
+        if self.done.any():
+            np.copyto(self.final_observations, observations,
+                      where=self.done_mask)
+            batch.reset(self.done)
+            observations = self.observe()
+        return (observations, self.rewards, self.terminated, self.truncated,
+                {'final_observation': self.final_observations,
+                 'done': self.done})
+
+    def observe(self):
+        """Writes and returns the observations of every match."""
+        if self.pixels:
+            return self.render()
+        batch = self.batch
+        states = self.states
+        np.divide(batch.ball_x, SCREEN_WIDTH, out=states[:, 0])
+        np.divide(batch.ball_y, SCREEN_HEIGHT, out=states[:, 1])
+        np.divide(batch.ball_movex, self.origspeed, out=states[:, 2])
+        np.divide(batch.ball_movey, self.origspeed, out=states[:, 3])
+        np.divide(batch.paddle1_y, SCREEN_HEIGHT, out=states[:, 4])
+        np.divide(batch.paddle2_y, SCREEN_HEIGHT, out=states[:, 5])
+        # Which way each paddle is going, or 0 if it isn't
+        np.multiply(batch.paddle1_moving, np.sign(batch.paddle1_speed),
+                    out=states[:, 6])
+        np.multiply(batch.paddle2_moving, np.sign(batch.paddle2_speed),
+                    out=states[:, 7])
+        return states
+
+    def render(self):
+        """Draws every match and returns the frames, see get_frames()."""
+        frames = self.get_frames()
+        batch = self.batch
+        frames[:] = self.court
+        for x, y, width, height in (
+                (batchsim.PADDLE1_X, batch.paddle1_y, PADDLE_WIDTH,
+                 PADDLE_HEIGHT),
+                (batchsim.PADDLE2_X, batch.paddle2_y, PADDLE_WIDTH,
+                 PADDLE_HEIGHT),
+                (batch.ball_x, batch.ball_y, BALL_SIZE, BALL_SIZE)):
+            # Every pixel the object covers in every match at once
+            left = np.reshape(self.to_pixels(x), (-1, 1, 1))
+            top = np.reshape(self.to_pixels(y), (-1, 1, 1))
+            columns = np.clip(left + np.arange(max(1, self.to_pixels(width))),
+                              0, self.width - 1)
+            rows = np.clip(top + np.arange(
+                max(1, self.to_pixels(height)))[:, None], 0, self.height - 1)
+            frames[self.match_index, rows, columns] = FOREGROUND
+        return frames
+
+
+def benchmark(count=256, seconds=3.0, pixels=False, seed=0):
+    """Returns how many match steps per second an environment runs with
+       random actions."""
+    rng = np.random.default_rng(seed)
+    env = VectorEnv(count, pixels=pixels)
+    env.reset()
+    actions = rng.integers(0, ACTIONS, (64, count))
+    steps = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        env.step(actions[steps % len(actions)])
+        steps += 1
+    return steps * count / (time.perf_counter() - start)
+
+
+def main():
+    """Benchmarks the environment."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=256,
+                        help='matches to play at once')
+    parser.add_argument('--pixels', action='store_true',
+                        help='observe frames rather than the state')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+    rate = benchmark(args.count, args.seconds, args.pixels)
+    print('{:.0f} steps per second ({:.1f} million an hour, {:.0f}x real '
+          'time)'.format(rate, rate * 3600 / 1e6, rate / TICK_RATE))
+
+
+if __name__ == '__main__':
+    main()
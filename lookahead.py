@@ -0,0 +1,325 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Lookahead
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""A computer player that searches ahead over paddle moves.
+
+SearchAI plays like any other simulation AI, but decides which way to go by
+an expectimax search: it tries each of its own moves, averages over each
+move the other player could make, and looks further ahead the same way,
+scoring where it ends up by how close its paddle is to where the ball will
+arrive. Each searched move is held for MOVE_TICKS ticks. A position is
+copied with Match.get_state() and played on with Match.step().
+
+The search runs in a worker process, deepening one move at a time until
+SEARCH_TIME runs out, and sends back the best move of the deepest search it
+finished. The game hands the worker the latest state and picks up the
+latest decision without ever waiting for one, so a slow search only makes
+the AI react later, never the frame rate drop. The depth reached and nodes
+searched per second are kept as metrics.
+
+Run this file to watch it play the hard InterceptAI in real time:
+    python3 lookahead.py --seconds 30
+"""
+
+import argparse
+import math
+import multiprocessing
+import time
+import simulation
+from simulation import (UP, STOP, DOWN, SCORE, BALL_SIZE, COURT_TOP,
+                        COURT_BOTTOM, SCREEN_WIDTH, AI_MAXSPEED, TICK_RATE)
+
+SEARCH_TIME = 4  # Milliseconds of search per decision
+MOVE_TICKS = 5  # Ticks each searched move is held for
+MAX_DEPTH = 12  # Most moves searched ahead
+SCORE_VALUE = 1000  # Worth of a point, against pixels off the ball's path
+DIRECTIONS = (STOP, UP, DOWN)  # STOP first, so ties keep the paddle still
+
+
+class OutOfTime(Exception):
+    """Raised when a search runs past its deadline."""
+
+
+class Searcher:
+    """Searches ahead from match states for one side's best move.
+
+       This is the worker's half of SearchAI; it can also be used directly
+       to search on the calling thread."""
+    def __init__(self, side, swept=False, fixed=False,
+                 move_ticks=MOVE_TICKS):
+        """side: which player to find moves for, 1 or 2
+           swept, fixed: the physics of the matches searched"""
+        self.side = side
+        self.move_ticks = move_ticks
+        # Both paddles are steered by the search, never by an AI
+        self.match = simulation.Match(2, swept, fixed=fixed)
+        self.nodes = 0
+        self.deadline = 0.0
+
+    def search(self, state, seconds):
+        """Searches from a state from Match.get_state() for a while.
+
+            Returns (direction, depth reached, nodes searched)."""
+        self.nodes = 0
+        self.deadline = time.perf_counter() + seconds
+        best = STOP
+        reached = 0
+        for depth in range(1, MAX_DEPTH + 1):
+            try:
+                best = self.search_moves(state, depth)[1]
+            except OutOfTime:
+                break
+            reached = depth
+        return best, reached, self.nodes
+
+    def search_moves(self, state, depth):
+        """Returns the expected value and best move of a state, searching
+           depth moves ahead."""
+        best_value = -math.inf
+        best_move = STOP
+        # The other side's moves only matter while the ball is going their
+        # way; coming this way it gets here before they could hit it again
+        self.match.set_state(state)
+        if self.is_approaching(self.match.ball):
+            replies = (STOP,)
+        else:
+            replies = DIRECTIONS
+        for move in DIRECTIONS:
+            total = 0
+            for reply in replies:
+                child, points = self.play(state, move, reply)
+                if points:
+                    total += points * SCORE_VALUE
+                elif depth == 1:
+                    total += self.evaluate()
+                else:
+                    total += self.search_moves(child, depth - 1)[0]
+            value = total / len(replies)
+            if value > best_value:
+                best_value = value
+                best_move = move
+        return best_value, best_move
+
+    def play(self, state, move, reply):
+        """Plays a move and the other side's reply from a state.
+
+            Returns the state after it, and 1 if we scored, -1 if they did
+            or 0 if nobody did."""
+        if time.perf_counter() > self.deadline:
+            raise OutOfTime()
+        self.nodes += 1
+        match = self.match
+        match.set_state(state)
+        if self.side == 1:
+            inputs = (move, reply)
+        else:
+            inputs = (reply, move)
+        for tick in range(self.move_ticks):
+            for event in match.step(inputs):
+                if event.kind == SCORE:
+                    return None, 1 if event.player == self.side else -1
+        return match.get_state(), 0
+
+    def is_approaching(self, ball):
+        """Returns whether the ball is heading for our side."""
+        return (ball.movex > 0) == (self.side == 1)
+
+    def evaluate(self):
+        """Scores the match as it is now: minus how many pixels our paddle
+           is from where the ball will reach it, or from the middle of the
+           court while the ball is going the other way."""
+        match = self.match
+        if self.side == 1:
+            paddle = match.player1
+        else:
+            paddle = match.player2
+        target = (COURT_TOP + COURT_BOTTOM) / 2
+        if self.is_approaching(match.ball):
+            if paddle.paddle_rect.x < SCREEN_WIDTH / 2:
+                plane = paddle.paddle_rect.right
+            else:
+                plane = paddle.paddle_rect.left - BALL_SIZE
+            intercept = simulation.predict_intercept(match.ball, plane)
+            if intercept is not None:
+                target = intercept[1] + BALL_SIZE / 2
+        return -abs(target - paddle.paddle_rect.centery)
+
+
+def run_worker(connection, move_ticks):
+    """Answers search requests from a SearchAI until it sends None."""
+    searchers = {}
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        state, side, swept, fixed, seconds = request
+        key = (side, swept, fixed)
+        if key not in searchers:
+            searchers[key] = Searcher(side, swept, fixed, move_ticks)
+        start = time.perf_counter()
+        direction, depth, nodes = searchers[key].search(state, seconds)
+        connection.send((direction, depth, nodes,
+                         time.perf_counter() - start))
+
+
+class SearchAI:
+    """A computer player that steers by a search run in another process.
+
+       The worker is started by the first reset() and keeps going between
+       matches until close() is called."""
+    def __init__(self, search_time=SEARCH_TIME, maxspeed=AI_MAXSPEED,
+                 move_ticks=MOVE_TICKS):
+        """search_time: milliseconds to search for each decision
+           maxspeed: the paddle's speed
+           move_ticks: ticks each searched move is held for"""
+        self.search_time = search_time
+        self.maxspeed = int(maxspeed)
+        self.move_ticks = move_ticks
+        self.process = None
+        self.connection = None
+        self.waiting = False  # Whether the worker has a request to answer
+        self.direction = STOP
+        # Metrics
+        self.decisions = 0
+        self.depth = 0  # Of the last decision
+        self.total_depth = 0
+        self.nodes = 0
+        self.search_seconds = 0.0
+
+    def start(self):
+        """Starts the worker process."""
+        self.connection, worker_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=run_worker, args=(worker_connection, self.move_ticks),
+            daemon=True)
+        self.process.start()
+
+    def reset(self, match, paddle):
+        """Gets ready to play a match with a paddle."""
+        paddle.maxspeed = self.maxspeed
+        paddle.movespeed = self.maxspeed
+        self.direction = STOP
+        if self.process is None:
+            self.start()
+
+    def receive(self):
+        """Picks up the worker's decision, if it has made one."""
+        while self.waiting and self.connection.poll():
+            (self.direction, self.depth, nodes,
+             seconds) = self.connection.recv()
+            self.waiting = False
+            self.decisions += 1
+            self.total_depth += self.depth
+            self.nodes += nodes
+            self.search_seconds += seconds
+
+    def steer(self, match, paddle):
+        """Steers the paddle for the coming tick by the latest decision,
+           and has the worker search from this tick if it is free."""
+        self.receive()
+        if not self.waiting:
+            side = 1 if paddle is match.player1 else 2
+            # Only the ball the AI follows, in a multi-ball match
+            state = simulation.Match.get_state(match)
+            self.connection.send((state, side, match.swept, match.fixed,
+                                  self.search_time / 1000))
+            self.waiting = True
+        if self.direction == STOP:
+            paddle.moving = 0
+        else:
+            paddle.moving = 1
+            paddle.movespeed = self.direction * self.maxspeed
+
+    def get_metrics(self):
+        """Returns how many decisions the search made, how deep it got and
+           how many nodes per second it searched."""
+        return {'decisions': self.decisions, 'depth': self.depth,
+                'mean_depth': self.total_depth / max(1, self.decisions),
+                'nodes_per_second': self.nodes / max(1e-9,
+                                                     self.search_seconds)}
+
+    def describe(self):
+        """Returns the metrics as a line of text, for the profiler HUD."""
+        metrics = self.get_metrics()
+        return 'search depth {}  mean {:.1f}  nodes/s {:.0f}'.format(
+            metrics['depth'], metrics['mean_depth'],
+            metrics['nodes_per_second'])
+
+    def close(self):
+        """Stops the worker process."""
+        if self.process is None:
+            return
+        self.connection.send(None)
+        self.process.join(1)
+        self.process = None
+
+
+def play_real_time(seconds, search_time=SEARCH_TIME, opponent='hard'):
+    """Plays SearchAI against an InterceptAI, a tick every 1 / TICK_RATE
+       seconds like the game.
+
+        Returns the points each won, the AI's metrics and the slowest and
+        median time steer() took."""
+    ai = SearchAI(search_time)
+    other = simulation.InterceptAI.from_difficulty(opponent)
+    match = simulation.Match(ai=ai)
+    other.reset(match, match.player1)
+    points = [0, 0]
+    steer_times = []
+    start = time.perf_counter()
+    tick = 0
+    while time.perf_counter() - start < seconds:
+        if match.winner is not None:
+            match = simulation.Match(ai=ai)
+            other.reset(match, match.player1)
+        other.steer(match, match.player1)
+        steer_start = time.perf_counter()
+        ai.steer(match, match.player2)
+        steer_times.append(time.perf_counter() - steer_start)
+        # Match.step would steer player 2 again, so step it by hand
+        match.numplayers = 2
+        for event in match.step():
+            if event.kind == SCORE:
+                points[event.player - 1] += 1
+        match.numplayers = 1
+        tick += 1
+        delay = start + tick / TICK_RATE - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    ai.close()
+    steer_times.sort()
+    return (points, ai.get_metrics(), steer_times[-1],
+            steer_times[len(steer_times) // 2])
+
+
+def main():
+    """Plays the search AI against an InterceptAI and reports on it."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=30,
+                        help='how long to play for')
+    parser.add_argument('--search-time', type=float, default=SEARCH_TIME,
+                        help='milliseconds of search per decision')
+    parser.add_argument('--opponent', default='hard',
+                        choices=sorted(simulation.DIFFICULTIES))
+    args = parser.parse_args()
+    points, metrics, slowest, median = play_real_time(
+        args.seconds, args.search_time, args.opponent)
+    print('Points: search {}, {} InterceptAI {}'.format(
+        points[1], args.opponent, points[0]))
+    print('{} decisions, depth {:.1f} on average ({} ticks ahead), {:.0f} '
+          'nodes per second'.format(
+              metrics['decisions'], metrics['mean_depth'],
+              round(metrics['mean_depth'] * MOVE_TICKS),
+              metrics['nodes_per_second']))
+    print('steer() took {:.1f} us at the median, {:.1f} us at most'.format(
+        median * 1e6, slowest * 1e6))
+
+
+if __name__ == '__main__':
+    main()
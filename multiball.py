@@ -0,0 +1,450 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Multi-ball
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""Matches with lots of balls in play at once.
+
+The balls are kept as flat arrays, one entry per ball, and follow the same
+rules as a lone simulation.Ball, all moved together with NumPy. They also
+bounce off each other. Checking every ball against every other one doesn't
+scale to thousands of balls, so every tick the balls are sorted into a
+uniform grid (a SpatialHash) and only balls in the same or neighbouring
+cells are checked against each other, and only the balls in the cells near
+a paddle are checked against it.
+
+Every ball that crosses a goal line scores and is served again, so a match
+is played to a higher score the more balls there are. The computer player
+goes after the ball nearest to it that is heading its way.
+
+Run this file directly to check that a single ball plays exactly like a
+normal match, then see how fast lots of balls run:
+    python3 multiball.py 1000
+"""
+
+import argparse
+import random
+import time
+import numpy as np
+import pygame
+import simulation
+from simulation import (SCREEN_WIDTH, SCREEN_HEIGHT, PADDLE_WIDTH,
+                        PADDLE_HEIGHT, BALL_SIZE, COURT_TOP, COURT_BOTTOM,
+                        PADDLE2_POS, MAX_SCORE, TICK_RATE, Ball, Event)
+
+# pygame.Rect stores C ints, so the balls do too
+DTYPE = np.int32
+# As big as a ball, two balls can only touch if they are in the same or
+# neighbouring cells
+CELL_SIZE = BALL_SIZE * 2
+BALL_HIT = 'ball_hit'  # Event kind for two balls bouncing off each other
+# Neighbouring cells to check, as (column, row) offsets; only half of them,
+# so each pair of cells is only checked once
+NEIGHBOURS = ((1, 0), (-1, 1), (0, 1), (1, 1))
+
+
+class SpatialHash:
+    """A uniform grid of cells over the screen, filled with balls.
+
+       Balls are sorted by the cell they are in, so the balls in a cell, or
+       in a run of cells along a row, are a slice of that order."""
+    def __init__(self, cell_size=CELL_SIZE, width=SCREEN_WIDTH,
+                 height=SCREEN_HEIGHT):
+        self.cell_size = cell_size
+        self.columns = width // cell_size + 1
+        self.rows = height // cell_size + 1
+        self.order = np.empty(0, np.intp)  # Ball indices sorted by cell
+        self.cells = np.empty(0, np.intp)  # Cell of each ball, in that order
+        # Where each cell's balls start in order, and one past the end
+        self.starts = np.zeros(self.columns * self.rows + 1, np.intp)
+
+    def get_cell(self, x, y):
+        """Returns the column and row of positions, kept on the grid."""
+        return (np.clip(x // self.cell_size, 0, self.columns - 1),
+                np.clip(y // self.cell_size, 0, self.rows - 1))
+
+    def build(self, x, y):
+        """Sorts balls into cells by the top left corners at x and y."""
+        column, row = self.get_cell(x, y)
+        cells = row * self.columns + column
+        self.order = np.argsort(cells, kind='stable')
+        self.cells = cells[self.order]
+        self.starts = np.searchsorted(
+            self.cells, np.arange(self.columns * self.rows + 1))
+
+    def query(self, left, top, right, bottom):
+        """Returns the balls in the cells an area touches."""
+        (first_column, last_column), (first_row, last_row) = self.get_cell(
+            np.array([left, right]), np.array([top, bottom]))
+        slices = []
+        for row in range(first_row, last_row + 1):
+            start = self.starts[row * self.columns + first_column]
+            end = self.starts[row * self.columns + last_column + 1]
+            slices.append(self.order[start:end])
+        return np.concatenate(slices)
+
+    def pairs(self):
+        """Returns every pair of balls in the same or neighbouring cells,
+           each pair once, as two arrays of ball indices."""
+        count = len(self.cells)
+        positions = np.arange(count)
+        column = self.cells % self.columns
+        row = self.cells // self.columns
+        firsts = []
+        seconds = []
+        # The balls after each one in its own cell...
+        ranges = [(positions, positions + 1, self.starts[self.cells + 1])]
+        # ...and every ball in half of its neighbouring cells
+        for column_offset, row_offset in NEIGHBOURS:
+            inside = ((column + column_offset >= 0) &
+                      (column + column_offset < self.columns) &
+                      (row + row_offset < self.rows))
+            neighbour = (self.cells + column_offset +
+                         row_offset * self.columns)[inside]
+            ranges.append((positions[inside], self.starts[neighbour],
+                           self.starts[neighbour + 1]))
+        for position, start, end in ranges:
+            counts = end - start
+            total = counts.sum()
+            if not total:
+                continue
+            # Count from start to end for each ball, all at once
+            offsets = np.cumsum(counts) - counts
+            other = (np.arange(total) - np.repeat(offsets, counts) +
+                     np.repeat(start, counts))
+            firsts.append(self.order[np.repeat(position, counts)])
+            seconds.append(self.order[other])
+        if not firsts:
+            return np.empty(0, np.intp), np.empty(0, np.intp)
+        return np.concatenate(firsts), np.concatenate(seconds)
+
+
+class BallArray:
+    """Many balls stored as a struct of arrays."""
+    def __init__(self, count, rng=None):
+        """count: how many balls to play with
+           rng: the random.Random that spreads them out; a single ball
+           starts like a normal Ball"""
+        ball = Ball()
+        self.count = count
+        self.origspeed = ball.origspeed
+        self.y_speed = ball.Y_SPEED
+        self.acceleration = ball.ACCELERATION
+        self.x = np.full(count, ball.ball_rect.x, DTYPE)
+        self.y = np.full(count, ball.ball_rect.y, DTYPE)
+        self.movex = np.full(count, ball.movex, DTYPE)
+        self.movey = np.full(count, ball.movey, DTYPE)
+        self.grid = SpatialHash()
+        if count > 1:
+            # Spread out between the paddles, heading every way
+            rng = rng or random.Random()
+            edge = PADDLE2_POS['x'] + PADDLE_WIDTH + BALL_SIZE
+            for index in range(count):
+                self.x[index] = rng.randrange(edge, SCREEN_WIDTH - edge -
+                                              BALL_SIZE)
+                self.y[index] = rng.randrange(COURT_TOP + 1,
+                                              COURT_BOTTOM - BALL_SIZE - 1)
+                self.movex[index] = rng.choice((-1, 1)) * self.origspeed
+                self.movey[index] = rng.choice((-1, 1)) * rng.randint(
+                    1, self.y_speed)
+
+    def __len__(self):
+        return self.count
+
+    def move(self, player1, player2):
+        """Bounces the balls off the walls and paddles, see Ball.move.
+
+            Returns the events that happened and an array of who scored
+            with each ball, 0 for nobody. Scoring is reported but not acted
+            upon. The balls themselves are moved afterwards by advance()."""
+        x, y = self.x, self.y
+        movex, movey = self.movex, self.movey
+        events = []
+        # Bounces the balls off the walls
+        newy = y + movey
+        top = newy <= COURT_TOP
+        bottom = ~top & (newy + BALL_SIZE >= COURT_BOTTOM)
+        y[top] = COURT_TOP
+        y[bottom] = COURT_BOTTOM - BALL_SIZE
+        wall = top | bottom
+        movey[wall] *= -1
+        events += [Event(simulation.WALL_HIT, None)] * int(wall.sum())
+        # Bounces the balls off paddles; only balls near enough to touch a
+        # paddle this tick need checking
+        self.grid.build(x, y)
+        reach = int(np.abs(movex).max()) + BALL_SIZE
+        rect1 = player1.paddle_rect
+        rect2 = player2.paddle_rect
+        # A ball past a paddle bounces back too
+        near1 = self.grid.query(rect1.x - reach, rect1.y - BALL_SIZE,
+                                SCREEN_WIDTH, rect1.bottom)
+        near2 = self.grid.query(0, rect2.y - BALL_SIZE,
+                                rect2.right + PADDLE_WIDTH + reach,
+                                rect2.bottom)
+        hit1 = near1[self.hits_paddle(near1, 1, rect1)]
+        hit2 = near2[self.hits_paddle(near2, 2, rect2)]
+        x[hit1] = rect1.x - BALL_SIZE
+        x[hit2] = rect2.right
+        movex[hit1] = -movex[hit1] - self.acceleration
+        movex[hit2] = -movex[hit2] + self.acceleration
+        events += [Event(simulation.PADDLE_HIT, 1)] * len(hit1)
+        events += [Event(simulation.PADDLE_HIT, 2)] * len(hit2)
+        # Check for a score
+        newx = x + movex
+        score = np.zeros(self.count, np.int8)
+        score[newx <= 0] = 1
+        score[(newx > 0) & (newx + BALL_SIZE >= SCREEN_WIDTH)] = 2
+        return events, score
+
+    def hits_paddle(self, near, side, rect):
+        """Returns which of some balls bounce off a paddle this tick, see
+           Ball.move."""
+        x, y = self.x[near], self.y[near]
+        movex = self.movex[near]
+        if side == 1:
+            heading = movex > 0
+            paddle_x = rect.x - movex
+            phased = x + movex >= rect.x
+        else:
+            heading = movex < 0
+            paddle_x = rect.x + movex + PADDLE_WIDTH
+            phased = x + movex <= rect.x
+        # pygame.Rect.colliderect of the ball and the paddle moved by the
+        # ball's speed
+        colliding = ((x < paddle_x + PADDLE_WIDTH) &
+                     (x + BALL_SIZE > paddle_x) &
+                     (y < rect.y + PADDLE_HEIGHT) & (y + BALL_SIZE > rect.y))
+        phased &= (y + BALL_SIZE >= rect.y) & (y <= rect.y + PADDLE_HEIGHT)
+        return heading & (colliding | phased)
+
+    def serve(self, mask, side, paddle):
+        """Puts balls in front of a paddle at their starting speed, see
+           Ball.reset."""
+        self.movex[mask] = self.origspeed if side == 1 else -self.origspeed
+        if side == 1:
+            self.x[mask] = paddle.paddle_rect.x - BALL_SIZE
+        else:
+            self.x[mask] = paddle.paddle_rect.x + PADDLE_WIDTH
+        self.y[mask] = paddle.paddle_rect.y + PADDLE_HEIGHT // 2
+        self.movey[mask] = self.y_speed
+
+    def advance(self):
+        """Moves the balls along by their speed."""
+        self.x += self.movex
+        self.y += self.movey
+
+    def collide(self):
+        """Bounces balls that overlap off each other.
+
+            Each pair swaps its speeds along the side they overlap least
+            on, as long as they are moving towards each other there, like
+            equal weights bouncing without losing any energy. Returns the
+            events that happened."""
+        if self.count < 2:
+            return []
+        self.grid.build(self.x, self.y)
+        first, second = self.grid.pairs()
+        dx = self.x[second] - self.x[first]
+        dy = self.y[second] - self.y[first]
+        touching = (np.abs(dx) < BALL_SIZE) & (np.abs(dy) < BALL_SIZE)
+        first, second = first[touching], second[touching]
+        dx, dy = dx[touching], dy[touching]
+        across = np.abs(dx) >= np.abs(dy)
+        speeds = np.where(across, self.movex[first] - self.movex[second],
+                          self.movey[first] - self.movey[second])
+        approaching = speeds * np.where(across, dx, dy) > 0
+        if not approaching.any():
+            return []
+        # A ball can touch several others, so go through them in turn, on
+        # lists as they are quicker to index one at a time
+        movex = self.movex.tolist()
+        movey = self.movey.tolist()
+        events = []
+        for a, b, sideways, offset in zip(
+                first[approaching].tolist(), second[approaching].tolist(),
+                across[approaching].tolist(),
+                np.where(across, dx, dy)[approaching].tolist()):
+            speeds = movex if sideways else movey
+            if (speeds[a] - speeds[b]) * offset > 0:
+                speeds[a], speeds[b] = speeds[b], speeds[a]
+                events.append(Event(BALL_HIT, None))
+        self.movex[:] = movex
+        self.movey[:] = movey
+        return events
+
+    def get_rects(self, last_x=None, last_y=None, alpha=1.0):
+        """Returns a pygame.Rect for every ball.
+
+            last_x, last_y and alpha draw the balls alpha of the way from
+            where they were at last_x and last_y to where they are now."""
+        x, y = self.x, self.y
+        if last_x is not None:
+            x = last_x + np.round((x - last_x) * alpha).astype(DTYPE)
+            y = last_y + np.round((y - last_y) * alpha).astype(DTYPE)
+        return [pygame.Rect(ball_x, ball_y, BALL_SIZE, BALL_SIZE)
+                for ball_x, ball_y in zip(x.tolist(), y.tolist())]
+
+
+class MultiBallMatch(simulation.Match):
+    """A match with many balls, see simulation.Match.
+
+       self.ball is a stand-in for whichever ball the computer player is
+       going after, so the AIs for a normal match work unchanged."""
+    def __init__(self, balls, numplayers=1, ai=None, max_score=None,
+                 rng=None):
+        """balls: how many balls to play with
+           max_score: scoring again after reaching this ends the match;
+           MAX_SCORE for each ball if none specified
+           rng: the random.Random that spreads out the balls"""
+        simulation.Match.__init__(self, numplayers, ai=ai)
+        self.balls = BallArray(balls, rng)
+        if max_score is None:
+            max_score = MAX_SCORE * balls
+        self.max_score = max_score
+        self.track_ball()
+
+    def get_state(self):
+        """Returns everything that changes during a match as a flat tuple,
+           see simulation.Match.get_state; the balls come last."""
+        balls = self.balls
+        return (simulation.Match.get_state(self) +
+                tuple(np.concatenate((balls.x, balls.y, balls.movex,
+                                      balls.movey)).tolist()))
+
+    def set_state(self, state):
+        """Puts the match back into a state from get_state()."""
+        simulation.Match.set_state(self, state[:17])
+        balls = self.balls
+        values = np.array(state[17:], DTYPE).reshape(4, len(balls))
+        balls.x[:], balls.y[:], balls.movex[:], balls.movey[:] = values
+        self.track_ball()
+
+    def track_ball(self):
+        """Points self.ball at the ball nearest the computer's paddle that
+           is heading for it, or the nearest ball if none are."""
+        balls = self.balls
+        heading = balls.movex < 0
+        if heading.any():
+            index = np.flatnonzero(heading)[np.argmin(balls.x[heading])]
+        else:
+            index = np.argmin(balls.x)
+        self.ball.ball_rect.x = balls.x[index]
+        self.ball.ball_rect.y = balls.y[index]
+        self.ball.movex = int(balls.movex[index])
+        self.ball.movey = int(balls.movey[index])
+
+    def increase_score(self, player):
+        """Increases a player's score; the ball is served by step().
+
+            Returns the events caused by the point."""
+        events = []
+        if self.player1_score >= self.max_score and player == 1:
+            self.winner = 1
+            events.append(Event(simulation.MATCH_OVER, 1))
+        elif self.player2_score >= self.max_score and player == 2:
+            self.winner = 2
+            events.append(Event(simulation.MATCH_OVER, 2))
+        if player == 1:
+            self.player1_score += 1
+        elif player == 2:
+            self.player2_score += 1
+        return events
+
+    def step(self, inputs=(None, None), dt=1):
+        """Advances the match by one tick, see simulation.Match.step.
+
+            Returns a list of the events that happened during the tick."""
+        if dt != 1:
+            raise ValueError('Multi-ball matches only step by 1 tick')
+        if self.winner is not None:
+            return []
+        for paddle, direction in zip((self.player1, self.player2), inputs):
+            if direction is not None:
+                paddle.set_direction(direction)
+        if self.numplayers == 1:
+            self.track_ball()
+            if self.ai:
+                self.ai.steer(self, self.player2)
+            else:
+                simulation.handle_AI(self.ball, self.player2)
+        self.player1.update(dt)
+        events, score = self.balls.move(self.player1, self.player2)
+        for player, paddle in ((1, self.player1), (2, self.player2)):
+            scored = score == player
+            for point in range(int(scored.sum())):
+                if self.winner is not None:
+                    break
+                events.append(Event(simulation.SCORE, player))
+                events.extend(self.increase_score(player))
+            self.balls.serve(scored, player, paddle)
+        # Finally move the balls
+        self.balls.advance()
+        events.extend(self.balls.collide())
+        self.player2.update(dt)
+        self.ticks += dt
+        return events
+
+
+def cross_check(ticks=20000, seed=0):
+    """Plays a one ball match against a normal match with the same inputs,
+       raising AssertionError if they ever differ.
+
+        Returns how many ticks were compared."""
+    rng = random.Random(seed)
+    match = simulation.Match()
+    multi = MultiBallMatch(1, max_score=MAX_SCORE)
+    for tick in range(ticks):
+        if match.winner:
+            match = simulation.Match()
+            multi = MultiBallMatch(1, max_score=MAX_SCORE)
+        direction = rng.choice((simulation.UP, simulation.STOP,
+                                simulation.DOWN))
+        events = match.step((direction, None))
+        multi_events = multi.step((direction, None))
+        expected = match.get_state()
+        # The ball itself isn't the stand-in, so compare it separately
+        state = multi.get_state()
+        ball = (match.ball.ball_rect.x, match.ball.ball_rect.y,
+                match.ball.movex, match.ball.movey)
+        if (expected[:4] + expected[9:] != state[:4] + state[9:17] or
+                ball != state[17:] or events != multi_events):
+            raise AssertionError('Tick {} differs:\n normal {} {}\n multi  {} '
+                                 '{}'.format(tick, expected, events, state,
+                                             multi_events))
+    return ticks
+
+
+def benchmark(balls, ticks=TICK_RATE * 10, seed=0):
+    """Returns the average seconds a tick of a match with some balls takes,
+       and how many balls bounced off each other per tick."""
+    match = MultiBallMatch(balls, rng=random.Random(seed))
+    hits = 0
+    start = time.perf_counter()
+    for tick in range(ticks):
+        if match.winner:
+            match = MultiBallMatch(balls, rng=random.Random(seed))
+        hits += sum(event.kind == BALL_HIT for event in match.step())
+    return (time.perf_counter() - start) / ticks, hits / ticks
+
+
+def main():
+    """Checks the rules, then benchmarks lots of balls."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('balls', nargs='*', type=int,
+                        default=[10, 100, 1000, 2000])
+    args = parser.parse_args()
+    print('One ball plays exactly like a normal match over {} ticks'.format(
+        cross_check()))
+    for balls in args.balls:
+        seconds, hits = benchmark(balls)
+        print('{} balls: {:.2f} ms per tick ({:.0f}% of a tick), {:.1f} '
+              'ball bounces per tick'.format(balls, seconds * 1000,
+                                             seconds * TICK_RATE * 100, hits))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,467 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Netplay
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""Two player matches over UDP, with prediction and rollback.
+
+Both sides run the same match and only send each other their paddle inputs.
+When the other side's input for a tick hasn't arrived yet it is guessed to
+be the same as their last known one, and the match carries on. If the guess
+turns out wrong, the match is rolled back to the start of that tick and
+played forward again with the right input. The events of a tick are only
+handed to the game once the tick can't be rolled back any more, so it never
+acts on a point that didn't really happen. Every packet carries all the
+inputs the other side hasn't acknowledged yet, so lost packets only cost
+time. Every HASH_INTERVAL ticks, once a tick's state can no longer be rolled
+back, its simulation.hash_state() is sent along too. If the two sides' hashes
+for a tick differ, the matches have gone out of sync. That is only expected
+between different machines, and fixed-point physics rule it out.
+
+Try it on loopback with a simulated bad connection:
+    python3 netplay.py --selftest --latency 60 --jitter 15 --loss 0.1
+"""
+
+import argparse
+import asyncio
+import queue
+import random
+import struct
+import threading
+import simulation
+from simulation import STOP, SCORE, MATCH_OVER, TICK_RATE
+
+DEFAULT_PORT = 7777
+INPUT_DELAY = 2  # Ticks between pressing a key and it taking effect
+MAX_ROLLBACK = 24  # Most ticks we run ahead of the other side's inputs
+MAX_INPUTS = 255  # Most inputs in one packet
+HASH_INTERVAL = TICK_RATE  # Ticks between state hashes sent
+
+# Magic, newest input tick, newest tick we have every input up to, count,
+# then the tick of our newest state hash (-1 if none yet) and the hash
+PACKET = struct.Struct('<2siiBiQ')
+MAGIC = b'PN'
+
+
+class RollbackSession:
+    """A networked 2 player match, seen from one side.
+
+       The session knows nothing about sockets: packets are sent with the
+       send function it's given and received packets are handed to
+       receive()."""
+    def __init__(self, local_player, send, input_delay=INPUT_DELAY,
+                 max_rollback=MAX_ROLLBACK, fixed=False):
+        """local_player: 1 or 2, the paddle steered on this side
+           send: function that sends a packet to the other side
+           fixed: play with fixed-point physics, which keep machines of
+           different kinds in sync"""
+        self.match = simulation.Match(numplayers=2, fixed=fixed)
+        self.local_player = local_player
+        self.send = send
+        self.max_rollback = max_rollback
+        self.tick = 0  # The next tick to play
+        # Local inputs by tick; the first few are before anyone pressed
+        # anything
+        self.local_inputs = [STOP] * input_delay
+        self.remote_inputs = {}  # Remote inputs by tick, as they arrive
+        self.remote_confirmed = -1  # We have every remote input up to here
+        self.remote_acked = -1  # They have every local input up to here
+        self.predictions = {}  # Guessed remote inputs we've played with
+        self.snapshots = {}  # Match state at the start of each tick
+        self.rollback_to = None  # Earliest tick played with a wrong guess
+        self.tick_events = {}  # Events of each tick not yet handed out
+        self.reported = 0  # The first tick whose events weren't handed out
+        # State hashes at the start of ticks that can't change any more,
+        # by tick, until the other side's hash for the tick turns up
+        self.local_hashes = {}
+        self.remote_hashes = {}
+        self.last_hash = (-1, 0)  # Our newest hash, sent in every packet
+        self.desync_tick = None  # First tick the hashes differed at
+        self.hashes_checked = 0
+        self.connected = False
+        # Stats
+        self.rollbacks = 0
+        self.resimulated = 0
+        self.stalls = 0
+
+    def advance(self, direction):
+        """Plays the next tick.
+
+            direction is the local player's input (UP, DOWN or STOP); it
+            takes effect after the input delay.
+            Returns the events of the ticks that can no longer be rolled
+            back since the last call, see take_events(), or None if we're
+            waiting for the other side, in which case the input is
+            dropped."""
+        if (not self.connected or
+                self.tick - self.remote_confirmed > self.max_rollback):
+            self.stalls += 1
+            self.send_inputs()
+            return None
+        self.sync()
+        self.local_inputs.append(direction)
+        self.simulate(self.tick)
+        self.tick += 1
+        self.send_inputs()
+        self.prune()
+        return self.take_events()
+
+    def take_events(self):
+        """Returns the events of every tick played with real inputs from
+           both sides that haven't been returned yet."""
+        events = []
+        while self.reported <= min(self.remote_confirmed, self.tick - 1):
+            events.extend(self.tick_events.pop(self.reported))
+            self.reported += 1
+        return events
+
+    def sync(self):
+        """Replays any ticks that were played with a wrong guess."""
+        if self.rollback_to is None:
+            return
+        start = self.rollback_to
+        self.rollback_to = None
+        self.match.set_state(self.snapshots[start])
+        for tick in range(start, self.tick):
+            self.simulate(tick)
+        self.rollbacks += 1
+        self.resimulated += self.tick - start
+
+    def simulate(self, tick):
+        """Plays a tick with the best inputs we have for it, keeping its
+           events until take_events() hands them out."""
+        self.snapshots[tick] = self.match.get_state()
+        remote = self.get_remote_input(tick)
+        if tick > self.remote_confirmed:
+            self.predictions[tick] = remote
+        local = self.local_inputs[tick]
+        if self.local_player == 1:
+            inputs = (local, remote)
+        else:
+            inputs = (remote, local)
+        self.tick_events[tick] = self.match.step(inputs)
+
+    def get_remote_input(self, tick):
+        """Returns the remote input for a tick, or a guess at it."""
+        if tick in self.remote_inputs:
+            return self.remote_inputs[tick]
+        for known in range(tick - 1, self.remote_confirmed - 1, -1):
+            if known in self.remote_inputs:
+                return self.remote_inputs[known]
+        return STOP
+
+    def prune(self):
+        """Forgets what can no longer be rolled back to, hashing it every
+           HASH_INTERVAL ticks first."""
+        for tick in [tick for tick in self.snapshots
+                     if tick <= self.remote_confirmed]:
+            if tick % HASH_INTERVAL == 0:
+                self.last_hash = (tick, simulation.hash_state(
+                    self.snapshots[tick]))
+                self.local_hashes[tick] = self.last_hash[1]
+                self.check_hashes()
+            del self.snapshots[tick]
+            self.predictions.pop(tick, None)
+        # Keep the inputs for ticks we haven't played yet, when we're
+        # behind the other side
+        for tick in [tick for tick in self.remote_inputs
+                     if tick < min(self.remote_confirmed, self.tick)]:
+            del self.remote_inputs[tick]
+
+    def send_inputs(self):
+        """Sends every local input the other side hasn't acknowledged."""
+        first = self.remote_acked + 1
+        last = min(len(self.local_inputs), first + MAX_INPUTS) - 1
+        payload = bytes(direction + 1
+                        for direction in self.local_inputs[first:last + 1])
+        self.send(PACKET.pack(MAGIC, last, self.remote_confirmed,
+                              len(payload), *self.last_hash) + payload)
+
+    def receive(self, packet):
+        """Takes in a packet from the other side."""
+        if len(packet) < PACKET.size:
+            return
+        magic, newest, ack, count, hash_tick, state_hash = \
+            PACKET.unpack_from(packet)
+        if magic != MAGIC:
+            return
+        self.connected = True
+        self.remote_acked = max(self.remote_acked, ack)
+        if hash_tick >= 0:
+            self.remote_hashes[hash_tick] = state_hash
+            self.check_hashes()
+        first = newest - count + 1
+        payload = packet[PACKET.size:PACKET.size + count]
+        for tick, code in enumerate(payload, first):
+            if tick <= self.remote_confirmed or tick in self.remote_inputs:
+                continue
+            direction = code - 1
+            self.remote_inputs[tick] = direction
+            if tick < self.tick and self.predictions.get(tick) != direction:
+                if self.rollback_to is None or tick < self.rollback_to:
+                    self.rollback_to = tick
+        while self.remote_confirmed + 1 in self.remote_inputs:
+            self.remote_confirmed += 1
+
+    def check_hashes(self):
+        """Compares the state hashes both sides have made, noting the
+           first tick they differ at.
+
+            The other side only sends its newest hash, so ours for ticks
+            before it are never going to be checked and are forgotten."""
+        newest = max(self.remote_hashes, default=-1)
+        for tick in [tick for tick in self.remote_hashes
+                     if tick in self.local_hashes]:
+            self.hashes_checked += 1
+            if (self.remote_hashes.pop(tick) != self.local_hashes.pop(tick)
+                    and (self.desync_tick is None or
+                         tick < self.desync_tick)):
+                self.desync_tick = tick
+        for tick in [tick for tick in self.local_hashes if tick < newest]:
+            del self.local_hashes[tick]
+
+    def is_settled(self):
+        """Whether every tick played so far used the real remote inputs."""
+        return (self.remote_confirmed >= self.tick - 1 and
+                self.rollback_to is None)
+
+
+# Transport
+class UDPProtocol(asyncio.DatagramProtocol):
+    """Sends and receives packets for a session."""
+    def __init__(self, receive, remote_addr=None):
+        """receive: function called with every packet from the other side
+           remote_addr: where the other side is; if None, whoever sends the
+           first packet"""
+        self.receive = receive
+        self.remote_addr = remote_addr
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.remote_addr is None:
+            self.remote_addr = addr
+        if addr == self.remote_addr:
+            self.receive(data)
+
+    def send(self, data):
+        """Sends a packet to the other side, once we know where it is."""
+        if self.remote_addr is not None:
+            self.transport.sendto(data, self.remote_addr)
+
+
+class LossyLink:
+    """Sends packets as if over a bad connection.
+
+       Each packet is delayed by latency seconds give or take up to jitter,
+       or dropped altogether with a chance of loss."""
+    def __init__(self, send, latency=0.0, jitter=0.0, loss=0.0, rng=None):
+        self.forward = send
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = rng or random.Random()
+
+    def send(self, data):
+        """Sends a packet, maybe late or not at all."""
+        if self.rng.random() < self.loss:
+            return
+        delay = self.latency + self.rng.uniform(-self.jitter, self.jitter)
+        if delay <= 0:
+            self.forward(data)
+        else:
+            asyncio.get_event_loop().call_later(delay, self.forward, data)
+
+
+class NetworkThread:
+    """Runs the UDP transport on its own thread for the game loop.
+
+       Packets are queued up as they arrive and handed to a session when the
+       game calls poll(), so the session is only ever touched by the game's
+       thread."""
+    def __init__(self, port=DEFAULT_PORT, remote_addr=None, latency=0.0,
+                 jitter=0.0, loss=0.0):
+        self.packets = queue.SimpleQueue()
+        self.loop = asyncio.new_event_loop()
+        self.protocol = UDPProtocol(self.packets.put, remote_addr)
+        self.link = LossyLink(self.protocol.send, latency, jitter, loss)
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(port, ready),
+                                       daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def run(self, port, ready):
+        """Runs the network event loop."""
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.loop.create_datagram_endpoint(
+            lambda: self.protocol, local_addr=('0.0.0.0', port)))
+        ready.set()
+        self.loop.run_forever()
+
+    def send(self, data):
+        """Sends a packet from the game's thread."""
+        self.loop.call_soon_threadsafe(self.link.send, data)
+
+    def poll(self, session):
+        """Hands every packet that arrived to a session."""
+        while True:
+            try:
+                session.receive(self.packets.get_nowait())
+            except queue.Empty:
+                return
+
+    def clear(self):
+        """Throws away every packet that arrived, e.g. from a match that's
+           over."""
+        while True:
+            try:
+                self.packets.get_nowait()
+            except queue.Empty:
+                return
+
+    def close(self):
+        """Stops the network thread."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def add_arguments(parser):
+    """Adds the netplay options to a command line parser."""
+    group = parser.add_argument_group('netplay')
+    group.add_argument('--host', type=int, metavar='PORT',
+                       help='host a network match on this port')
+    group.add_argument('--join', metavar='HOST:PORT',
+                       help='join a network match')
+    group.add_argument('--latency', type=float, default=0.0,
+                       help='add this many milliseconds to every packet')
+    group.add_argument('--jitter', type=float, default=0.0,
+                       help='vary the added latency by up to this much')
+    group.add_argument('--loss', type=float, default=0.0,
+                       help='drop this fraction of packets')
+
+
+def from_arguments(args):
+    """Starts the network from parsed command line options.
+
+        Returns (NetworkThread, local player), or (None, 1) if no network
+        match was asked for. The host plays on the right as player 1."""
+    shim = (args.latency / 1000, args.jitter / 1000, args.loss)
+    if args.host is not None:
+        return NetworkThread(args.host, None, *shim), 1
+    elif args.join:
+        host, _, port = args.join.rpartition(':')
+        return NetworkThread(0, (host, int(port)), *shim), 2
+    return None, 1
+
+
+# Loopback test
+async def loopback_test(ticks=TICK_RATE * 10, latency=0.05, jitter=0.0,
+                        loss=0.0, seed=0, fixed=False):
+    """Plays a match between two sessions over UDP on this machine.
+
+        Each side presses random keys in real time. Once both have played
+        every tick and caught up on each other's inputs, their matches must
+        be in the same state, no state hash may have differed and each side
+        must have been handed one SCORE event per point scored, and a
+        MATCH_OVER event if the match was won. Returns the two sessions."""
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    sessions = []
+    protocols = []
+    for player in (1, 2):
+        protocol = UDPProtocol(None)
+        await loop.create_datagram_endpoint(lambda: protocol,
+                                            local_addr=('127.0.0.1', 0))
+        link = LossyLink(protocol.send, latency, jitter, loss,
+                         random.Random(rng.random()))
+        session = RollbackSession(player, link.send, fixed=fixed)
+        protocol.receive = session.receive
+        sessions.append(session)
+        protocols.append(protocol)
+    for protocol, other in ((protocols[0], protocols[1]),
+                            (protocols[1], protocols[0])):
+        protocol.remote_addr = other.transport.get_extra_info('sockname')
+    directions = [STOP, STOP]
+    events = [[], []]
+    while any(session.tick < ticks for session in sessions):
+        for index, session in enumerate(sessions):
+            if rng.random() < 0.1:
+                directions[index] = rng.choice((simulation.UP, STOP,
+                                                simulation.DOWN))
+            if session.tick < ticks:
+                events[index].extend(session.advance(directions[index])
+                                     or [])
+        await asyncio.sleep(1 / TICK_RATE)
+    # Let the last inputs get through
+    while not all(session.remote_confirmed >= ticks - 1
+                  for session in sessions):
+        for session in sessions:
+            session.send_inputs()
+        await asyncio.sleep(0.01)
+    for index, session in enumerate(sessions):
+        session.sync()
+        events[index].extend(session.take_events())
+    for protocol in protocols:
+        protocol.transport.close()
+    if sessions[0].match.get_state() != sessions[1].match.get_state():
+        raise AssertionError('The two sides ended up out of sync')
+    for session in sessions:
+        if session.desync_tick is not None:
+            raise AssertionError('Player {} saw the state hashes differ at '
+                                 'tick {}'.format(session.local_player,
+                                                  session.desync_tick))
+    match = sessions[0].match
+    points = [match.player1_score, match.player2_score]
+    for session, handed_out in zip(sessions, events):
+        scores = [sum(1 for event in handed_out
+                      if event.kind == SCORE and event.player == player)
+                  for player in (1, 2)]
+        if scores != points:
+            raise AssertionError('Player {} was told of {} points but the '
+                                 'score is {}'.format(session.local_player,
+                                                      scores, points))
+        winners = [event.player for event in handed_out
+                   if event.kind == MATCH_OVER]
+        if winners != ([] if match.winner is None else [match.winner]):
+            raise AssertionError('Player {} was told of winners {} but the '
+                                 'winner is {}'.format(session.local_player,
+                                                       winners, match.winner))
+    return sessions
+
+
+def main():
+    """Runs the loopback test from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--selftest', action='store_true', required=True,
+                        help='play a match between two sessions on loopback')
+    parser.add_argument('--ticks', type=int, default=TICK_RATE * 10)
+    parser.add_argument('--latency', type=float, default=50.0,
+                        help='one way latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='latency varies by up to this much')
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help='fraction of packets dropped')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fixed-point', action='store_true',
+                        help='play with fixed-point physics')
+    args = parser.parse_args()
+    sessions = asyncio.run(loopback_test(args.ticks, args.latency / 1000,
+                                         args.jitter / 1000, args.loss,
+                                         args.seed, args.fixed_point))
+    for session in sessions:
+        print('Player {}: {} ticks, {} rollbacks, {} ticks replayed, {} '
+              'stalls, {} state hashes checked'.format(
+                  session.local_player, session.tick, session.rollbacks,
+                  session.resimulated, session.stalls,
+                  session.hashes_checked))
+    print('Both sides in sync: {}'.format(sessions[0].match.get_state()))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,10 +10,24 @@
 # License:        MIT
 #------------------------------------------------------------------------------
 
+import argparse
+import collections
 import pygame
 import sys
 import os
+import time
 import pygame.locals as pygamevars
+import lookahead
+import multiball
+import netplay
+import profiler
+import replay
+import simulation
+import sounds
+import spectate
+import telemetry
+from simulation import (SCREEN_WIDTH, SCREEN_HEIGHT, BARRIER_HEIGHT,
+                        BARRIER_OFFSET, COURT_TOP, COURT_BOTTOM, TICK_RATE)
 
 # Colors
 WHITE = (255, 255, 255)
@@ -21,30 +35,14 @@ BLACK = (0, 0, 0)
 
 
 # Display constants
-SCREEN_WIDTH = 900
-SCREEN_HEIGHT = 600
 WINDOW_TITLE = 'Plink'
+# The game is drawn at SCREEN_WIDTH x SCREEN_HEIGHT, then blown up this many
+# times to fill the window, unless --scale says otherwise
+WINDOW_SCALE = 1
 BG_COLOR = BLACK
 FPSCOUNT_POS = {'x': 30, 'y': 23}
-PADDLE_WIDTH = 20
-PADDLE_HEIGHT = 100
-PADDLE_OFFSET = 25  # The space between the paddle and the side of the screen
-PADDLE_BUFFER = 5  # THe space between the paddle and the barriers
-PADDLE_Y = (SCREEN_HEIGHT / 2) - (PADDLE_HEIGHT / 2)  # Centers the paddle
-# Starting points for paddles
-PADDLE1_POS = {'x': (SCREEN_WIDTH - PADDLE_WIDTH - PADDLE_OFFSET),
-               'y': PADDLE_Y}
-PADDLE2_POS = {'x': PADDLE_OFFSET, 'y': PADDLE_Y}
-# Ball properties
-BALL_SIZE = 20
-BALL_POS = {'x': ((SCREEN_WIDTH / 2) - (BALL_SIZE / 2)),
-            'y': ((SCREEN_HEIGHT / 2) - (BALL_SIZE / 2))}
 BARRIER_WIDTH = SCREEN_WIDTH - 20
-BARRIER_HEIGHT = 25
-BARRIER_OFFSET = 10
 BARRIER_X = 10
-COURT_TOP = BARRIER_HEIGHT + BARRIER_OFFSET
-COURT_BOTTOM = SCREEN_HEIGHT - BARRIER_HEIGHT - BARRIER_OFFSET
 NET_SQUARE_SIZE = 23
 NET_BUFFER = 16
 NET_POS = {'x': float(SCREEN_WIDTH / 2) - float(NET_SQUARE_SIZE / 2),
@@ -54,6 +52,7 @@ SCOREBOX_X_BUF = 100
 SCOREBOX_Y_BUF = 20
 P1_SCOREPOS = {'x': (SCREEN_WIDTH / 2) + SCOREBOX_X_BUF,
                'y': COURT_TOP + SCOREBOX_Y_BUF}
+# Player 2's score grows to the left, away from the net, past one digit
 P2_SCOREPOS = {'x': (SCREEN_WIDTH / 2) - (DIGIT_BLOCK_SIZE * 3) -
                      SCOREBOX_X_BUF,
                'y': COURT_TOP + SCOREBOX_Y_BUF}
@@ -64,11 +63,15 @@ LETTER_HEIGHT = 6
 TITLE_POS = {'x': ((SCREEN_WIDTH / 2) - (TITLE_BLOCK_SIZE *
                   ((LETTER_LENGTH * 2) + 1))),
              'y': 100}
+TITLE_LINE_WIDTH = 420  # How wide the line under the title grows
 OPTIONS_BUFFER = 5
 OPTIONS_BLOCK_SIZE = 3
 OPTIONS_POS = {'x': (SCREEN_WIDTH / 2) - 50,
                'y': (TITLE_POS['y'] + 200)}
 MENU_PNTR_SIZE = 7
+# With more moving objects than this, the whole screen is drawn every frame
+MAX_DIRTY_RECTS = 64
+PROFILER_POS = {'x': 60, 'y': COURT_BOTTOM - 100}
 
 
 # Game states
@@ -81,12 +84,44 @@ WIN = 5
 
 
 # System constants
-FPS = 70
+TICK_TIME = 1000 / TICK_RATE  # Milliseconds between updates
+MAX_TICKS = 5  # Most updates to catch up on before drawing a frame
+FPS = 240  # Most frames drawn per second
+# Most milliseconds a screen that can't change sleeps before looking again
+IDLE_TIMEOUT = 500
+# With --precise-input, how often to look for input while waiting for the
+# next frame, in milliseconds
+INPUT_SAMPLE_TIME = 1
+# How good the computer is: a key of simulation.DIFFICULTIES, or None for
+# the classic computer player. Only matches against the classic one are
+# recorded to Replays
+AI_DIFFICULTY = None
+# Which sounds cut off which when too many play at once, higher first
+WALL_PRIORITY = 0
+HIT_PRIORITY = 1
+MENU_PRIORITY = 2
+SCORE_PRIORITY = 3
+MATCH_OVER_PRIORITY = 4
+RECORD_REPLAYS = True  # Save a replay of every match
+REPLAY_DIR = 'Replays'
+PROFILE_DIR = 'Profiles'  # Where F4 saves the frame profiler's data
 
 
 # Classes
 class TextBox:
-    """Simple class for creating and modifying text boxes."""
+    """Simple class for creating and modifying text boxes.
+       Fonts and rendered text are shared by every text box, so showing
+       text that has been shown before doesn't render it again"""
+    CACHE_SIZE = 128  # Most rendered texts kept
+
+    # Fonts keyed by their type and size
+    fonts = {}
+    # Rendered texts keyed by (text, font, color, antialias), least recently
+    # used first
+    rendered = collections.OrderedDict()
+    hits = 0
+    misses = 0
+
     def __init__(self, text_value, font_size, font_color,
                  position, font_type=None):
         """text_value: text to have in the text box
@@ -94,16 +129,56 @@ class TextBox:
            font_type: font to use; if none specified use default
            font_color: color of the text as a tuple
            positon is a tuple containing x and y coordinates"""
-        self.font = pygame.font.Font(font_type, font_size)
-        self.color = font_color
+        self.font = self.get_font(font_type, font_size)
+        self.color = tuple(font_color)
         self.position = position
         self.set_value(text_value)
 
+    @classmethod
+    def get_font(cls, font_type, font_size):
+        """Returns the font of a type and size, loading it the first time."""
+        key = (font_type, font_size)
+        font = cls.fonts.get(key)
+        if font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = cls.fonts[key] = pygame.font.Font(font_type, font_size)
+        return font
+
+    @classmethod
+    def render(cls, text_value, font, color, antialias=True):
+        """Returns a surface with the text rendered on it, from the cache if
+           it's there."""
+        key = (text_value, font, color, antialias)
+        text = cls.rendered.get(key)
+        if text is not None:
+            cls.hits += 1
+            cls.rendered.move_to_end(key)
+            return text
+        cls.misses += 1
+        text = font.render(text_value, antialias, color)
+        cls.rendered[key] = text
+        if len(cls.rendered) > cls.CACHE_SIZE:
+            cls.rendered.popitem(last=False)
+        return text
+
+    @classmethod
+    def get_cache_stats(cls):
+        """Returns how well the cache of rendered text is doing."""
+        lookups = cls.hits + cls.misses
+        return {'hits': cls.hits, 'misses': cls.misses,
+                'hit_rate': cls.hits / lookups if lookups else 0.0,
+                'size': len(cls.rendered), 'capacity': cls.CACHE_SIZE}
+
     def set_value(self, text_value):
         """Set's the textbox's value, then displays it back on the screen."""
-        text = self.font.render(text_value, True, self.color)
-        self.text_rect = text.get_rect(center=self.position)
-        screen.blit(text, self.text_rect)
+        self.text = self.render(text_value, self.font, self.color)
+        self.text_rect = self.text.get_rect(center=self.position)
+        self.draw()
+
+    def draw(self):
+        """Displays the text box on the screen again, as it is."""
+        screen.blit(self.text, self.text_rect)
 
 
 class FPSCounter:
@@ -123,126 +198,14 @@ class FPSCounter:
         #screen.fill(BLACK, self.fps_counter.text_rect)
         # Get clock fps, truncate decimals, then convert to string
         self.fps_counter.set_value(str(int(fps_clock.get_fps())))
-        # Kina a nasty hack, I shouldn't have to set the value every frame.
-        # Will add method that simply re-renders the text
-        self.fpslabel.set_value('FPS: ')
-
-
-class Paddle:
-    """Class detailing how a pong paddle looks and functions."""
-    def __init__(self, posx, posy, maxspeed=12):
-        self.maxspeed = maxspeed
-        # Simply invert movespeed to change direction
-        self.movespeed = self.maxspeed
-        self.moving = 0  # Decides if the paddle should move or not
-        self.moveup = 0
-        self.movedown = 0
-        # Create the rect for the paddle then draw it to the screen
-        self.paddle_rect = pygame.Rect(posx, posy, PADDLE_WIDTH, PADDLE_HEIGHT)
-
-    def move(self):
-        """Moves the paddle."""
-        # Stop paddle from moving out of bounds
-        if self.paddle_rect.y + self.movespeed <= COURT_TOP:
-            self.paddle_rect.y = COURT_TOP + PADDLE_BUFFER
-        elif (self.paddle_rect.y + self.movespeed +
-              PADDLE_HEIGHT >= COURT_BOTTOM):
-            self.paddle_rect.y = COURT_BOTTOM - PADDLE_HEIGHT - PADDLE_BUFFER
-        else:
-            self.paddle_rect.move_ip(0, self.movespeed)
-
-    def update(self):
-        """Draw the paddle."""
-        if self.moving:
-            self.move()
-        screen.fill(WHITE, self.paddle_rect)
-
-
-class Ball:
-    """Class describing ball properties and behavior."""
-    Y_SPEED = 5
-    ACCELERATION = 1
-
-    def __init__(self):
-        self.origspeed = 15
-        self.maxspeed = self.origspeed
-        self.movex = -self.maxspeed
-        self.movey = self.Y_SPEED
-        self.ball_rect = pygame.Rect(BALL_POS['x'], BALL_POS['y'],
-                                     BALL_SIZE, BALL_SIZE)
-
-    def reset(self, side):
-        """Put's the ball in center and resets speed.
-
-            side is which side the ball should spawn on"""
-        #self.ball_rect.x = BALL_POS['x']
-        #self.ball_rect.y = BALL_POS['y']
-        self.maxspeed = self.origspeed
-        self.movex = self.maxspeed
-        if side == 2:
-            self.movex *= -1
-            self.ball_rect.x = player2.paddle_rect.x + PADDLE_WIDTH
-            self.ball_rect.y = player2.paddle_rect.y + (PADDLE_HEIGHT / 2)
-        else:
-            self.ball_rect.x = player1.paddle_rect.x - BALL_SIZE
-            self.ball_rect.y = player1.paddle_rect.y + (PADDLE_HEIGHT / 2)
-        self.movey = self.Y_SPEED
-
-    def wall_collide_adjust(self, newy):
-        """When the ball hits a wall, adjust it."""
-        self.ball_rect.y = newy
-        self.movey *= -1
-        wallhit_sfx.play()
-
-    def paddle_collide_adjust(self, newx, speed_modifier):
-        """When the ball hits a paddle, adjust it."""
-        self.ball_rect.x = newx
-        self.movex *= -1
-        self.movex += speed_modifier
-        paddlehit_sfx.play()
-
-    def ball_phased(self, player):
-        """Check if ball 'phased' through the paddle."""
-        if player is player1:
-            return ((self.ball_rect.x + self.movex) >= player.paddle_rect.x and
-                (self.ball_rect.y + BALL_SIZE) >= player.paddle_rect.y and
-                 self.ball_rect.y <= (player.paddle_rect.y + PADDLE_HEIGHT))
-        else:
-            return ((self.ball_rect.x + self.movex) <= player.paddle_rect.x and
-                (self.ball_rect.y + BALL_SIZE) >= player.paddle_rect.y and
-                 self.ball_rect.y <= (player.paddle_rect.y + PADDLE_HEIGHT))
-
-    def move(self):
-        """Moves the ball then draws it to the screen."""
-        # Bounces the ball off the walls
-        if self.ball_rect.y + self.movey <= COURT_TOP:
-            self.wall_collide_adjust(COURT_TOP)
-        elif self.ball_rect.y + self.movey + BALL_SIZE >= COURT_BOTTOM:
-            self.wall_collide_adjust(COURT_BOTTOM - BALL_SIZE)
-        # Bounces the ball off paddles
-        if ((self.ball_rect.colliderect(
-                player1.paddle_rect.move(-self.movex, 0)) or
-                self.ball_phased(player1)) and self.movex > 0):
-            self.paddle_collide_adjust(player1.paddle_rect.x - BALL_SIZE,
-                                       -self.ACCELERATION)
-        elif ((self.ball_rect.colliderect(player2.paddle_rect.move(
-                self.movex + PADDLE_WIDTH, 0)) or
-                self.ball_phased(player2)) and self.movex < 0):
-            self.paddle_collide_adjust(player2.paddle_rect.x + PADDLE_WIDTH,
-                                       self.ACCELERATION)
-        # Check for a score
-        if self.ball_rect.x + self.movex <= 0:
-            increase_score(player=1)
-        elif self.ball_rect.x + self.movex + BALL_SIZE >= SCREEN_WIDTH:
-            increase_score(player=2)
-        # Finally move and draw the ball
-        self.ball_rect.move_ip(self.movex, self.movey)
-        screen.fill(WHITE, self.ball_rect)
+        self.fpslabel.draw()
 
 
 class PixelChar:
     """Converts a character into 'pixels' on the screen.
-       Each character is represented by a matrix"""
+       Each character is represented by a matrix, which is rendered to a
+       surface the first time it is drawn at a given size"""
+    DIGIT_LENGTH = 3
     CHARS = {  0:
                 [[1, 1, 1],
                  [1, 0, 1],
@@ -459,22 +422,177 @@ class PixelChar:
                  [0, 0, 0, 0]]
             }
 
-    def __init__(self, xpos, ypos):
+    # Rendered characters and words, keyed by what they show and their size
+    glyphs = {}
+    words = {}
+
+    def __init__(self, xpos, ypos, grow_left=False):
+        """grow_left: numbers of more than one digit grow to the left, so
+           the last digit stays at xpos"""
         self.xpos = xpos
         self.ypos = ypos
-
-    def draw_character(self, char, block_size):
+        self.grow_left = grow_left
+
+    @classmethod
+    def get_glyph(cls, char, block_size):
+        """Returns a surface with the character drawn on it.
+
+            Numbers above 9 are drawn digit by digit."""
+        key = (char, block_size)
+        glyph = cls.glyphs.get(key)
+        if glyph is not None:
+            return glyph
+        if isinstance(char, int) and char > 9:
+            glyph = cls.get_word(str(char), block_size, cls.DIGIT_LENGTH)
+        else:
+            matrix = cls.CHARS[char]
+            glyph = pygame.Surface((block_size * len(matrix[0]),
+                                    block_size * len(matrix)))
+            glyph.fill(BG_COLOR)
+            for y, row in enumerate(matrix):
+                for x, block_on in enumerate(row):
+                    if block_on:
+                        glyph.fill(WHITE, (block_size * x, block_size * y,
+                                           block_size, block_size))
+            # Only the blocks themselves get drawn
+            glyph.set_colorkey(BG_COLOR, pygamevars.RLEACCEL)
+        cls.glyphs[key] = glyph
+        return glyph
+
+    @classmethod
+    def get_word(cls, word, block_size, charlen):
+        """Returns a surface with a whole word drawn on it.
+
+            charlen is the width of a character in blocks; characters are
+            spaced one block apart"""
+        key = (word, block_size, charlen)
+        surface = cls.words.get(key)
+        if surface is not None:
+            return surface
+        glyphs = []
+        for char in word:
+            if char.isdigit():
+                char = int(char)
+            glyphs.append(cls.get_glyph(char, block_size))
+        spacing = block_size * (charlen + 1)
+        width = spacing * (len(glyphs) - 1) + glyphs[-1].get_width()
+        height = max(glyph.get_height() for glyph in glyphs)
+        surface = pygame.Surface((width, height))
+        surface.fill(BG_COLOR)
+        for x, glyph in enumerate(glyphs):
+            surface.blit(glyph, (x * spacing, 0))
+        surface.set_colorkey(BG_COLOR, pygamevars.RLEACCEL)
+        cls.words[key] = surface
+        return surface
+
+    def get_rect(self, char, block_size):
+        """Returns the area the character covers when drawn."""
+        xpos = self.xpos
+        if self.grow_left and isinstance(char, int):
+            xpos -= (len(str(char)) - 1) * block_size * (self.DIGIT_LENGTH + 1)
+        return self.get_glyph(char, block_size).get_rect(topleft=(xpos,
+                                                                  self.ypos))
+
+    def draw_character(self, char, block_size, surface=None):
         """Draws the character.
-            char is a matrix containing data on a character"""
-        if char == 10:
-            char = '-'
-        for y, row in enumerate(self.CHARS[char]):
-            for x, block_on in enumerate(row):
-                if block_on:
-                    blockrect = pygame.Rect(self.xpos + (block_size * x),
-                                            self.ypos + (block_size * y),
-                                            block_size, block_size)
-                    screen.fill(WHITE, blockrect)
+            char is a key into CHARS, or a number to draw
+            surface is where to draw it; the screen if none specified"""
+        if surface is None:
+            surface = screen
+        surface.blit(self.get_glyph(char, block_size),
+                     self.get_rect(char, block_size))
+
+
+class CourtRenderer:
+    """Draws the court, redrawing only what changed since the last frame.
+
+       The barriers, net and scores live on a pre-rendered layer. Each frame
+       the moving objects are erased by copying the layer back over where they
+       were, drawn at their new spot, and only those areas are sent to the
+       display."""
+    def __init__(self):
+        self.background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        self.background = self.background.convert()
+        self.background.fill(BG_COLOR)
+        draw_barriers(self.background)
+        draw_net(self.background)
+        self.layer = self.background.copy()
+        self.blocks = {}  # White surfaces by size, to blit objects with
+        self.invalidate()
+
+    def invalidate(self):
+        """Forces the next frame to redraw the whole screen."""
+        self.match = None
+        self.overlay = None
+        self.scores = None
+        self.drawn = []  # Areas covered by moving objects on the last frame
+
+    def get_block(self, size):
+        """Returns a white surface of a size, made the first time."""
+        block = self.blocks.get(size)
+        if block is None:
+            block = self.blocks[size] = pygame.Surface(size).convert()
+            block.fill(WHITE)
+        return block
+
+    def draw_scores(self):
+        """Draws the scores onto the layer if they changed.
+
+            Returns the areas of the screen that need updating."""
+        scores = (match.player1_score, match.player2_score)
+        if scores == self.scores:
+            return []
+        changed = []
+        for scorebox, score, old_score in zip((p1_scorebox, p2_scorebox),
+                                              scores, self.scores or scores):
+            if self.scores and score == old_score:
+                continue
+            score = get_score_char(score)
+            old_score = get_score_char(old_score)
+            area = scorebox.get_rect(score, DIGIT_BLOCK_SIZE)
+            if self.scores:
+                area.union_ip(scorebox.get_rect(old_score, DIGIT_BLOCK_SIZE))
+                self.layer.blit(self.background, area, area)
+            scorebox.draw_character(score, DIGIT_BLOCK_SIZE, self.layer)
+            screen.blit(self.layer, area, area)
+            changed.append(area)
+        self.scores = scores
+        return changed
+
+    def draw(self, rects, overlay=None):
+        """Draws the court with white objects on it and updates the display.
+
+            rects are the areas of the moving objects (paddles and balls)
+            overlay is an optional function that draws onto the layer"""
+        updates = []
+        if match is not self.match or overlay is not self.overlay:
+            # Nothing on screen can be reused, start over
+            self.layer.blit(self.background, (0, 0))
+            self.scores = None
+            self.draw_scores()
+            if overlay:
+                overlay(self.layer)
+            screen.blit(self.layer, (0, 0))
+            self.match = match
+            self.overlay = overlay
+        elif len(rects) > MAX_DIRTY_RECTS:
+            # Too many to keep track of, so redraw everything
+            self.draw_scores()
+            screen.blit(self.layer, (0, 0))
+        else:
+            # Erase the moving objects from last frame
+            for area in self.drawn:
+                screen.blit(self.layer, area, area)
+            updates.extend(self.drawn)
+            updates.extend(self.draw_scores())
+        self.drawn = [rect.copy() for rect in rects]
+        # Blitting is quicker than filling when there are lots of them
+        screen.blits([(self.get_block(area.size), area)
+                      for area in self.drawn], False)
+        if updates:
+            present(updates + self.drawn)
+        else:
+            present()
 
 
 # Functions
@@ -487,19 +605,11 @@ def set_icon(icon_file):
         print('Icon could not be loaded!')
 
 
-def load_sound(soundfile):
-    """Loads a sound file and returns a sound object."""
-    fullpath = os.path.join('Sounds', soundfile)  # For cross compatibility
-    try:
-        sound = pygame.mixer.Sound(fullpath)
-    except:
-        print('Sound file could not be loaded!')
-        # Make a dummy class so we don't need to do future error checking
-        class NoSound:
-            def play(self):
-                pass
-        sound = NoSound()
-    return sound
+def load_sound(soundfile, priority=0):
+    """Returns a sound object for a sound file, which plays once it has
+       loaded in the background. When too many sounds play at once, the
+       ones with the lowest priority are cut off."""
+    return sound_loader.load(soundfile, priority)
 
 
 def play_music(musicfile):
@@ -518,60 +628,159 @@ def play_music(musicfile):
 
 def create_window(width, height, title, icon=None):
     """Creates a new pygame window."""
-    # Lower the buffer size to remove sound lag
-    pygame.mixer.pre_init(buffer=512)
-    pygame.init()
+    # Only the display; the mixer and fonts start when first needed
+    pygame.display.init()
     set_icon(icon)
     screen = pygame.display.set_mode((width, height))
     pygame.display.set_caption(title)
     return screen
 
 
+def create_framebuffer(window, scale):
+    """Returns the surface the game is drawn on.
+
+        If scale is above 1 this is a separate surface, scale times smaller
+        than the window, which present() blows up; otherwise it is the
+        window itself."""
+    if scale == 1:
+        return window
+    size = (window.get_width() // scale, window.get_height() // scale)
+    return pygame.Surface(size).convert()
+
+
+def present(areas=None):
+    """Shows what was drawn on the screen in the window.
+
+        areas limits the update to parts of the screen; if none specified
+        the whole screen is updated."""
+    frame_profiler.lap('render')
+    if screen is window:
+        if areas is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(areas)
+        frame_profiler.lap('present')
+        return
+    # Plain integer scaling keeps every block sharp
+    if areas is None:
+        pygame.transform.scale(screen, window.get_size(), window)
+        pygame.display.flip()
+        frame_profiler.lap('present')
+        return
+    window_areas = []
+    for area in areas:
+        area = area.clip(screen.get_rect())
+        if not area.width or not area.height:
+            continue
+        window_area = pygame.Rect(area.x * window_scale, area.y * window_scale,
+                                  area.width * window_scale,
+                                  area.height * window_scale)
+        window.blit(pygame.transform.scale(screen.subsurface(area),
+                                           window_area.size), window_area)
+        window_areas.append(window_area)
+    pygame.display.update(window_areas)
+    frame_profiler.lap('present')
+
+
+def save_replay():
+    """Saves the replay of the current match, if there is one."""
+    global recorder
+    if not recorder or not recorder.inputs:
+        return
+    filename = time.strftime('%Y%m%d-%H%M%S') + '.plr'
+    try:
+        os.makedirs(REPLAY_DIR, exist_ok=True)
+        recorder.save(os.path.join(REPLAY_DIR, filename))
+    except OSError:
+        print('Replay could not be saved!')
+    recorder = None
+
+
+def save_profile():
+    """Saves the frame profiler's data as CSV and JSON."""
+    path = os.path.join(PROFILE_DIR, time.strftime('%Y%m%d-%H%M%S'))
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        frame_profiler.save_csv(path + '.csv')
+        frame_profiler.save_json(path + '.json')
+    except OSError:
+        print('Profile could not be saved!')
+
+
+def toggle_profiler():
+    """Shows or hides the frame profiler's HUD."""
+    global show_profiler
+    show_profiler = not show_profiler
+    # Get rid of the HUD if it was showing
+    court_renderer.invalidate()
+
+
 def quit_game():
     """Quits the game gracefully."""
+    save_replay()
+    if network:
+        network.close()
+    if broadcaster:
+        broadcaster.close()
+    if telemetry_log:
+        telemetry_log.close()
+    if search_ai:
+        search_ai.close()
     pygame.quit()
     sys.exit()
 
 
-def increase_score(player):
-    """Increases a player's score and resets the ball."""
-    # Probably a better solution than globals here.
-    global player1_score
-    global player2_score
-    if player1_score >= 9 and player == 1:
-        win_go()
-    elif player2_score >= 9 and player == 2:
-        game_over_go()
-    if player == 1:
-        player1_score += 1
-        playerscore_sfx.play()
-    elif player == 2:
-        player2_score += 1
-        aiscore_sfx.play()
-    ball.reset(player)
-
-
-def draw_barriers():
+def draw_barriers(surface):
     """Draws upper and lower barriers."""
     barrierup = pygame.Rect(BARRIER_X, BARRIER_OFFSET, BARRIER_WIDTH,
                             BARRIER_HEIGHT)
     barrierdown = pygame.Rect(BARRIER_X, SCREEN_HEIGHT - BARRIER_HEIGHT -
                               BARRIER_OFFSET, BARRIER_WIDTH, BARRIER_HEIGHT)
-    screen.fill(WHITE, barrierup)
-    screen.fill(WHITE, barrierdown)
+    surface.fill(WHITE, barrierup)
+    surface.fill(WHITE, barrierdown)
 
 
-def draw_net():
+def draw_net(surface):
     """Draws the tennis net down the center of the screen."""
     for y in range(NET_POS['y'], COURT_BOTTOM, NET_SQUARE_SIZE + NET_BUFFER):
         netsquare = (pygame.Rect(NET_POS['x'], y,
                      NET_SQUARE_SIZE, NET_SQUARE_SIZE))
-        screen.fill(WHITE, netsquare)
+        surface.fill(WHITE, netsquare)
+
+
+def get_score_char(score):
+    """Returns what to draw for a score. The winning score of a classic
+       match is drawn as '-'; multi-ball matches play to higher scores, so
+       theirs are drawn as numbers."""
+    if (score > simulation.MAX_SCORE and
+            not isinstance(match, multiball.MultiBallMatch)):
+        return '-'
+    return score
+
+
+def handle_match_events(events):
+    """Plays sounds and changes game state for events from the match."""
+    for event in events:
+        if (event.kind == simulation.WALL_HIT or
+                event.kind == multiball.BALL_HIT):
+            wallhit_sfx.play()
+        elif event.kind == simulation.PADDLE_HIT:
+            paddlehit_sfx.play()
+        elif event.kind == simulation.SCORE:
+            if event.player == local_player:
+                playerscore_sfx.play()
+            else:
+                aiscore_sfx.play()
+        elif event.kind == simulation.MATCH_OVER:
+            if event.player == local_player:
+                win_go()
+            else:
+                game_over_go()
 
 
 def handle_player_movement(event, player):
     """Handles all player movement."""
-    if player is player1:
+    if player is not player2:
         upkey = pygamevars.K_UP
         downkey = pygamevars.K_DOWN
     else:
@@ -601,18 +810,76 @@ def handle_player_movement(event, player):
             player.moving = 0
 
 
-def handle_AI():
-    """Handles paddle AI."""
-    # Have the paddle only move when ball is moving towards it
-    if ball.movex < 0:
-        player2.moving = 1
-    else:
-        player2.moving = 0
-    if ball.ball_rect.y > (player2.paddle_rect.y + PADDLE_HEIGHT +
-                           player2.movespeed):
-        player2.movespeed = player2.maxspeed
-    elif ball.ball_rect.y < (player2.paddle_rect.y - player2.movespeed):
-        player2.movespeed = -player2.maxspeed
+def get_steered_paddle(event):
+    """Returns the paddle a key event steers, or None."""
+    if event.type != pygamevars.KEYDOWN and event.type != pygamevars.KEYUP:
+        return None
+    if event.key == pygamevars.K_UP or event.key == pygamevars.K_DOWN:
+        return player1
+    if numplayers == 2 and (event.key == pygamevars.K_a or
+                            event.key == pygamevars.K_z):
+        return player2
+    return None
+
+
+def steer_paddles(tick_start):
+    """Steers the paddles by the key events seen before a tick ends, each
+       from the point in the tick it was seen at.
+
+        A paddle moves at its old speed up to that point, straight away,
+        and at its new speed for the rest of the tick, which the tick
+        itself does by moving it at a fraction of its speed. Both moves
+        are clamped like whole ones. Returns the paddles and the speeds to
+        put back, and clamp them again, once the tick is done."""
+    tick_end = tick_start + TICK_TIME / 1000
+    done = {}  # Pixels of the tick's movement each paddle has already made
+    while paddle_events and paddle_events[0][0] < tick_end:
+        seen, event = paddle_events.pop(0)
+        player = get_steered_paddle(event)
+        fraction = max(0, (seen - tick_start) * 1000 / TICK_TIME)
+        # To the nearest pixel the paddle can move
+        pixels = round(fraction * player.maxspeed)
+        if player.moving:
+            movespeed = player.movespeed
+            player.movespeed = pixels - done.get(player, 0)
+            if movespeed < 0:
+                player.movespeed = -player.movespeed
+            player.move()
+            player.clamp()
+            player.movespeed = movespeed
+        done[player] = pixels
+        handle_player_movement(event, player)
+        frame_profiler.latency.act(seen)
+    speeds = []
+    for player, pixels in done.items():
+        speeds.append((player, player.movespeed))
+        if player.movespeed < 0:
+            player.movespeed = pixels - player.maxspeed
+        else:
+            player.movespeed = player.maxspeed - pixels
+    return speeds
+
+
+def sample_input():
+    """Waits for the next frame, looking for input every INPUT_SAMPLE_TIME
+       meanwhile to see when it happened."""
+    global tick_lag, frame_start
+    deadline = frame_start + (1000 / FPS - INPUT_SAMPLE_TIME) / 1000
+    while time.perf_counter() < deadline:
+        now = time.perf_counter()
+        sampled_events.extend((now, event) for event in pygame.event.get())
+        time.sleep(INPUT_SAMPLE_TIME / 1000)
+    tick_lag += fps_clock.tick(FPS)
+    frame_start = time.perf_counter()
+
+
+def get_events():
+    """Returns every event since the last call, each with the
+       time.perf_counter() it was seen at."""
+    now = time.perf_counter()
+    events = sampled_events + [(now, event) for event in pygame.event.get()]
+    del sampled_events[:]
+    return events
 
 
 def pause_game():
@@ -621,6 +888,8 @@ def pause_game():
     game_state = PAUSED
     pygame.mixer.music.pause()
     pause_sfx.play()
+    if telemetry_log:
+        telemetry_log.record(match, telemetry.PAUSE)
 
 
 def unpause_game():
@@ -629,6 +898,8 @@ def unpause_game():
     game_state = PLAY
     pygame.mixer.music.unpause()
     unpause_sfx.play()
+    if telemetry_log:
+        telemetry_log.record(match, telemetry.UNPAUSE)
 
 
 def game_over_go():
@@ -637,6 +908,7 @@ def game_over_go():
     criticalerr_sfx.play()
     #pygame.mixer.music.fadeout(1000)
     game_state = GAMEOVER
+    save_replay()
 
 
 def win_go():
@@ -645,34 +917,32 @@ def win_go():
     victory_sfx.play()
     #pygame.mixer.music.fadeout(1000)
     game_state = WIN
+    save_replay()
 
 
-def draw_word(word, xpos, ypos, blocksize, charlen):
+def draw_word(word, xpos, ypos, blocksize, charlen, surface=None):
     """Converts a word into pixelated format."""
-    for x, char in enumerate(word):
-        if char.isdigit():
-            char = int(char)
-        if char == 10:
-            char = '-'
-        pixelchar = PixelChar(xpos + (x * (blocksize *
-                             (charlen + 1))),
-                              ypos)
-        pixelchar.draw_character(char, blocksize)
+    if surface is None:
+        surface = screen
+    surface.blit(PixelChar.get_word(word, blocksize, charlen), (xpos, ypos))
 
 
-def draw_menu_pointer():
-    """Draws the menu option pointer."""
+def flash_menu_pointer():
+    """Flashes the menu option pointer."""
     # Code for flashing is inelegant and doesn't really work for any number
     # besides 5. But it gets the job done.
     global pntrflash
-    if game_state == TRANS:
-        if (pygame.time.get_ticks() % 5) == 0:
-            if pntrflash:
-                pntrflash = 0
-            else:
-                pntrflash = 1
+    if (pygame.time.get_ticks() % 5) == 0:
         if pntrflash:
-            return
+            pntrflash = 0
+        else:
+            pntrflash = 1
+
+
+def draw_menu_pointer():
+    """Draws the menu option pointer."""
+    if game_state == TRANS and pntrflash:
+        return
     xpos = OPTIONS_POS['x'] - 30
     ypos = (OPTIONS_POS['y'] + ((LETTER_HEIGHT + OPTIONS_BUFFER) *
             menu_pointer * OPTIONS_BLOCK_SIZE))
@@ -700,70 +970,128 @@ def play_game():
     game_state = TRANS
 
 
+def get_moving_rects():
+    """Returns the rects of the paddles and ball; the balls of a multi-ball
+       match are kept apart, see interpolate_rects()."""
+    if ball_count > 1:
+        return [player1.paddle_rect, player2.paddle_rect]
+    return [player1.paddle_rect, ball.ball_rect, player2.paddle_rect]
+
+
+def remember_positions():
+    """Remembers where the paddles and ball are before a tick."""
+    global last_positions, last_balls
+    last_positions = [rect.topleft for rect in get_moving_rects()]
+    if ball_count > 1:
+        last_balls = (match.balls.x.copy(), match.balls.y.copy())
+
+
+def interpolate_rects(alpha):
+    """Returns the rects of the paddles and ball as they are alpha of the
+       way from their positions before the last tick to their current ones.
+
+        Player 1's paddle is always first and player 2's last."""
+    rects = []
+    for rect, (lastx, lasty) in zip(get_moving_rects(), last_positions):
+        rects.append(pygame.Rect(lastx + round((rect.x - lastx) * alpha),
+                                 lasty + round((rect.y - lasty) * alpha),
+                                 rect.width, rect.height))
+    if ball_count > 1:
+        rects[1:1] = match.balls.get_rects(last_balls[0], last_balls[1],
+                                           alpha)
+    return rects
+
+
+def report_desync():
+    """Says that the network match went out of sync, once a match."""
+    global desync_reported
+    desync_reported = True
+    print('Network match went out of sync at tick {}{}'.format(
+        session.desync_tick, '' if fixed_point else
+        ' (--fixed-point on both sides keeps different machines in sync)'))
+
+
 def game_state_play():
     """What to do when game_state = PLAY"""
     play_music('music.ogg')
-    screen.fill(BG_COLOR)
-    draw_barriers()
-    draw_net()
-    if numplayers == 1:
-        handle_AI()
-    player1.update()
-    ball.move()
-    p1_scorebox.draw_character(player1_score, DIGIT_BLOCK_SIZE)
-    player2.update()
-    p2_scorebox.draw_character(player2_score, DIGIT_BLOCK_SIZE)
-    #fps_counter.update()  # Uncomment this if you want an FPS counter
-    pygame.display.flip()
-
-
-def draw_gameover():
+    remember_positions()
+    if recorder:
+        recorder.record()
+    if session:
+        network.poll(session)
+        events = session.advance(simulation.get_direction(net_keys))
+        if events is None:
+            return  # Waiting to hear from the other side
+        if session.desync_tick is not None and not desync_reported:
+            report_desync()
+    else:
+        events = match.step()
+    if telemetry_log:
+        telemetry_log.record_events(match, events)
+    handle_match_events(events)
+    # Online a point is only handed out once it can't be rolled back, some
+    # ticks after the serve, so look for a serve on every tick
+    if session or any(event.kind == simulation.SCORE for event in events):
+        # The ball was put back in play, so don't slide it across the court
+        if ball_count == 1:
+            lastx = last_positions[1][0]
+            if abs(ball.ball_rect.x - lastx) > SCREEN_WIDTH / 2:
+                last_positions[1] = ball.ball_rect.topleft
+        else:
+            lastx, lasty = last_balls
+            served = abs(match.balls.x - lastx) > SCREEN_WIDTH / 2
+            lastx[served] = match.balls.x[served]
+            lasty[served] = match.balls.y[served]
+
+
+def draw_gameover(surface=None):
     """Gameover message."""
-    draw_word('YOU LOSE', 485, 200, 10, LETTER_LENGTH)
-    draw_word('PRESS SPACE', 520, 280, 6, LETTER_LENGTH)
+    draw_word('YOU LOSE', 485, 200, 10, LETTER_LENGTH, surface)
+    draw_word('PRESS SPACE', 520, 280, 6, LETTER_LENGTH, surface)
 
 
-def draw_win():
+def draw_win(surface=None):
     """Win message."""
-    draw_word('YOU WIN', 485, 200, 10, LETTER_LENGTH)
-    draw_word('PRESS SPACE', 520, 280, 6, LETTER_LENGTH)
+    draw_word('YOU WIN', 485, 200, 10, LETTER_LENGTH, surface)
+    draw_word('PRESS SPACE', 520, 280, 6, LETTER_LENGTH, surface)
+
+
+def finish_match():
+    """Keeps the game going on the screens after a match."""
+    remember_positions()
+    if session:
+        # The match is shared with the other side, so leave it alone and
+        # keep sending inputs until they know the match is over too
+        network.poll(session)
+        session.send_inputs()
+    else:
+        player1.update()
+        player2.update()
 
 
 def game_state_gameover():
     """Gameover state."""
-    screen.fill(BG_COLOR)
-    draw_barriers()
-    draw_net()
-    player1.update()
-    player2.update()
-    p1_scorebox.draw_character(player1_score, DIGIT_BLOCK_SIZE)
-    p2_scorebox.draw_character(player2_score, DIGIT_BLOCK_SIZE)
-    draw_gameover()
-    pygame.display.flip()
+    finish_match()
 
 
 def game_state_win():
-    """Gameover state."""
-    screen.fill(BG_COLOR)
-    draw_barriers()
-    draw_net()
-    player1.update()
-    player2.update()
-    p1_scorebox.draw_character(player1_score, DIGIT_BLOCK_SIZE)
-    p2_scorebox.draw_character(player2_score, DIGIT_BLOCK_SIZE)
-    draw_win()
-    pygame.display.flip()
+    """Win state."""
+    finish_match()
+
+
+def grow_title_line():
+    """Widens the line under the menu title until it is full length."""
+    global titleline_width
+    if titleline_width < TITLE_LINE_WIDTH:
+        titleline_width += 10
 
 
 def draw_title_line():
     """Draws the line under the menu title."""
-    global titleline_width
     # Magic numbers... I know. My lack of forethought is biting me in the ass
     underline = pygame.Rect((TITLE_POS['x'] + 190) - (titleline_width / 2),
                              TITLE_POS['y'] + 140, titleline_width, 5)
     screen.fill(WHITE, underline)
-    if titleline_width < 420:
-        titleline_width += 10
 
 
 def draw_credits():
@@ -780,7 +1108,7 @@ def draw_menu():
     show_menu_options()
     draw_menu_pointer()
     draw_credits()
-    pygame.display.flip()
+    present()
 
 
 def go_to_menu():
@@ -788,27 +1116,28 @@ def go_to_menu():
     global game_state
     pygame.mixer.music.stop()
     game_state = MENU
+    save_replay()
 
 
 def game_state_menu():
     """What to do when game_state = MENU"""
     play_music('mainmenu.ogg')
-    draw_menu()
+    grow_title_line()
 
 
 def game_state_transition():
     """Transition between the menu and the game."""
     global game_state
+    grow_title_line()
+    flash_menu_pointer()
     pygame.mixer.music.fadeout(2000)
     if not pygame.mixer.music.get_busy():
         reset_game(numplayers)
         game_state = PLAY
-    draw_menu()
 
 
-def game_loop():
-    """The game loop."""
-    handle_input()
+def update_game():
+    """Advances the game by one tick."""
     if game_state == MENU:
         game_state_menu()
     elif game_state == TRANS:
@@ -819,45 +1148,203 @@ def game_loop():
         game_state_gameover()
     elif game_state == WIN:
         game_state_win()
-    fps_clock.tick(FPS)
+    # Spectators only see matches with one ball
+    if broadcaster and ball_count == 1 and (
+            game_state == PLAY or game_state == GAMEOVER or
+            game_state == WIN):
+        broadcaster.publish(match)
+
+
+def draw_game(alpha):
+    """Draws a frame.
+
+        alpha is how far the frame is between the last tick and the next,
+        from 0 to 1; moving objects are drawn that far along."""
+    if game_state == MENU or game_state == TRANS:
+        draw_menu()
+    elif game_state == PLAY:
+        court_renderer.draw(interpolate_rects(alpha))
+        #fps_counter.update()  # Uncomment this if you want an FPS counter
+    elif game_state == GAMEOVER or game_state == WIN:
+        rects = interpolate_rects(alpha)
+        if game_state == GAMEOVER:
+            overlay = draw_gameover
+        else:
+            overlay = draw_win
+        court_renderer.draw([rects[0], rects[-1]], overlay)
+
+
+def get_idle_view():
+    """Returns what is on screen if nothing can change it until an event
+       comes, such as the menu once its title line has grown; None if it is
+       still moving.
+
+        Two views are equal only if the screen looks the same."""
+    if show_profiler:
+        return None  # The HUD keeps changing
+    if game_state == PAUSED:
+        return (PAUSED,)
+    if game_state == MENU and titleline_width >= TITLE_LINE_WIDTH:
+        return (MENU, menu_pointer, tuple(menu_options))
+    # Spectators are sent every tick of a match, even once it has ended
+    if (game_state == GAMEOVER or game_state == WIN) and not broadcaster:
+        positions = [rect.topleft for rect in get_moving_rects()]
+        if positions == last_positions:
+            return (game_state, tuple(positions))
+    return None
+
+
+def wait_for_event():
+    """Sleeps until an event comes, or IDLE_TIMEOUT passes, keeping the
+       event for get_events()."""
+    event = pygame.event.wait(IDLE_TIMEOUT)
+    if event.type != pygamevars.NOEVENT:
+        sampled_events.append((time.perf_counter(), event))
+
+
+def update_ticks(tick_start):
+    """Updates the game a tick at a time until it has caught up.
+
+        tick_start is the time.perf_counter() that the game time which
+        hasn't been updated yet began at."""
+    global tick_lag
+    while tick_lag >= TICK_TIME:
+        if game_state == PLAY and precise_input and not session:
+            speeds = steer_paddles(tick_start)
+            update_game()
+            for player, movespeed in speeds:
+                player.movespeed = movespeed
+                player.clamp()
+        else:
+            if game_state == PLAY:
+                frame_profiler.latency.act()
+            update_game()
+        tick_lag -= TICK_TIME
+        tick_start += TICK_TIME / 1000
+
+
+def game_loop():
+    """The game loop.
+
+       The game is updated TICK_RATE times a second, separately from how
+       often frames are drawn, so it plays the same at any frame rate. While
+       nothing on screen can change, see get_idle_view(), the loop sleeps
+       until an event comes rather than drawing the same frame over again,
+       and only draws once something has changed."""
+    global tick_lag, frame_start, idle_view
+    if idle_view is not None:
+        wait_for_event()
+        frame_profiler.skip()  # Sleeping isn't part of any frame
+        # The time slept went by on the screen it was slept on, so play it
+        # there before handling the event that woke the game
+        tick_lag = min(tick_lag + fps_clock.tick(), MAX_TICKS * TICK_TIME)
+        update_ticks(time.perf_counter() - tick_lag / 1000)
+        frame_start = time.perf_counter()
+    elif precise_input:
+        sample_input()
+    else:
+        tick_lag += fps_clock.tick(FPS)
+    frame_profiler.lap('wait')
+    # After a long stall, skip ahead rather than fast forwarding through it
+    tick_lag = min(tick_lag, MAX_TICKS * TICK_TIME)
+    # When the game time that hasn't been updated yet began
+    tick_start = time.perf_counter() - tick_lag / 1000
+    handle_input()
+    frame_profiler.lap('input')
+    update_ticks(tick_start)
+    voice_pool.dispatch()
+    frame_profiler.lap('update')
+    if idle_view is None or get_idle_view() != idle_view:
+        draw_game(tick_lag / TICK_TIME)
+        if show_profiler:
+            present([profiler_hud.draw(screen)])
+        frame_profiler.latency.present()
+        idle_view = get_idle_view()
+    frame_profiler.end_frame()
 
 
 def reset_game(playersnum=1):
     """Resets all variables for the game."""
     # Yeah, I know. I blame feature creep and lack of understanding how
     # quickly organization would become a problem.
-    global menu_options, game_state, menu_pointer, player1_score
-    global player2_score, numplayers, player1, player2, ball
+    global menu_options, game_state, menu_pointer, match
+    global numplayers, player1, player2, ball, recorder, session, net_keys
     global p1_scorebox, p2_scorebox, pntrflash, titleline_width
-    menu_options = ['1 PLAYER', '2 PLAYER']
+    global desync_reported
+    if network:
+        menu_options = ['1 PLAYER', 'NETWORK']
+    else:
+        menu_options = ['1 PLAYER', '2 PLAYER']
     game_state = MENU
     menu_pointer = 0
-    player1_score = 0
-    player2_score = 0
     numplayers = playersnum
-    player1 = Paddle(PADDLE1_POS['x'], PADDLE1_POS['y'])
-    if numplayers == 1:
-        player2 = Paddle(PADDLE2_POS['x'], PADDLE2_POS['y'], maxspeed=8)
+    if search_ai:
+        ai = search_ai
+    elif AI_DIFFICULTY:
+        ai = simulation.InterceptAI.from_difficulty(AI_DIFFICULTY)
+    else:
+        ai = None
+    if network and numplayers == 2:
+        # The other paddle is steered from across the network, and the keys
+        # steer this one rather than the match's paddle, which gets rolled
+        # back whenever the other side's inputs turn up late
+        network.clear()
+        session = netplay.RollbackSession(local_player, network.send,
+                                          fixed=fixed_point)
+        desync_reported = False
+        match = session.match
+        net_keys = simulation.Paddle(0, 0)
+    elif ball_count > 1:
+        session = None
+        match = multiball.MultiBallMatch(ball_count, numplayers, ai=ai)
     else:
-        player2 = Paddle(PADDLE2_POS['x'], PADDLE2_POS['y'])
-    ball = Ball()
+        session = None
+        match = simulation.Match(numplayers, ai=ai, fixed=fixed_point)
+    # Shortcuts to the match objects, used for input and drawing
+    player1 = match.player1
+    player2 = match.player2
+    ball = match.ball
+    # Replays only hold one ball matches steered a whole tick at a time, by
+    # inputs that play back the same. They are played back against the
+    # classic computer player; the others pick moves at random or by timing
+    if (RECORD_REPLAYS and not session and not precise_input and
+            ball_count == 1 and ai is None):
+        recorder = replay.Recorder(match)
+    else:
+        recorder = None
+    del paddle_events[:]
     p1_scorebox = PixelChar(P1_SCOREPOS['x'], P1_SCOREPOS['y'])
-    p2_scorebox = PixelChar(P2_SCOREPOS['x'], P2_SCOREPOS['y'])
+    p2_scorebox = PixelChar(P2_SCOREPOS['x'], P2_SCOREPOS['y'], True)
     pntrflash = 1
     titleline_width = 5
+    remember_positions()
 
 
 def handle_input():
     """Handles all user input."""
     global menu_pointer
     global game_state
-    for event in pygame.event.get():
+    global idle_view
+    for seen, event in get_events():
         if event.type == pygamevars.QUIT:
             quit_game()
+        elif event.type == pygamevars.VIDEOEXPOSE:
+            # The window contents were lost, so redraw everything
+            court_renderer.invalidate()
+            idle_view = None
         elif event.type == pygamevars.KEYDOWN:
             if event.key == pygamevars.K_ESCAPE:
                 go_to_menu()
-        if game_state == PLAY or game_state == PAUSED:
+            elif event.key == pygamevars.K_F3:
+                toggle_profiler()
+            elif event.key == pygamevars.K_F4:
+                save_profile()
+        if game_state == PLAY and get_steered_paddle(event):
+            frame_profiler.latency.press(seen)
+        if session and game_state == PLAY:
+            # The other side can't be paused
+            handle_player_movement(event, net_keys)
+        elif game_state == PLAY or game_state == PAUSED:
             if event.type == pygamevars.KEYDOWN:
                 if (event.key == pygamevars.K_p or
                         event.key == pygamevars.K_SPACE):
@@ -865,9 +1352,14 @@ def handle_input():
                         pause_game()
                     else:
                         unpause_game()
-            handle_player_movement(event, player1)
-            if numplayers == 2:
-                handle_player_movement(event, player2)
+            if precise_input:
+                # Played at the point in the tick they were seen
+                if get_steered_paddle(event):
+                    paddle_events.append((seen, event))
+            else:
+                handle_player_movement(event, player1)
+                if numplayers == 2:
+                    handle_player_movement(event, player2)
         elif game_state == MENU:
             if event.type == pygamevars.KEYDOWN:
                 if event.key == pygamevars.K_DOWN:
@@ -889,28 +1381,158 @@ def handle_input():
                     game_state = PLAY
 
 
-# Initialize display and FPS clock
-screen = create_window(SCREEN_WIDTH, SCREEN_HEIGHT,
-                       WINDOW_TITLE, 'pong_icon.png')
-fps_clock = pygame.time.Clock()
-fps_counter = FPSCounter(FPSCOUNT_POS['x'], FPSCOUNT_POS['y'])
-
-#Load sounds
-paddlehit_sfx = load_sound('paddlehit.wav')
-wallhit_sfx = load_sound('wallhit.wav')
-aiscore_sfx = load_sound('aiscore.wav')
-playerscore_sfx = load_sound('playerscore.wav')
-pause_sfx = load_sound('pause.wav')
-unpause_sfx = load_sound('unpause.wav')
-menumove_sfx = load_sound('menumove.wav')
-menuselect_sfx = load_sound('menuselect.wav')
-criticalerr_sfx = load_sound('criticalerror.wav')  # Just for fun
-victory_sfx = load_sound('victory.wav')  # Just for fun
-
-
-# Set everything up
-reset_game()
+def get_parser():
+    """Returns the parser for the game's command line."""
+    parser = argparse.ArgumentParser(description=WINDOW_TITLE)
+    netplay.add_arguments(parser)
+    parser.add_argument('--spectate', type=int, metavar='PORT',
+                        help='stream matches to spectators on this port')
+    parser.add_argument('--scale', type=int, default=WINDOW_SCALE,
+                        metavar='N',
+                        help='make the window N times bigger; the game is '
+                             'still drawn at the same size, then blown up '
+                             '(default %(default)s)')
+    parser.add_argument('--no-sound-bundle', action='store_true',
+                        help='load the sound files rather than the sound '
+                             'bundle')
+    parser.add_argument('--balls', type=int, default=1,
+                        help='play with this many balls at once; not over '
+                             'the network')
+    parser.add_argument('--telemetry', metavar='FILE',
+                        help='record every hit, score and pause to FILE; '
+                             'SQLite if it ends in .db or .sqlite, JSON '
+                             'lines if not. With --balls, without speeds '
+                             'or rallies')
+    parser.add_argument('--fixed-point', action='store_true',
+                        help='play with fixed-point physics, which give the '
+                             'same results on every machine')
+    parser.add_argument('--search-ai', type=float, nargs='?',
+                        const=lookahead.SEARCH_TIME, metavar='MS',
+                        help='play 1 player matches against a computer that '
+                             'searches ahead, for MS milliseconds a decision '
+                             '(default %(const)s)')
+    parser.add_argument('--precise-input', action='store_true',
+                        help='look for input more often and steer the '
+                             'paddles from the point in a tick each key was '
+                             'pressed at')
+    parser.add_argument('--time-startup', action='store_true',
+                        help='say when the first frame is drawn and the '
+                             'sounds are loaded, then quit')
+    return parser
+
+
+def load_sounds(no_bundle=False):
+    """Starts loading the sound effects; they finish in the background."""
+    global voice_pool, sound_loader, paddlehit_sfx, wallhit_sfx, aiscore_sfx
+    global playerscore_sfx, pause_sfx, unpause_sfx, menumove_sfx
+    global menuselect_sfx, criticalerr_sfx, victory_sfx
+    voice_pool = sounds.VoicePool()
+    if no_bundle:
+        sound_loader = sounds.SoundLoader(None, voice_pool)
+    else:
+        sound_loader = sounds.SoundLoader(voices=voice_pool)
+    paddlehit_sfx = load_sound('paddlehit.wav', HIT_PRIORITY)
+    wallhit_sfx = load_sound('wallhit.wav', WALL_PRIORITY)
+    aiscore_sfx = load_sound('aiscore.wav', SCORE_PRIORITY)
+    playerscore_sfx = load_sound('playerscore.wav', SCORE_PRIORITY)
+    pause_sfx = load_sound('pause.wav', MENU_PRIORITY)
+    unpause_sfx = load_sound('unpause.wav', MENU_PRIORITY)
+    menumove_sfx = load_sound('menumove.wav', MENU_PRIORITY)
+    menuselect_sfx = load_sound('menuselect.wav', MENU_PRIORITY)
+    # Just for fun
+    criticalerr_sfx = load_sound('criticalerror.wav', MATCH_OVER_PRIORITY)
+    victory_sfx = load_sound('victory.wav', MATCH_OVER_PRIORITY)
+    sound_loader.finish()
+
+
+def setup(argv=None):
+    """Reads the command line, opens the window and loads the sounds, so
+       the game is ready to play without starting it.
+
+        argv is the command line without the program's name; sys.argv if
+        None. Importing the game does none of this, so the rest of it can
+        be used without a window."""
+    global args, network, local_player, precise_input, ball_count, fixed_point
+    global broadcaster, telemetry_log, window, screen, fps_clock
+    global frame_profiler, profiler_hud, frame_start, fps_counter
+    global court_renderer, search_ai, window_scale
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.scale < 1:
+        parser.error('--scale must be at least 1')
+    # Rollback sessions only play one ball matches
+    if args.balls > 1 and (args.host is not None or args.join):
+        parser.error('--balls only works for matches on this machine, not '
+                     'with --host or --join')
+    # Start the network if asked to play over one or stream to spectators
+    network, local_player = netplay.from_arguments(args)
+    precise_input = args.precise_input
+    ball_count = args.balls
+    fixed_point = args.fixed_point
+    if args.spectate:
+        broadcaster = spectate.Broadcaster(args.spectate)
+    else:
+        broadcaster = None
+    if args.telemetry:
+        telemetry_log = telemetry.open_telemetry(args.telemetry)
+    else:
+        telemetry_log = None
+    if args.search_ai:
+        search_ai = lookahead.SearchAI(args.search_ai)
+    else:
+        search_ai = None
+
+    # Initialize display and FPS clock
+    window_scale = args.scale
+    window = create_window(SCREEN_WIDTH * window_scale,
+                           SCREEN_HEIGHT * window_scale,
+                           WINDOW_TITLE, 'pong_icon.png')
+    screen = create_framebuffer(window, window_scale)
+    fps_clock = pygame.time.Clock()
+    frame_profiler = profiler.FrameProfiler()
+    profiler_hud = profiler.ProfilerHUD(frame_profiler, PROFILER_POS['x'],
+                                       PROFILER_POS['y'])
+    if search_ai:
+        profiler_hud.sources.append(search_ai.describe)
+    frame_start = time.perf_counter()
+    fps_counter = FPSCounter(FPSCOUNT_POS['x'], FPSCOUNT_POS['y'])
+    court_renderer = CourtRenderer()
+
+    load_sounds(args.no_sound_bundle)
+
+    # Set everything up
+    reset_game()
+
+
+def main(argv=None):
+    """Starts the game."""
+    setup(argv)
+    if args.time_startup:
+        game_loop()
+        print('first frame', flush=True)
+        sound_loader.loaded.wait()
+        print('sounds loaded', flush=True)
+        quit_game()
+    while 1:
+        game_loop()
+
+
+# State of the game loop, besides what setup() and reset_game() set up
+network = None
+broadcaster = None
+telemetry_log = None
+search_ai = None
+desync_reported = False
+precise_input = False
+ball_count = 1
+fixed_point = False
+window_scale = WINDOW_SCALE
+show_profiler = False  # F3 shows the HUD, F4 saves the data
+tick_lag = 0  # Milliseconds of game time that haven't been updated yet
+sampled_events = []  # (time seen, event) caught while waiting for a frame
+paddle_events = []  # (time seen, key event) to steer the paddles with
+idle_view = None  # What is on screen while the game loop sleeps
 
 # Main Loop
-while 1:
-    game_loop()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Profiler
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""Times every frame of the game, phase by phase.
+
+The game loop calls lap() after each part of a frame, naming the part that
+just finished, and end_frame() at the end. The last FRAMES frames are kept
+in a ring buffer, which costs next to nothing, so the profiler can always be
+on: when a frame spikes, the frames around it are still there to look at on
+the HUD or to export as CSV or JSON.
+
+It also keeps how long inputs take to show on screen: from when the game
+first sees a key event, through the tick that acts on it, to the end of the
+first frame presented after that tick.
+"""
+
+import array
+import csv
+import json
+import time
+import pygame
+
+FRAMES = 600  # Frames kept
+LATENCY_SAMPLES = 200  # Input latencies kept
+PHASES = ('wait', 'input', 'update', 'render', 'present')
+PERCENTILES = (50, 95, 99)
+HUD_REFRESH = 0.5  # Seconds between updates of the HUD's numbers
+HUD_SIZE = {'width': 310, 'height': 100}
+HUD_COLOR = (200, 200, 200)
+HUD_BG_COLOR = (30, 30, 30)
+SPARK_COLOR = (90, 200, 90)
+SPIKE_COLOR = (220, 70, 70)
+SPIKE_TIME = 1000 / 60  # Frames slower than this show red on the sparkline
+
+
+def get_percentiles(values):
+    """Returns the PERCENTILES and maximum of some values."""
+    values = sorted(values)
+    if not values:
+        return [0.0] * (len(PERCENTILES) + 1)
+    return ([values[min(len(values) - 1, len(values) * percent // 100)]
+             for percent in PERCENTILES] + [values[-1]])
+
+
+def get_summary(values):
+    """Returns the PERCENTILES and maximum of some values by name."""
+    names = ['p{}'.format(percent) for percent in PERCENTILES] + ['max']
+    return dict(zip(names, get_percentiles(values)))
+
+
+class RingBuffer:
+    """Keeps the last few of a series of numbers."""
+    def __init__(self, size):
+        self.values = array.array('d', bytes(8 * size))
+        self.count = 0  # Numbers added ever
+
+    def append(self, value):
+        """Adds a number, pushing out the oldest if full."""
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    def __len__(self):
+        """The number of numbers kept."""
+        return min(self.count, len(self.values))
+
+    def get_values(self):
+        """Returns the numbers kept, oldest first."""
+        if self.count <= len(self.values):
+            return list(self.values[:self.count])
+        index = self.count % len(self.values)
+        return list(self.values[index:]) + list(self.values[:index])
+
+
+class LatencyTracker:
+    """Measures how long inputs take to show on screen, in milliseconds."""
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.latencies = RingBuffer(samples)
+        self.waiting = []  # When inputs not acted on yet were seen
+        self.acted = []  # When inputs acted on but not shown yet were seen
+
+    def press(self, seen):
+        """Notes an input seen at a time from time.perf_counter()."""
+        self.waiting.append(seen)
+
+    def act(self, until=None):
+        """Notes that a tick acted on the inputs seen up to a time; all of
+           them if None."""
+        if until is None:
+            self.acted += self.waiting
+            self.waiting = []
+        else:
+            self.acted += [seen for seen in self.waiting if seen <= until]
+            self.waiting = [seen for seen in self.waiting if seen > until]
+
+    def present(self):
+        """Notes that a frame showing the inputs acted on was presented."""
+        now = time.perf_counter()
+        for seen in self.acted:
+            self.latencies.append((now - seen) * 1000)
+        self.acted = []
+
+
+class FrameProfiler:
+    """Keeps how long each phase of the last few frames took."""
+    def __init__(self, frames=FRAMES, phases=PHASES):
+        self.frames = frames
+        self.phases = phases
+        # Milliseconds, a ring buffer per phase
+        self.times = {phase: RingBuffer(frames) for phase in phases}
+        self.totals = RingBuffer(frames)
+        self.current = dict.fromkeys(phases, 0.0)
+        self.last_lap = time.perf_counter()
+        self.latency = LatencyTracker()
+
+    def lap(self, phase):
+        """Counts the time since the last lap towards a phase of this
+           frame."""
+        now = time.perf_counter()
+        self.current[phase] += (now - self.last_lap) * 1000
+        self.last_lap = now
+
+    def skip(self):
+        """Leaves the time since the last lap out of every phase."""
+        self.last_lap = time.perf_counter()
+
+    def end_frame(self):
+        """Stores this frame's times and starts the next frame."""
+        total = 0.0
+        for phase, elapsed in self.current.items():
+            self.times[phase].append(elapsed)
+            total += elapsed
+            self.current[phase] = 0.0
+        self.totals.append(total)
+
+    def __len__(self):
+        """The number of frames kept."""
+        return len(self.totals)
+
+    def get_times(self, phase=None):
+        """Returns the times of a phase, or the whole frame if None, oldest
+           first."""
+        if phase is None:
+            return self.totals.get_values()
+        return self.times[phase].get_values()
+
+    def get_percentiles(self, phase=None):
+        """Returns the PERCENTILES and maximum of a phase, or the whole
+           frame if None."""
+        return get_percentiles(self.get_times(phase))
+
+    def get_summary(self):
+        """Returns the percentiles of every phase, the whole frame and input
+           latency."""
+        summary = {}
+        for phase in (None,) + tuple(self.phases):
+            summary[phase or 'frame'] = get_summary(self.get_times(phase))
+        summary['input_latency'] = get_summary(
+            self.latency.latencies.get_values())
+        return summary
+
+    def get_rows(self):
+        """Returns every frame kept as a row of phase times."""
+        first = self.totals.count - len(self)
+        columns = [self.get_times(phase) for phase in self.phases]
+        columns.append(self.get_times())
+        return [[first + row] + [column[row] for column in columns]
+                for row in range(len(self))]
+
+    def save_csv(self, path):
+        """Writes the frames kept to a CSV file, in milliseconds."""
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['frame'] + list(self.phases) + ['total'])
+            writer.writerows(self.get_rows())
+
+    def save_json(self, path):
+        """Writes the frames kept, the input latencies kept and their
+           percentiles to a JSON file."""
+        with open(path, 'w') as json_file:
+            json.dump({'phases': list(self.phases) + ['total'],
+                       'summary': self.get_summary(),
+                       'frames': self.get_rows(),
+                       'input_latency': self.latency.latencies.get_values()},
+                      json_file)
+
+
+class ProfilerHUD:
+    """Draws frame time percentiles and a sparkline of recent frames.
+
+       Anything else worth watching can add a function to sources that
+       returns a line of text, which is shown under the frame times."""
+    def __init__(self, profiler, xpos, ypos):
+        """profiler: the FrameProfiler to show
+           xpos, ypos: where the HUD's top left corner goes"""
+        self.profiler = profiler
+        self.rect = pygame.Rect(xpos, ypos, HUD_SIZE['width'],
+                                HUD_SIZE['height'])
+        self.font = None  # Loaded when the HUD is first shown
+        self.lines = []
+        self.sources = []
+        self.refreshed = 0.0
+
+    def refresh(self):
+        """Renders the numbers again."""
+        if self.font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            self.font = pygame.font.Font(None, 16)
+        p50, p95, p99, most = self.profiler.get_percentiles()
+        latency = get_percentiles(self.profiler.latency.latencies.get_values())
+        texts = ['frame ms  p50 {:.1f}  p95 {:.1f}  p99 {:.1f}  max {:.1f}'
+                 .format(p50, p95, p99, most),
+                 'p95  ' + '  '.join(
+                     '{} {:.2f}'.format(phase,
+                                        self.profiler.get_percentiles(phase)[1])
+                     for phase in self.profiler.phases if phase != 'wait'),
+                 'input latency ms  p50 {:.1f}  p95 {:.1f}  max {:.1f}'.format(
+                     latency[0], latency[1], latency[-1])]
+        texts.extend(source() for source in self.sources)
+        self.lines = [self.font.render(text, True, HUD_COLOR, HUD_BG_COLOR)
+                      for text in texts]
+        self.refreshed = time.perf_counter()
+
+    def draw(self, surface):
+        """Draws the HUD and returns the area it covers."""
+        if time.perf_counter() - self.refreshed > HUD_REFRESH:
+            self.refresh()
+        surface.fill(HUD_BG_COLOR, self.rect)
+        y = self.rect.y + 4
+        for line in self.lines:
+            surface.blit(line, (self.rect.x + 4, y))
+            y += line.get_height() + 2
+        # A bar per frame, as many as fit, the newest on the right
+        bottom = self.rect.bottom - 4
+        height = bottom - y - 2
+        times = self.profiler.get_times()[-(self.rect.width - 8):]
+        x = self.rect.right - 4 - len(times)
+        for frame_time in times:
+            bar = min(height, max(1, int(frame_time / (SPIKE_TIME * 2) *
+                                         height)))
+            color = SPIKE_COLOR if frame_time > SPIKE_TIME else SPARK_COLOR
+            surface.fill(color, (x, bottom - bar, 1, bar))
+            x += 1
+        return self.rect
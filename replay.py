@@ -0,0 +1,260 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Replays
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""Records matches as paddle inputs and plays them back.
+
+A replay stores one byte per tick: two bits of input for each paddle. Every
+KEYFRAME_INTERVAL ticks the whole match state is stored as well, so playback
+can jump to any point by restoring the closest keyframe before it and
+simulating only the ticks in between. Playback is headless, so a match plays
+back many times faster than real time.
+
+Run this file with a replay to check it plays back cleanly:
+    python3 replay.py Replays/somematch.plr [tick]
+or with --selftest to record matches and check they play back the same:
+    python3 replay.py --selftest
+"""
+
+import argparse
+import bisect
+import random
+import struct
+import sys
+import time
+import zlib
+import simulation
+
+MAGIC = b'PLRP'
+VERSION = 1
+KEYFRAME_INTERVAL = simulation.TICK_RATE * 10  # Every ten seconds
+
+# Two bits per paddle; a paddle steered by the computer is recorded as AI
+INPUT_CODES = {simulation.STOP: 0, simulation.UP: 1, simulation.DOWN: 2,
+               None: 3}
+INPUT_DIRECTIONS = {code: direction
+                    for direction, code in INPUT_CODES.items()}
+
+# Version, number of players, flags, input count and keyframe count
+HEADER = struct.Struct('<4sBBBII')
+SWEPT_FLAG = 1
+FIXED_FLAG = 2
+# A keyframe is a tick number followed by simulation.Match.get_state()
+KEYFRAME = struct.Struct('<IIHHBdddddhBhhhBhh')
+
+
+def encode_inputs(inputs):
+    """Packs a pair of paddle directions into a byte."""
+    return INPUT_CODES[inputs[0]] | (INPUT_CODES[inputs[1]] << 2)
+
+
+def decode_inputs(byte):
+    """Unpacks a byte into a pair of paddle directions."""
+    return (INPUT_DIRECTIONS[byte & 3], INPUT_DIRECTIONS[(byte >> 2) & 3])
+
+
+class Recorder:
+    """Records a match as it is played."""
+    def __init__(self, match, keyframe_interval=KEYFRAME_INTERVAL):
+        """match: the match to record, from its current tick on"""
+        self.match = match
+        self.keyframe_interval = keyframe_interval
+        self.inputs = bytearray()
+        self.keyframes = []
+
+    def record(self):
+        """Records the paddle inputs for the tick about to be played.
+
+            Call this after input has been handled and before the match is
+            stepped."""
+        match = self.match
+        if len(self.inputs) % self.keyframe_interval == 0:
+            self.keyframes.append((len(self.inputs), match.get_state()))
+        inputs = [simulation.get_direction(match.player1),
+                  simulation.get_direction(match.player2)]
+        if match.numplayers == 1:
+            inputs[1] = None
+        self.inputs.append(encode_inputs(inputs))
+
+    def to_bytes(self):
+        """Returns the recording in the replay file format."""
+        flags = 0
+        if self.match.swept:
+            flags |= SWEPT_FLAG
+        if self.match.fixed:
+            flags |= FIXED_FLAG
+        header = HEADER.pack(MAGIC, VERSION, self.match.numplayers, flags,
+                             len(self.inputs), len(self.keyframes))
+        keyframes = b''.join(KEYFRAME.pack(tick, *state)
+                             for tick, state in self.keyframes)
+        return header + zlib.compress(bytes(self.inputs) + keyframes)
+
+    def save(self, path):
+        """Writes the recording to a file."""
+        with open(path, 'wb') as replay_file:
+            replay_file.write(self.to_bytes())
+
+
+class Replay:
+    """A recorded match that can be played back from any tick."""
+    def __init__(self, data):
+        """data: the contents of a replay file"""
+        (magic, version, self.numplayers, flags, count,
+         keyframe_count) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a version {} replay'.format(VERSION))
+        self.swept = bool(flags & SWEPT_FLAG)
+        self.fixed = bool(flags & FIXED_FLAG)
+        body = zlib.decompress(data[HEADER.size:])
+        self.inputs = body[:count]
+        self.keyframes = []
+        for index in range(keyframe_count):
+            values = KEYFRAME.unpack_from(body, count + index * KEYFRAME.size)
+            self.keyframes.append((values[0], self.load_state(values[1:])))
+        self.keyframe_ticks = [tick for tick, state in self.keyframes]
+
+    @classmethod
+    def load(cls, path):
+        """Reads a replay file."""
+        with open(path, 'rb') as replay_file:
+            return cls(replay_file.read())
+
+    def __len__(self):
+        """The number of ticks in the replay."""
+        return len(self.inputs)
+
+    def load_state(self, state):
+        """Restores the number types of a keyframe's match state."""
+        state = list(state)
+        if not self.swept:
+            # The classic rules and fixed-point physics run entirely on
+            # integers
+            state[4:9] = [int(value) for value in state[4:9]]
+        return tuple(state)
+
+    def seek(self, tick):
+        """Returns a match as it was at the start of a tick."""
+        if not 0 <= tick <= len(self):
+            raise ValueError('Tick {} is outside the replay'.format(tick))
+        index = bisect.bisect_right(self.keyframe_ticks, tick) - 1
+        start, state = self.keyframes[index]
+        match = simulation.Match(self.numplayers, self.swept,
+                                 fixed=self.fixed)
+        match.set_state(state)
+        for events in self.play(match, start, tick, verify=False):
+            pass
+        return match
+
+    def play(self, match=None, start=0, end=None, verify=True):
+        """Plays the replay back, yielding the events of each tick.
+
+            match is the match to play, already at the start tick; a new one
+            from the first keyframe if none specified.
+            With verify, the match is checked against every keyframe on the
+            way and ValueError is raised if it went out of sync."""
+        if match is None:
+            match = simulation.Match(self.numplayers, self.swept,
+                                     fixed=self.fixed)
+            match.set_state(self.keyframes[0][1])
+        if end is None:
+            end = len(self)
+        keyframes = dict(self.keyframes) if verify else {}
+        for tick in range(start, end):
+            inputs = decode_inputs(self.inputs[tick])
+            if tick in keyframes:
+                # Keyframes are taken with the tick's input already on the
+                # paddles, so put it there before comparing
+                for paddle, direction in zip((match.player1, match.player2),
+                                             inputs):
+                    if direction is not None:
+                        paddle.set_direction(direction)
+                if match.get_state() != keyframes[tick]:
+                    raise ValueError('Replay went out of sync at tick {}'
+                                     .format(tick))
+            yield match.step(inputs)
+
+
+def selftest(count=20, keyframe_interval=50, seed=0):
+    """Records matches with random input, changing it on every keyframe
+       tick, and checks each plays back to the same end.
+
+        Returns how many matches went out of sync."""
+    rng = random.Random(seed)
+    directions = (simulation.UP, simulation.STOP, simulation.DOWN)
+    failures = 0
+    for number in range(count):
+        match = simulation.Match(number % 2 + 1, swept=number % 4 >= 2,
+                                 fixed=number % 8 >= 4)
+        recorder = Recorder(match, keyframe_interval)
+        inputs = [simulation.STOP, simulation.STOP]
+        while match.winner is None:
+            for player in range(2):
+                # Like a player, keys are held for a while
+                if (rng.random() < 0.1 or
+                        len(recorder.inputs) % keyframe_interval == 0):
+                    inputs[player] = rng.choice(directions)
+            match.player1.set_direction(inputs[0])
+            if match.numplayers == 2:
+                match.player2.set_direction(inputs[1])
+            recorder.record()
+            match.step()
+        replay = Replay(recorder.to_bytes())
+        playback = simulation.Match(replay.numplayers, replay.swept,
+                                    fixed=replay.fixed)
+        playback.set_state(replay.keyframes[0][1])
+        try:
+            for events in replay.play(playback):
+                pass
+        except ValueError as error:
+            print('Match {}: {}'.format(number, error))
+            failures += 1
+            continue
+        if playback.get_state() != match.get_state():
+            print('Match {}: ended differently'.format(number))
+            failures += 1
+    return failures
+
+
+def main():
+    """Checks a replay plays back in sync and reports on it."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('replay', nargs='?', help='replay file to play back')
+    parser.add_argument('tick', type=int, nargs='?',
+                        help='also show the match state at this tick')
+    parser.add_argument('--selftest', action='store_true',
+                        help='record matches and check they play back')
+    args = parser.parse_args()
+    if args.selftest:
+        failures = selftest()
+        print('{} match(es) out of sync'.format(failures))
+        if failures:
+            sys.exit(1)
+        return
+    if args.replay is None:
+        parser.error('a replay file is needed')
+    replay = Replay.load(args.replay)
+    match = simulation.Match(replay.numplayers, replay.swept,
+                             fixed=replay.fixed)
+    match.set_state(replay.keyframes[0][1])
+    start = time.perf_counter()
+    for events in replay.play(match):
+        pass
+    elapsed = time.perf_counter() - start
+    print('{} ticks, {} keyframes, final score {} - {}'.format(
+        len(replay), len(replay.keyframes), match.player1_score,
+        match.player2_score))
+    print('Played back at {:.0f}x real time'.format(
+        len(replay) / simulation.TICK_RATE / max(elapsed, 1e-9)))
+    if args.tick is not None:
+        print('State at tick {}: {}'.format(args.tick,
+                                             replay.seek(args.tick)
+                                             .get_state()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,660 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Simulation
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""Headless match simulation.
+
+Everything in here is pure game logic: no drawing, no sound and no display.
+A Match is stepped one tick at a time and reports what happened as a list of
+events, which the game (or a test, or a batch of AI matches) can then react to
+however it likes.
+
+A match with fixed-point physics runs on integers only, so the same inputs
+give exactly the same match on any machine. Lockstep and replay code can then
+send just the inputs, and now and then a hash of the state from get_hash() to
+check both sides still agree.
+"""
+
+import collections
+import hashlib
+import math
+import random
+import struct
+import pygame
+
+
+# Court constants
+SCREEN_WIDTH = 900
+SCREEN_HEIGHT = 600
+PADDLE_WIDTH = 20
+PADDLE_HEIGHT = 100
+PADDLE_OFFSET = 25  # The space between the paddle and the side of the screen
+PADDLE_BUFFER = 5  # THe space between the paddle and the barriers
+PADDLE_Y = (SCREEN_HEIGHT / 2) - (PADDLE_HEIGHT / 2)  # Centers the paddle
+# Starting points for paddles
+PADDLE1_POS = {'x': (SCREEN_WIDTH - PADDLE_WIDTH - PADDLE_OFFSET),
+               'y': PADDLE_Y}
+PADDLE2_POS = {'x': PADDLE_OFFSET, 'y': PADDLE_Y}
+# Ball properties
+BALL_SIZE = 20
+BALL_POS = {'x': ((SCREEN_WIDTH / 2) - (BALL_SIZE / 2)),
+            'y': ((SCREEN_HEIGHT / 2) - (BALL_SIZE / 2))}
+BARRIER_HEIGHT = 25
+BARRIER_OFFSET = 10
+COURT_TOP = BARRIER_HEIGHT + BARRIER_OFFSET
+COURT_BOTTOM = SCREEN_HEIGHT - BARRIER_HEIGHT - BARRIER_OFFSET
+TICK_RATE = 70  # Ticks per second; all speeds are in pixels per tick
+MAX_SCORE = 9  # Scoring again after reaching this ends the match
+AI_MAXSPEED = 8  # Paddle speed of the computer player in 1 player mode
+MAX_BOUNCES = 8  # Most collisions a swept ball resolves in a single step
+SUBPIXELS = 256  # Steps per pixel of a FixedBall's position
+TICK_STEPS = 65536  # Steps per tick of a FixedBall's collision times
+# Paddle speed and aiming error in pixels of the InterceptAI levels
+DIFFICULTIES = {'easy': {'maxspeed': 6, 'error': 70},
+                'medium': {'maxspeed': 8, 'error': 40},
+                'hard': {'maxspeed': 10, 'error': 20},
+                'perfect': {'maxspeed': 12, 'error': 0}}
+
+# Paddle inputs
+UP = -1
+STOP = 0
+DOWN = 1
+
+# Event kinds
+WALL_HIT = 'wall_hit'
+PADDLE_HIT = 'paddle_hit'
+SCORE = 'score'
+MATCH_OVER = 'match_over'
+
+# kind is one of the event kinds above, player is the player it concerns
+# (None for wall hits)
+Event = collections.namedtuple('Event', ['kind', 'player'])
+
+
+# Classes
+class Paddle:
+    """Class detailing how a pong paddle moves."""
+    def __init__(self, posx, posy, maxspeed=12):
+        self.maxspeed = maxspeed
+        # Simply invert movespeed to change direction
+        self.movespeed = self.maxspeed
+        self.moving = 0  # Decides if the paddle should move or not
+        self.moveup = 0
+        self.movedown = 0
+        self.paddle_rect = pygame.Rect(posx, posy, PADDLE_WIDTH, PADDLE_HEIGHT)
+
+    def set_direction(self, direction):
+        """Steers the paddle.
+
+            direction is UP, DOWN or STOP"""
+        if direction == STOP:
+            self.moving = 0
+        else:
+            self.moving = 1
+            self.movespeed = direction * self.maxspeed
+
+    def move(self, dt=1):
+        """Moves the paddle.
+
+            dt is how many ticks worth of movement to make"""
+        speed = self.movespeed * dt
+        # Stop paddle from moving out of bounds
+        if self.paddle_rect.y + speed <= COURT_TOP:
+            self.paddle_rect.y = COURT_TOP + PADDLE_BUFFER
+        elif (self.paddle_rect.y + speed +
+              PADDLE_HEIGHT >= COURT_BOTTOM):
+            self.paddle_rect.y = COURT_BOTTOM - PADDLE_HEIGHT - PADDLE_BUFFER
+        else:
+            self.paddle_rect.move_ip(0, speed)
+
+    def clamp(self):
+        """Keeps the paddle off the barriers by PADDLE_BUFFER.
+
+            move() only does this when a move would reach the court's edge,
+            so moves of only a few pixels can creep closer."""
+        self.paddle_rect.y = min(max(self.paddle_rect.y,
+                                     COURT_TOP + PADDLE_BUFFER),
+                                 COURT_BOTTOM - PADDLE_HEIGHT - PADDLE_BUFFER)
+
+    def update(self, dt=1):
+        """Moves the paddle if it should be moving."""
+        if self.moving:
+            self.move(dt)
+
+
+class Ball:
+    """Class describing ball properties and behavior."""
+    Y_SPEED = 5
+    ACCELERATION = 1
+
+    def __init__(self):
+        self.origspeed = 15
+        self.maxspeed = self.origspeed
+        self.movex = -self.maxspeed
+        self.movey = self.Y_SPEED
+        self.ball_rect = pygame.Rect(BALL_POS['x'], BALL_POS['y'],
+                                     BALL_SIZE, BALL_SIZE)
+
+    def reset(self, side, paddle):
+        """Put's the ball in front of a paddle and resets speed.
+
+            side is which side the ball should spawn on
+            paddle is the paddle on that side"""
+        self.maxspeed = self.origspeed
+        self.movex = self.maxspeed
+        if side == 2:
+            self.movex *= -1
+            self.ball_rect.x = paddle.paddle_rect.x + PADDLE_WIDTH
+        else:
+            self.ball_rect.x = paddle.paddle_rect.x - BALL_SIZE
+        self.ball_rect.y = paddle.paddle_rect.y + (PADDLE_HEIGHT / 2)
+        self.movey = self.Y_SPEED
+
+    def wall_collide_adjust(self, newy):
+        """When the ball hits a wall, adjust it."""
+        self.ball_rect.y = newy
+        self.movey *= -1
+
+    def paddle_collide_adjust(self, newx, speed_modifier):
+        """When the ball hits a paddle, adjust it."""
+        self.ball_rect.x = newx
+        self.movex *= -1
+        self.movex += speed_modifier
+
+    def ball_phased(self, player, side):
+        """Check if ball 'phased' through the paddle.
+
+            side is which side of the court the paddle is on"""
+        if side == 1:
+            return ((self.ball_rect.x + self.movex) >= player.paddle_rect.x and
+                (self.ball_rect.y + BALL_SIZE) >= player.paddle_rect.y and
+                 self.ball_rect.y <= (player.paddle_rect.y + PADDLE_HEIGHT))
+        else:
+            return ((self.ball_rect.x + self.movex) <= player.paddle_rect.x and
+                (self.ball_rect.y + BALL_SIZE) >= player.paddle_rect.y and
+                 self.ball_rect.y <= (player.paddle_rect.y + PADDLE_HEIGHT))
+
+    def advance(self):
+        """Moves the ball along by its speed."""
+        self.ball_rect.move_ip(self.movex, self.movey)
+
+    def move(self, player1, player2):
+        """Bounces the ball off anything it's about to hit.
+
+            Returns a list of the events that happened. A scoring event is
+            reported but not acted upon. The ball itself is moved afterwards
+            by advance()."""
+        events = []
+        # Bounces the ball off the walls
+        if self.ball_rect.y + self.movey <= COURT_TOP:
+            self.wall_collide_adjust(COURT_TOP)
+            events.append(Event(WALL_HIT, None))
+        elif self.ball_rect.y + self.movey + BALL_SIZE >= COURT_BOTTOM:
+            self.wall_collide_adjust(COURT_BOTTOM - BALL_SIZE)
+            events.append(Event(WALL_HIT, None))
+        # Bounces the ball off paddles
+        if ((self.ball_rect.colliderect(
+                player1.paddle_rect.move(-self.movex, 0)) or
+                self.ball_phased(player1, 1)) and self.movex > 0):
+            self.paddle_collide_adjust(player1.paddle_rect.x - BALL_SIZE,
+                                       -self.ACCELERATION)
+            events.append(Event(PADDLE_HIT, 1))
+        elif ((self.ball_rect.colliderect(player2.paddle_rect.move(
+                self.movex + PADDLE_WIDTH, 0)) or
+                self.ball_phased(player2, 2)) and self.movex < 0):
+            self.paddle_collide_adjust(player2.paddle_rect.x + PADDLE_WIDTH,
+                                       self.ACCELERATION)
+            events.append(Event(PADDLE_HIT, 2))
+        # Check for a score
+        if self.ball_rect.x + self.movex <= 0:
+            events.append(Event(SCORE, 1))
+        elif self.ball_rect.x + self.movex + BALL_SIZE >= SCREEN_WIDTH:
+            events.append(Event(SCORE, 2))
+        return events
+
+
+class SweptBall(Ball):
+    """A ball that moves by continuous collision detection.
+
+       Instead of checking where the ball will be at the end of a tick, the
+       exact time it touches a wall, paddle or goal line is worked out, the
+       ball is moved there and bounced, and the rest of the step is used up
+       the same way. Fast balls can't pass through paddles and several
+       bounces in one step (say a wall, then a paddle) are handled in order.
+
+       The position is kept as floats in x and y; ball_rect is rounded from
+       them after every move."""
+    SCALE = 1  # Units of x and y per pixel
+    TICK_LENGTH = 1  # Units of time per tick
+
+    def __init__(self):
+        Ball.__init__(self)
+        self.sync_position()
+
+    def sync_position(self):
+        """Takes the float position from ball_rect."""
+        self.x = float(self.ball_rect.x)
+        self.y = float(self.ball_rect.y)
+
+    def sync_rect(self):
+        """Rounds ball_rect from the position."""
+        self.ball_rect.x = round(self.x)
+        self.ball_rect.y = round(self.y)
+
+    def time_to(self, distance, speed):
+        """Returns how long the ball takes to go a distance at a speed."""
+        return distance / speed
+
+    def travel(self, time):
+        """Moves the ball along its path for a time."""
+        self.x += self.movex * time
+        self.y += self.movey * time
+
+    def reset(self, side, paddle):
+        """Put's the ball in front of a paddle and resets speed."""
+        Ball.reset(self, side, paddle)
+        self.sync_position()
+
+    def advance(self):
+        """Does nothing; move() moves the ball as it goes."""
+
+    def move(self, player1, player2, dt=1):
+        """Moves the ball dt ticks along its path, bouncing as it goes.
+
+            Returns a list of the events that happened on the way. The ball
+            stops where it crosses a goal line, with a scoring event."""
+        events = []
+        remaining = dt * self.TICK_LENGTH
+        for bounce in range(MAX_BOUNCES + 1):
+            hit = None  # (time, kind, player, axis) of the first collision
+            wall = self.wall_time()
+            if wall is not None and wall <= remaining:
+                hit = (wall, WALL_HIT, None, 'y')
+            for side, paddle in ((1, player1), (2, player2)):
+                # Only the paddle the ball is heading towards can be hit
+                if (side == 1) != (self.movex > 0):
+                    continue
+                paddle_hit = self.paddle_time(paddle)
+                if paddle_hit is not None and paddle_hit[0] <= remaining:
+                    if hit is None or paddle_hit[0] < hit[0]:
+                        hit = (paddle_hit[0], PADDLE_HIT, side, paddle_hit[1])
+            goal = self.goal_time()
+            if goal is not None and goal <= remaining:
+                if hit is None or goal < hit[0]:
+                    hit = (goal, SCORE, 1 if self.movex < 0 else 2, None)
+            if hit is None or bounce == MAX_BOUNCES:
+                self.travel(remaining)
+                break
+            time, kind, player, axis = hit
+            self.travel(time)
+            remaining -= time
+            events.append(Event(kind, player))
+            if kind == SCORE:
+                break
+            if axis == 'y':
+                self.movey *= -1
+            elif player == 1:
+                self.movex = -self.movex - self.ACCELERATION
+            else:
+                self.movex = -self.movex + self.ACCELERATION
+        self.sync_rect()
+        return events
+
+    def wall_time(self):
+        """Returns how long until the ball touches the wall it is heading
+           for, or None if it isn't moving vertically."""
+        if self.movey < 0:
+            return max(0, self.time_to(COURT_TOP * self.SCALE - self.y,
+                                       self.movey))
+        elif self.movey > 0:
+            return max(0, self.time_to(
+                (COURT_BOTTOM - BALL_SIZE) * self.SCALE - self.y, self.movey))
+        return None
+
+    def goal_time(self):
+        """Returns how long until the ball crosses a goal line."""
+        if self.movex < 0:
+            return max(0, self.time_to(-self.x, self.movex))
+        elif self.movex > 0:
+            return max(0, self.time_to(
+                (SCREEN_WIDTH - BALL_SIZE) * self.SCALE - self.x, self.movex))
+        return None
+
+    def paddle_time(self, paddle):
+        """Sweeps the ball against a paddle.
+
+            Returns (time, axis) of the first touch, where axis is 'x' for
+            the paddle's sides and 'y' for its ends, or None if the ball
+            misses it. A ball already overlapping the paddle touches it
+            straight away."""
+        rect = paddle.paddle_rect
+        scale = self.SCALE
+        # Grow the paddle by the ball's size so the ball is a single point
+        entry = []
+        leave = []
+        for pos, speed, low, high in (
+                (self.x, self.movex, (rect.left - BALL_SIZE) * scale,
+                 rect.right * scale),
+                (self.y, self.movey, (rect.top - BALL_SIZE) * scale,
+                 rect.bottom * scale)):
+            if speed == 0:
+                if not low < pos < high:
+                    return None
+                entry.append(-math.inf)
+                leave.append(math.inf)
+            else:
+                first = self.time_to(low - pos, speed)
+                second = self.time_to(high - pos, speed)
+                entry.append(min(first, second))
+                leave.append(max(first, second))
+        enter_time = max(entry)
+        leave_time = min(leave)
+        if enter_time >= leave_time or leave_time <= 0:
+            return None
+        axis = 'x' if entry[0] >= entry[1] else 'y'
+        return max(0, enter_time), axis
+
+
+class FixedBall(SweptBall):
+    """A swept ball on fixed-point integers.
+
+       The position is kept in x and y as whole SUBPIXELS, and times as
+       whole TICK_STEPS, always rounded down. No floats are involved, so the
+       ball moves exactly the same on every machine. ball_rect is rounded
+       from the position after every move."""
+    SCALE = SUBPIXELS
+    TICK_LENGTH = TICK_STEPS
+
+    def sync_position(self):
+        """Takes the position from ball_rect."""
+        self.x = self.ball_rect.x * SUBPIXELS
+        self.y = self.ball_rect.y * SUBPIXELS
+
+    def sync_rect(self):
+        """Rounds ball_rect from the position, halves up."""
+        self.ball_rect.x = (self.x + SUBPIXELS // 2) // SUBPIXELS
+        self.ball_rect.y = (self.y + SUBPIXELS // 2) // SUBPIXELS
+
+    def time_to(self, distance, speed):
+        """Returns how many TICK_STEPS the ball takes to go a distance in
+           SUBPIXELS at a speed in pixels per tick."""
+        return distance * TICK_STEPS // (speed * SUBPIXELS)
+
+    def travel(self, time):
+        """Moves the ball along its path for some TICK_STEPS."""
+        self.x += self.movex * SUBPIXELS * time // TICK_STEPS
+        self.y += self.movey * SUBPIXELS * time // TICK_STEPS
+
+    def reset(self, side, paddle):
+        """Put's the ball in front of a paddle and resets speed."""
+        self.maxspeed = self.origspeed
+        self.movex = self.maxspeed
+        if side == 2:
+            self.movex *= -1
+            self.ball_rect.x = paddle.paddle_rect.x + PADDLE_WIDTH
+        else:
+            self.ball_rect.x = paddle.paddle_rect.x - BALL_SIZE
+        self.ball_rect.y = paddle.paddle_rect.y + PADDLE_HEIGHT // 2
+        self.movey = self.Y_SPEED
+        self.sync_position()
+
+
+class Match:
+    """The complete state of a match, stepped one tick at a time."""
+    def __init__(self, numplayers=1, swept=False, ai=None, fixed=False):
+        """numplayers: 1 pits player 1 against the computer, 2 is
+           player versus player
+           swept: use SweptBall physics instead of the classic rules
+           ai: what steers the computer's paddle, like an InterceptAI; the
+           classic handle_AI if none specified
+           fixed: use FixedBall physics, which play like swept ones but
+           give the same results on every machine"""
+        self.numplayers = numplayers
+        self.swept = swept
+        self.fixed = fixed
+        self.ai = ai
+        self.player1_score = 0
+        self.player2_score = 0
+        self.winner = None  # Set to the winning player once the match ends
+        self.ticks = 0
+        self.player1 = Paddle(PADDLE1_POS['x'], PADDLE1_POS['y'])
+        if numplayers == 1:
+            self.player2 = Paddle(PADDLE2_POS['x'], PADDLE2_POS['y'],
+                                  maxspeed=AI_MAXSPEED)
+        else:
+            self.player2 = Paddle(PADDLE2_POS['x'], PADDLE2_POS['y'])
+        if fixed:
+            self.ball = FixedBall()
+        elif swept:
+            self.ball = SweptBall()
+        else:
+            self.ball = Ball()
+        if ai and numplayers == 1:
+            ai.reset(self, self.player2)
+
+    def get_state(self):
+        """Returns everything that changes during a match as a flat tuple.
+
+            The order is ticks, both scores, winner (0 while playing), the
+            ball's x, y, movex, movey and maxspeed, then for each paddle its
+            y, moving, movespeed and maxspeed. Which keys are held down is
+            up to whoever steers the paddle, so it isn't included. With
+            fixed-point physics the ball's x and y are in SUBPIXELS."""
+        ball = self.ball
+        if self.swept or self.fixed:
+            ballx, bally = ball.x, ball.y
+        else:
+            ballx, bally = ball.ball_rect.x, ball.ball_rect.y
+        state = [self.ticks, self.player1_score, self.player2_score,
+                 self.winner or 0, ballx, bally, ball.movex, ball.movey,
+                 ball.maxspeed]
+        for paddle in (self.player1, self.player2):
+            state.extend((paddle.paddle_rect.y, paddle.moving,
+                          paddle.movespeed, paddle.maxspeed))
+        return tuple(state)
+
+    def set_state(self, state):
+        """Puts the match back into a state from get_state()."""
+        state = list(state)
+        (self.ticks, self.player1_score, self.player2_score, winner, ballx,
+         bally, self.ball.movex, self.ball.movey,
+         self.ball.maxspeed) = state[:9]
+        self.winner = winner or None
+        if self.swept or self.fixed:
+            self.ball.x, self.ball.y = ballx, bally
+            self.ball.sync_rect()
+        else:
+            self.ball.ball_rect.x = round(ballx)
+            self.ball.ball_rect.y = round(bally)
+        for paddle, start in ((self.player1, 9), (self.player2, 13)):
+            (paddle.paddle_rect.y, paddle.moving, paddle.movespeed,
+             paddle.maxspeed) = state[start:start + 4]
+
+    def get_hash(self):
+        """Returns a hash of get_state(), see hash_state()."""
+        return hash_state(self.get_state())
+
+    def increase_score(self, player):
+        """Increases a player's score and resets the ball.
+
+            Returns the events caused by the point."""
+        events = []
+        if self.player1_score >= MAX_SCORE and player == 1:
+            self.winner = 1
+            events.append(Event(MATCH_OVER, 1))
+        elif self.player2_score >= MAX_SCORE and player == 2:
+            self.winner = 2
+            events.append(Event(MATCH_OVER, 2))
+        if player == 1:
+            self.player1_score += 1
+            self.ball.reset(player, self.player1)
+        elif player == 2:
+            self.player2_score += 1
+            self.ball.reset(player, self.player2)
+        return events
+
+    def step(self, inputs=(None, None), dt=1):
+        """Advances the match by one tick.
+
+            inputs holds a direction (UP, DOWN or STOP) for each player, or
+            None to leave that paddle as it is. In 1 player mode player 2 is
+            always steered by the computer.
+            dt is the length of the step in ticks; only swept matches
+            without fixed-point physics can take steps other than 1.
+            Returns a list of the events that happened during the tick."""
+        if dt != 1 and (self.fixed or not self.swept):
+            raise ValueError('Only swept matches can step by {} ticks'
+                             .format(dt))
+        if self.winner is not None:
+            return []
+        for paddle, direction in zip((self.player1, self.player2), inputs):
+            if direction is not None:
+                paddle.set_direction(direction)
+        if self.numplayers == 1:
+            if self.ai:
+                self.ai.steer(self, self.player2)
+            else:
+                handle_AI(self.ball, self.player2)
+        self.player1.update(dt)
+        if self.swept or self.fixed:
+            events = self.ball.move(self.player1, self.player2, dt)
+        else:
+            events = self.ball.move(self.player1, self.player2)
+        for event in list(events):
+            if event.kind == SCORE:
+                events.extend(self.increase_score(event.player))
+        # Finally move the ball
+        self.ball.advance()
+        self.player2.update(dt)
+        self.ticks += dt
+        return events
+
+
+class InterceptAI:
+    """A computer player that goes to where the ball will be.
+
+       Between bounces the ball's path is fixed, so the AI only works out
+       where it will cross the paddle when the ball's speed changes (a wall
+       or paddle bounce or a serve) and then just steers there. While the
+       ball is heading away it goes back to the middle of the court.
+
+       error is how far off in pixels, at most, each prediction is aimed,
+       to make the AI beatable. rng is the random.Random the errors come
+       from."""
+    def __init__(self, rng=None, maxspeed=AI_MAXSPEED, error=0):
+        self.rng = rng or random.Random()
+        self.maxspeed = int(maxspeed)
+        self.error = float(error)
+        self.velocity = None  # The ball's speed when the target was set
+        self.target = None  # Where the middle of the paddle should go
+
+    @classmethod
+    def from_difficulty(cls, difficulty, rng=None):
+        """Creates an AI from one of the DIFFICULTIES."""
+        return cls(rng, **DIFFICULTIES[difficulty])
+
+    def reset(self, match, paddle):
+        """Gets ready to play a match with a paddle."""
+        paddle.maxspeed = self.maxspeed
+        paddle.movespeed = self.maxspeed
+        self.velocity = None
+
+    def aim(self, ball, paddle):
+        """Works out where the paddle should go for the ball's new path."""
+        if paddle.paddle_rect.x < SCREEN_WIDTH / 2:
+            plane = paddle.paddle_rect.right
+        else:
+            plane = paddle.paddle_rect.left - BALL_SIZE
+        intercept = predict_intercept(ball, plane)
+        if intercept is None:
+            self.target = (COURT_TOP + COURT_BOTTOM) / 2
+        else:
+            ticks, bally = intercept
+            self.target = bally + BALL_SIZE / 2
+            if self.error:
+                self.target += self.rng.uniform(-self.error, self.error)
+
+    def steer(self, match, paddle):
+        """Steers the paddle for the coming tick."""
+        ball = match.ball
+        velocity = (ball.movex, ball.movey)
+        if velocity != self.velocity:
+            self.velocity = velocity
+            self.aim(ball, paddle)
+        offset = self.target - paddle.paddle_rect.centery
+        if abs(offset) < self.maxspeed:
+            paddle.moving = 0
+        else:
+            paddle.moving = 1
+            paddle.movespeed = self.maxspeed if offset > 0 else -self.maxspeed
+
+
+# Functions
+def predict_intercept(ball, plane):
+    """Predicts where the ball will cross a vertical line.
+
+        plane is the x the ball's left edge will be at when it crosses.
+        Bounces off the walls are folded in, so this takes the same time
+        however far away the ball is. Paddles are ignored.
+        Returns (ticks until it crosses, the ball's y then), or None if the
+        ball is moving away from the line."""
+    if isinstance(ball, SweptBall):
+        x, y = ball.x / ball.SCALE, ball.y / ball.SCALE
+    else:
+        x, y = ball.ball_rect.x, ball.ball_rect.y
+    if ball.movex == 0 or (plane - x) * ball.movex < 0:
+        return None
+    ticks = (plane - x) / ball.movex
+    # Unfold the walls: the ball goes back and forth over a court that is
+    # span high, which repeats every two spans
+    span = COURT_BOTTOM - BALL_SIZE - COURT_TOP
+    travelled = (y - COURT_TOP + ball.movey * ticks) % (2 * span)
+    if travelled > span:
+        travelled = 2 * span - travelled
+    return ticks, COURT_TOP + travelled
+
+
+def hash_state(state):
+    """Returns a 64 bit hash of a match state from Match.get_state().
+
+        It is the same on every machine and every run, unlike hash(), so it
+        can be sent across the network or saved to check that two matches
+        played with the same inputs ended up in the same state."""
+    try:
+        data = struct.pack('<{}q'.format(len(state)), *state)
+    except struct.error:
+        data = repr(state).encode()  # Floats, from swept physics
+    digest = hashlib.blake2b(data, digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def get_direction(paddle):
+    """Returns which way a paddle is being steered: UP, DOWN or STOP."""
+    if not paddle.moving:
+        return STOP
+    elif paddle.movespeed < 0:
+        return UP
+    return DOWN
+
+
+def handle_AI(ball, paddle):
+    """Steers a computer controlled paddle towards the ball."""
+    # Have the paddle only move when ball is moving towards it
+    if paddle.paddle_rect.x < SCREEN_WIDTH / 2:
+        approaching = ball.movex < 0
+    else:
+        approaching = ball.movex > 0
+    if approaching:
+        paddle.moving = 1
+    else:
+        paddle.moving = 0
+    if ball.ball_rect.y > (paddle.paddle_rect.y + PADDLE_HEIGHT +
+                           paddle.movespeed):
+        paddle.movespeed = paddle.maxspeed
+    elif ball.ball_rect.y < (paddle.paddle_rect.y - paddle.movespeed):
+        paddle.movespeed = -paddle.maxspeed
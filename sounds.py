@@ -0,0 +1,308 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Sounds
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""Loads the sound effects without holding up the first frame.
+
+    python3 sounds.py build
+decodes every sound effect into the mixer's own sample format and packs
+them into one bundle. The game memory maps the bundle and makes its sounds
+on a background thread, so the menu shows straight away; a sound that isn't
+ready yet just doesn't play. Without a bundle, or if the mixer runs at a
+different format than the bundle was built for, the WAV files are loaded
+instead, still in the background. Music is streamed from its file as it
+plays, so it isn't bundled.
+
+    python3 sounds.py bench
+measures how long the game takes to draw its first frame and to finish
+loading its sounds, with and without the bundle.
+
+Sounds played through a VoicePool don't start straight away: they are
+gathered up and played together once a frame, each sound only once however
+many times it was asked for, on a fixed set of channels kept for them. When
+every channel is busy, a sound takes over the channel of the least important
+one playing if that one is less important than it, and is dropped if not.
+"""
+
+import argparse
+import mmap
+import os
+import queue
+import struct
+import subprocess
+import sys
+import threading
+import time
+import pygame
+
+SOUND_DIR = 'Sounds'
+BUNDLE_FILE = os.path.join(SOUND_DIR, 'sounds.bundle')
+MAGIC = b'PLSB'
+VERSION = 1
+# Version, mixer frequency, format and channels, and number of sounds
+HEADER = struct.Struct('<4sBihBB')
+# Sound file name, and where its samples are in the bundle
+ENTRY = struct.Struct('<32sII')
+VOICES = 8  # Channels kept for a voice pool
+MIXER_BUFFER = 512  # Small, to remove sound lag
+
+
+def init_mixer():
+    """Starts the mixer the way the game uses it, if it hasn't started."""
+    if not pygame.mixer.get_init():
+        pygame.mixer.pre_init(buffer=MIXER_BUFFER)
+        pygame.mixer.init()
+
+
+class Sound:
+    """A sound effect that plays once it has loaded."""
+    def __init__(self, soundfile, priority=0, voices=None):
+        """priority: how important the sound is, higher is more
+           voices: the VoicePool to play it through, if any"""
+        self.soundfile = soundfile
+        self.priority = priority
+        self.voices = voices
+        self.sound = None
+
+    def play(self):
+        """Plays the sound, if it's ready."""
+        if self.voices:
+            self.voices.request(self)
+        elif self.sound:
+            self.sound.play()
+
+
+class VoicePool:
+    """Plays sounds once a frame on channels kept just for them.
+
+       After each dispatch, frame_counts says what happened to the sounds
+       asked for that frame, and totals adds them all up."""
+    def __init__(self, voices=VOICES):
+        init_mixer()
+        if pygame.mixer.get_num_channels() < voices:
+            pygame.mixer.set_num_channels(voices)
+        # Sound.play() without a pool won't use these channels
+        pygame.mixer.set_reserved(voices)
+        self.channels = [pygame.mixer.Channel(index)
+                         for index in range(voices)]
+        self.playing = [None] * voices  # The sound last started on each
+        self.requests = []
+        self.frame_counts = self.new_counts()
+        self.totals = self.new_counts()
+
+    @staticmethod
+    def new_counts():
+        """Returns counters all at zero.
+
+            requested: times sounds were asked for
+            merged: requests for a sound already asked for that frame
+            played: sounds started on a free channel
+            stolen: sounds started on a channel playing something less
+            important
+            dropped: sounds not played, for want of a channel or because
+            they hadn't loaded yet"""
+        return {'requested': 0, 'merged': 0, 'played': 0, 'stolen': 0,
+                'dropped': 0}
+
+    def request(self, sound):
+        """Asks for a sound to be played at the next dispatch."""
+        self.requests.append(sound)
+
+    def dispatch(self):
+        """Plays the sounds asked for since the last dispatch, most
+           important first."""
+        counts = self.new_counts()
+        counts['requested'] = len(self.requests)
+        sounds = []
+        for sound in self.requests:
+            if sound in sounds:
+                counts['merged'] += 1
+            else:
+                sounds.append(sound)
+        self.requests = []
+        sounds.sort(key=lambda sound: sound.priority, reverse=True)
+        for sound in sounds:
+            if not sound.sound:
+                counts['dropped'] += 1
+                continue
+            voice = self.find_voice(sound)
+            if voice is None:
+                counts['dropped'] += 1
+                continue
+            if self.channels[voice].get_busy():
+                counts['stolen'] += 1
+            else:
+                counts['played'] += 1
+            self.channels[voice].play(sound.sound)
+            self.playing[voice] = sound
+        self.frame_counts = counts
+        for name, count in counts.items():
+            self.totals[name] += count
+
+    def find_voice(self, sound):
+        """Returns the channel to play a sound on, or None if there isn't
+           one."""
+        lowest = None
+        for voice, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                return voice
+            if (lowest is None or self.playing[voice].priority <
+                    self.playing[lowest].priority):
+                lowest = voice
+        if self.playing[lowest].priority < sound.priority:
+            return lowest
+        return None
+
+
+class SoundLoader:
+    """Loads sound effects on a background thread, from the bundle if it
+       can."""
+    def __init__(self, bundle=BUNDLE_FILE, voices=None):
+        """bundle: the bundle to load from; None to load the files
+           voices: the VoicePool to play the sounds through, if any"""
+        self.voices = voices
+        init_mixer()
+        self.requests = queue.SimpleQueue()
+        self.loaded = threading.Event()
+        self.from_bundle = 0  # How many sounds came from the bundle
+        self.thread = threading.Thread(target=self.run, args=(bundle,),
+                                       daemon=True)
+        self.thread.start()
+
+    def load(self, soundfile, priority=0):
+        """Returns a sound that plays once it has loaded."""
+        sound = Sound(soundfile, priority, self.voices)
+        self.requests.put(sound)
+        return sound
+
+    def finish(self):
+        """Lets the loader stop once every sound asked for has loaded."""
+        self.requests.put(None)
+
+    def run(self, bundle):
+        """Loads sounds as they are asked for, until finish() is called."""
+        entries = {}
+        data = None
+        try:
+            if bundle:
+                with open(bundle, 'rb') as bundle_file:
+                    data = mmap.mmap(bundle_file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+                entries = read_entries(data)
+        except (OSError, ValueError, struct.error):
+            pass  # No usable bundle, so load the files
+        try:
+            while True:
+                sound = self.requests.get()
+                if sound is None:
+                    break
+                try:
+                    if sound.soundfile in entries:
+                        offset, length = entries[sound.soundfile]
+                        sound.sound = pygame.mixer.Sound(
+                            buffer=data[offset:offset + length])
+                        self.from_bundle += 1
+                    else:
+                        sound.sound = pygame.mixer.Sound(os.path.join(
+                            SOUND_DIR, sound.soundfile))
+                except (pygame.error, OSError):
+                    # The sound stays silent
+                    print('Sound file could not be loaded!')
+        finally:
+            if data:
+                data.close()
+            # Even if loading went wrong, nothing should wait forever
+            self.loaded.set()
+
+
+def read_entries(data):
+    """Returns where each sound is in a bundle, by file name.
+
+        Raises ValueError if the bundle is unusable with the mixer as it is
+        set up now."""
+    (magic, version, frequency, sample_format, channels,
+     count) = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a version {} sound bundle'.format(VERSION))
+    if (frequency, sample_format, channels) != pygame.mixer.get_init():
+        raise ValueError('The sound bundle was built for another mixer format')
+    entries = {}
+    for index in range(count):
+        name, offset, length = ENTRY.unpack_from(
+            data, HEADER.size + index * ENTRY.size)
+        entries[name.rstrip(b'\0').decode()] = (offset, length)
+    return entries
+
+
+def build_bundle(path=BUNDLE_FILE):
+    """Packs every sound effect into a bundle, already converted to the
+       format the game sets the mixer up with."""
+    init_mixer()
+    soundfiles = sorted(name for name in os.listdir(SOUND_DIR)
+                        if name.endswith('.wav'))
+    samples = [pygame.mixer.Sound(os.path.join(SOUND_DIR, name)).get_raw()
+               for name in soundfiles]
+    frequency, sample_format, channels = pygame.mixer.get_init()
+    header = HEADER.pack(MAGIC, VERSION, frequency, sample_format, channels,
+                         len(soundfiles))
+    offset = HEADER.size + ENTRY.size * len(soundfiles)
+    entries = []
+    for name, raw in zip(soundfiles, samples):
+        entries.append(ENTRY.pack(name.encode(), offset, len(raw)))
+        offset += len(raw)
+    with open(path, 'wb') as bundle_file:
+        bundle_file.write(header + b''.join(entries) + b''.join(samples))
+    pygame.mixer.quit()
+    return soundfiles, offset
+
+
+def time_startup(bundle=True):
+    """Starts the game headless and returns how many seconds it took to draw
+       the first frame and to load every sound."""
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy', SDL_AUDIODRIVER='dummy')
+    command = [sys.executable, 'plink.py', '--time-startup']
+    if not bundle:
+        command.append('--no-sound-bundle')
+    start = time.perf_counter()
+    game = subprocess.Popen(command, stdout=subprocess.PIPE, env=env,
+                            universal_newlines=True)
+    times = {}
+    for line in game.stdout:
+        times[line.strip()] = time.perf_counter() - start
+    game.wait()
+    return times['first frame'], times['sounds loaded']
+
+
+def main():
+    """Builds the sound bundle or benchmarks startup."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=('build', 'bench'))
+    parser.add_argument('-n', '--runs', type=int, default=10,
+                        help='how many times to start the game for bench')
+    args = parser.parse_args()
+    if args.command == 'build':
+        soundfiles, size = build_bundle()
+        print('Packed {} sounds into {} ({:.1f} MB)'.format(
+            len(soundfiles), BUNDLE_FILE, size / 1e6))
+        return
+    for bundle in (False, True):
+        if bundle and not os.path.exists(BUNDLE_FILE):
+            print('No sound bundle; run "python3 sounds.py build" first')
+            return
+        runs = [time_startup(bundle) for run in range(args.runs)]
+        first_frames = sorted(first_frame for first_frame, loaded in runs)
+        loads = sorted(loaded for first_frame, loaded in runs)
+        print('{}: first frame {:.0f} ms, sounds loaded {:.0f} ms '
+              '(medians of {} runs)'.format(
+                  'Bundle' if bundle else 'WAV files',
+                  first_frames[len(runs) // 2] * 1000,
+                  loads[len(runs) // 2] * 1000, args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,347 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Spectating
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""Streams a match live to spectators over TCP.
+
+Every tick the positions of the ball and paddles and the scores are encoded
+once, and the same bytes are sent to every spectator. Most ticks only send
+what changed since the last one; every KEYFRAME_INTERVAL ticks the whole
+frame is sent again, and spectators that join start from the last keyframe.
+Frames go out SEND_INTERVAL ticks at a time, since it's the number of sends
+rather than their size that limits how many spectators can watch.
+
+Spectators that can't keep up are skipped until their connection drains and
+then pick up again at the next keyframe; ones that stay behind for too long
+are dropped. Sending happens on its own thread, so a slow spectator never holds
+up the game.
+
+Watch a match being hosted with plink.py --spectate 7778:
+    python3 spectate.py localhost:7778
+Or see how many spectators one core can keep up with:
+    python3 spectate.py --bench 2000
+"""
+
+import argparse
+import asyncio
+import struct
+import threading
+import time
+import simulation
+from simulation import TICK_RATE
+
+DEFAULT_PORT = 7778
+KEYFRAME_INTERVAL = TICK_RATE  # A keyframe every second
+SEND_INTERVAL = 2  # Ticks sent together; KEYFRAME_INTERVAL must divide by it
+SKIP_BUFFER = 16 * 1024  # Unsent bytes before a spectator gets skipped
+DROP_AFTER = TICK_RATE * 5  # Ticks of being skipped before being dropped
+
+# Frame number, ball x and y, paddle 1 and 2 y, player 1 and 2 score
+KEYFRAME = struct.Struct('<cIhhhhBB')
+KEYFRAME_KIND = b'K'
+# A delta is its kind, a byte with a bit for each value that changed, then
+# a signed byte for how much each of those values changed by
+DELTA_KIND = b'D'
+FIELD_COUNT = 6
+
+
+def get_frame(match):
+    """Returns what spectators see of a match."""
+    return (match.ball.ball_rect.x, match.ball.ball_rect.y,
+            match.player1.paddle_rect.y, match.player2.paddle_rect.y,
+            match.player1_score, match.player2_score)
+
+
+class FrameEncoder:
+    """Turns frames into keyframes and deltas."""
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.frame = 0
+        self.last = None
+
+    def encode(self, values):
+        """Encodes the next frame. Returns (payload, whether it's a
+           keyframe)."""
+        keyframe = self.last is None or self.frame % self.keyframe_interval == 0
+        if not keyframe:
+            mask = 0
+            changes = []
+            for field, (value, last) in enumerate(zip(values, self.last)):
+                if value != last:
+                    if not -128 <= value - last <= 127:
+                        # Too big a jump for a delta, like the ball being
+                        # served
+                        keyframe = True
+                        break
+                    mask |= 1 << field
+                    changes.append(value - last)
+        if keyframe:
+            payload = KEYFRAME.pack(KEYFRAME_KIND, self.frame, *values)
+        else:
+            payload = (DELTA_KIND + bytes((mask,)) +
+                       struct.pack('<{}b'.format(len(changes)), *changes))
+        self.last = values
+        self.frame += 1
+        return payload, keyframe
+
+
+class FrameDecoder:
+    """Turns a stream of keyframes and deltas back into frames."""
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frame = None
+        self.values = None
+
+    def feed(self, data):
+        """Takes in bytes from the stream and returns the (frame number,
+           values) of every frame they completed."""
+        self.buffer += data
+        frames = []
+        position = 0
+        while position < len(self.buffer):
+            kind = self.buffer[position:position + 1]
+            if kind == KEYFRAME_KIND:
+                if len(self.buffer) - position < KEYFRAME.size:
+                    break
+                values = KEYFRAME.unpack_from(self.buffer, position)
+                self.frame = values[1]
+                self.values = list(values[2:])
+                position += KEYFRAME.size
+            elif kind == DELTA_KIND:
+                if len(self.buffer) - position < 2:
+                    break
+                mask = self.buffer[position + 1]
+                count = bin(mask).count('1')
+                if len(self.buffer) - position < 2 + count:
+                    break
+                changes = struct.unpack_from('<{}b'.format(count),
+                                             self.buffer, position + 2)
+                position += 2 + count
+                if self.values is None:
+                    continue  # Can't happen: streams start at a keyframe
+                changes = iter(changes)
+                for field in range(FIELD_COUNT):
+                    if mask & (1 << field):
+                        self.values[field] += next(changes)
+                self.frame += 1
+            else:
+                raise ValueError('Not a spectator stream')
+            frames.append((self.frame, tuple(self.values)))
+        del self.buffer[:position]
+        return frames
+
+
+class SpectatorProtocol(asyncio.Protocol):
+    """One spectator's connection."""
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.transport = None
+        self.waiting = False  # Skipped frames, so waiting for a keyframe
+        self.behind = 0  # Ticks skipped in a row
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.transport.write(b''.join(self.broadcaster.backlog))
+        self.broadcaster.clients.add(self)
+
+    def connection_lost(self, exc):
+        self.broadcaster.clients.discard(self)
+
+    def data_received(self, data):
+        pass  # Spectators have nothing to say
+
+    def send(self, payload, keyframe):
+        """Sends frames, unless the spectator is too far behind.
+
+            keyframe is whether the first of them is a keyframe."""
+        if (self.transport.get_write_buffer_size() > SKIP_BUFFER or
+                (self.waiting and not keyframe)):
+            self.waiting = True
+            self.behind += self.broadcaster.send_interval
+            self.broadcaster.skipped += self.broadcaster.send_interval
+            if self.behind > DROP_AFTER:
+                self.broadcaster.dropped += 1
+                self.broadcaster.clients.discard(self)
+                self.transport.abort()
+        else:
+            self.waiting = False
+            self.behind = 0
+            self.transport.write(payload)
+
+
+class Broadcaster:
+    """Serves a match to spectators from its own thread.
+
+       Call publish() with the match once every tick."""
+    def __init__(self, port=DEFAULT_PORT, host='0.0.0.0',
+                 keyframe_interval=KEYFRAME_INTERVAL,
+                 send_interval=SEND_INTERVAL):
+        if keyframe_interval % send_interval:
+            raise ValueError('Keyframes must start a batch of frames')
+        self.encoder = FrameEncoder(keyframe_interval)
+        self.send_interval = send_interval
+        self.pending = []  # Frames waiting to be sent together
+        self.backlog = []  # Everything sent since the last keyframe
+        self.clients = set()
+        # Stats
+        self.skipped = 0
+        self.dropped = 0
+        self.fan_out_time = 0.0  # CPU seconds spent sending frames
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.run,
+                                       args=(host, port, ready), daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def run(self, host, port, ready):
+        """Runs the server's event loop."""
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(self.loop.create_server(
+            lambda: SpectatorProtocol(self), host, port, backlog=1024))
+        self.port = self.server.sockets[0].getsockname()[1]
+        ready.set()
+        self.loop.run_forever()
+
+    def publish(self, match):
+        """Sends this tick's frame of a match to every spectator."""
+        payload, keyframe = self.encoder.encode(get_frame(match))
+        self.loop.call_soon_threadsafe(self.fan_out, payload, keyframe)
+
+    def fan_out(self, payload, keyframe):
+        """Sends frames to every spectator, on the server's thread."""
+        if not self.pending:
+            self.pending_keyframe = keyframe
+        self.pending.append(payload)
+        if len(self.pending) < self.send_interval:
+            return
+        start = time.thread_time()
+        payload = b''.join(self.pending)
+        keyframe = self.pending_keyframe
+        self.pending = []
+        if keyframe:
+            self.backlog = [payload]
+        else:
+            self.backlog.append(payload)
+        for client in list(self.clients):
+            client.send(payload, keyframe)
+        self.fan_out_time += time.thread_time() - start
+
+    def close(self):
+        """Stops serving."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# Spectators
+async def watch(host, port):
+    """Prints the score of a match whenever it changes."""
+    reader, writer = await asyncio.open_connection(host, port)
+    decoder = FrameDecoder()
+    score = None
+    while True:
+        data = await reader.read(4096)
+        if not data:
+            print('The match is over')
+            return
+        for frame, values in decoder.feed(data):
+            if values[4:] != score:
+                score = values[4:]
+                print('Frame {}: {} - {}'.format(frame, *score))
+
+
+async def benchmark(spectators, seconds=5.0, slow=0):
+    """Streams a match played by the computer to lots of local spectators.
+
+        slow is how many of them never read anything, to check they are
+        dealt with. Returns the broadcaster, the number of ticks and the
+        bytes the spectators received."""
+    broadcaster = Broadcaster(0, '127.0.0.1')
+    received = [0]
+
+    async def spectate(check):
+        reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                       broadcaster.port)
+        decoder = FrameDecoder()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            if check is not None:
+                check.extend(decoder.feed(data))
+            received[0] += len(data)
+
+    async def stall():
+        # Connects but never reads
+        reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                       broadcaster.port)
+        stalled.append(writer)
+
+    seen = []
+    stalled = []
+    tasks = [asyncio.ensure_future(spectate(seen))]
+    tasks += [asyncio.ensure_future(spectate(None))
+              for spectator in range(spectators - 1)]
+    await asyncio.gather(*(stall() for spectator in range(slow)))
+    while len(broadcaster.clients) < spectators + slow:
+        await asyncio.sleep(0.01)
+    match = simulation.Match()
+    frames = []
+    start = time.perf_counter()
+    for tick in range(int(seconds * TICK_RATE)):
+        simulation.handle_AI(match.ball, match.player1)
+        match.step()
+        frames.append(get_frame(match))
+        broadcaster.publish(match)
+        # Keep to the game's tick rate
+        await asyncio.sleep(max(0, start + (tick + 1) / TICK_RATE -
+                                time.perf_counter()))
+    await asyncio.sleep(0.5)
+    broadcaster.close()
+    for task in tasks:
+        task.cancel()
+    for writer in stalled:
+        writer.close()
+    # It may have been skipped ahead, but what it saw must be right
+    if not seen or any(frames[frame] != values for frame, values in seen):
+        raise AssertionError('A spectator saw the match wrong')
+    return broadcaster, len(frames), received[0]
+
+
+def main():
+    """Watches a match, or benchmarks the server."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('address', nargs='?', default='localhost',
+                        help='HOST[:PORT] of the match to watch')
+    parser.add_argument('--bench', type=int, metavar='SPECTATORS',
+                        help='stream to this many local spectators instead')
+    parser.add_argument('--slow', type=int, default=10,
+                        help="benchmark spectators that don't read")
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+    if args.bench:
+        broadcaster, ticks, received = asyncio.run(benchmark(
+            args.bench, args.seconds, args.slow))
+        per_tick = broadcaster.fan_out_time / ticks
+        print('{} spectators, {} ticks, {:.1f} MB sent'.format(
+            args.bench, ticks, received / 1e6))
+        print('{:.0f} us per tick to send to everyone ({:.1f}% of a core)'
+              .format(per_tick * 1e6, per_tick * TICK_RATE * 100))
+        print('About {:.0f} spectators per core'.format(
+            args.bench / (per_tick * TICK_RATE)))
+        print('{} frames skipped, {} slow spectators dropped'.format(
+            broadcaster.skipped, broadcaster.dropped))
+    else:
+        host, _, port = args.address.partition(':')
+        try:
+            asyncio.run(watch(host, int(port or DEFAULT_PORT)))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Telemetry
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""Records what happens in matches and stores it for later.
+
+Every paddle hit, wall hit, score, pause and the start and end of every
+rally becomes a record with the fields in FIELDS. The game only puts records
+into a ring buffer made once up front; a background thread takes them out in
+batches and stores them, so storing never holds up a frame. If the writer
+falls a whole buffer behind, new records are dropped and counted rather than
+waited for. The events of multi-ball matches don't say which ball they were
+about, so they are recorded without speeds, offsets or rallies.
+
+Records are stored in SQLite if the file ends in .db or .sqlite, and as one
+JSON object per line otherwise. To see how long rallies last and how fast the
+ball goes over everything stored:
+    python3 telemetry.py query matches.db
+and to fill a file with computer matches to try it on:
+    python3 telemetry.py simulate matches.db -n 1000
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+import simulation
+from simulation import PADDLE_HIT, WALL_HIT, SCORE, MATCH_OVER
+
+RING_SIZE = 4096  # Records the buffer holds
+BATCH_SIZE = 512  # Records waiting that wake the writer early
+FLUSH_INTERVAL = 1.0  # Most seconds records wait to be stored
+PERCENTILES = (10, 50, 90, 99)
+HISTOGRAM_BARS = 40  # Width of the longest histogram bar
+
+# Record kinds, besides the simulation's event kinds
+RALLY_START = 'rally_start'
+RALLY_END = 'rally_end'
+PAUSE = 'pause'
+UNPAUSE = 'unpause'
+
+# match is an id for the match, tick its tick and time the time.time() the
+# record was made at. player is who the record concerns, if anyone. speed is
+# the ball's horizontal speed in pixels per tick: after a hit, when a rally
+# starts, and the fastest of the rally when it ends. offset is how far the
+# middle of the ball was below the middle of the paddle at the end of the
+# tick it hit it. rally is how many paddle hits the rally has had.
+FIELDS = ('match', 'tick', 'time', 'kind', 'player', 'speed', 'offset',
+          'rally')
+
+
+class SQLiteWriter:
+    """Stores records in a table of an SQLite database, a transaction per
+       batch."""
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+
+    def open(self):
+        """Opens the database, on the thread that writes to it."""
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS events (match TEXT, tick INTEGER, '
+            'time REAL, kind TEXT, player INTEGER, speed INTEGER, '
+            'offset INTEGER, rally INTEGER)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS events_kind ON events (kind)')
+        self.connection.commit()
+
+    def write(self, records):
+        """Stores a batch of records."""
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)', records)
+
+    def close(self):
+        """Closes the database."""
+        self.connection.close()
+
+
+class JSONLinesWriter:
+    """Appends records to a file as one JSON object per line."""
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def open(self):
+        """Opens the file."""
+        self.file = open(self.path, 'a')
+
+    def write(self, records):
+        """Stores a batch of records."""
+        self.file.write(''.join(json.dumps(dict(zip(FIELDS, record))) + '\n'
+                                for record in records))
+        self.file.flush()
+
+    def close(self):
+        """Closes the file."""
+        self.file.close()
+
+
+class Telemetry:
+    """Turns match events into records and stores them in the background.
+
+       The game calls record_events() with the events of every tick and
+       record() for things outside the match, like pausing. Only the game's
+       thread adds records and only the writer's thread takes them out."""
+    def __init__(self, writer, size=RING_SIZE, interval=FLUSH_INTERVAL):
+        """writer: what stores the records, like an SQLiteWriter
+           size: how many records the ring buffer holds
+           interval: most seconds between batches"""
+        self.writer = writer
+        self.interval = interval
+        self.ring = [None] * size
+        self.added = 0  # Records ever added
+        self.stored = 0  # Records ever taken out to be stored
+        self.dropped = 0  # Records that didn't fit
+        self.match = None
+        self.match_id = None
+        self.rally = 0  # Paddle hits this rally
+        self.speed = 0  # Fastest the ball has gone this rally
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, record):
+        """Puts a record in the ring buffer, or drops it if that's full."""
+        if self.added - self.stored >= len(self.ring):
+            self.dropped += 1
+            return
+        self.ring[self.added % len(self.ring)] = record
+        self.added += 1
+        if self.added - self.stored == BATCH_SIZE:
+            self.wake.set()
+
+    def record(self, match, kind, player=None, speed=None, offset=None):
+        """Adds a record about a match."""
+        if match is not self.match:
+            self.start_match(match)
+        self.add((self.match_id, match.ticks, time.time(), kind, player,
+                  speed, offset, self.rally))
+
+    def start_match(self, match):
+        """Starts recording a new match, with its first rally if it has
+           only one ball."""
+        self.match = match
+        self.match_id = uuid.uuid4().hex
+        self.rally = 0
+        if not is_multiball(match):
+            self.start_rally(match)
+
+    def start_rally(self, match):
+        """Notes that the ball was served."""
+        self.rally = 0
+        self.speed = abs(match.ball.movex)
+        self.record(match, RALLY_START, speed=self.speed)
+
+    def record_events(self, match, events):
+        """Adds records for the events of a tick of a match, after it has
+           been stepped."""
+        if match is not self.match:
+            self.start_match(match)
+        if is_multiball(match):
+            for event in events:
+                self.record(match, event.kind, event.player)
+            return
+        for event in events:
+            ball = match.ball
+            if event.kind == PADDLE_HIT:
+                if event.player == 1:
+                    paddle = match.player1
+                else:
+                    paddle = match.player2
+                self.rally += 1
+                self.speed = max(self.speed, abs(ball.movex))
+                self.record(match, PADDLE_HIT, event.player, abs(ball.movex),
+                            ball.ball_rect.centery -
+                            paddle.paddle_rect.centery)
+            elif event.kind == WALL_HIT:
+                self.record(match, WALL_HIT, speed=abs(ball.movex))
+            elif event.kind == SCORE:
+                self.record(match, SCORE, event.player)
+                self.record(match, RALLY_END, speed=self.speed)
+                # The ball has already been served again, unless that was
+                # the last point
+                if match.winner is None:
+                    self.start_rally(match)
+            elif event.kind == MATCH_OVER:
+                self.record(match, MATCH_OVER, event.player)
+
+    def run(self):
+        """Stores records in batches until close() is called."""
+        self.writer.open()
+        while not self.stopping:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+        self.flush()
+        self.writer.close()
+
+    def flush(self):
+        """Stores every record added so far."""
+        added = self.added
+        if added == self.stored:
+            return
+        size = len(self.ring)
+        records = [self.ring[index % size]
+                   for index in range(self.stored, added)]
+        self.stored = added  # Frees the space for new records
+        self.writer.write(records)
+
+    def close(self):
+        """Stores what is left and stops the writer."""
+        self.stopping = True
+        self.wake.set()
+        self.thread.join()
+
+
+def is_multiball(match):
+    """Returns whether a match is a multiball.MultiBallMatch, without
+       importing NumPy for it."""
+    return hasattr(match, 'balls')
+
+
+def open_writer(path):
+    """Returns the writer for a file, chosen by its extension."""
+    if os.path.splitext(path)[1] in ('.db', '.sqlite'):
+        return SQLiteWriter(path)
+    return JSONLinesWriter(path)
+
+
+def open_telemetry(path):
+    """Starts recording to a file, see open_writer()."""
+    return Telemetry(open_writer(path))
+
+
+def load_columns(path):
+    """Returns the rally lengths, rally top speeds and paddle hit speeds
+       stored in a file, and how many matches they came from."""
+    rallies = []
+    top_speeds = []
+    hit_speeds = []
+    if isinstance(open_writer(path), SQLiteWriter):
+        connection = sqlite3.connect(path)
+        for rally, speed in connection.execute(
+                'SELECT rally, speed FROM events WHERE kind = ?',
+                (RALLY_END,)):
+            rallies.append(rally)
+            top_speeds.append(speed)
+        hit_speeds = [speed for speed, in connection.execute(
+            'SELECT speed FROM events WHERE kind = ? AND speed IS NOT NULL',
+            (PADDLE_HIT,))]
+        matches, = connection.execute(
+            'SELECT COUNT(DISTINCT match) FROM events').fetchone()
+        connection.close()
+        return rallies, top_speeds, hit_speeds, matches
+    match_ids = set()
+    with open(path) as records:
+        for line in records:
+            record = json.loads(line)
+            match_ids.add(record['match'])
+            if record['kind'] == RALLY_END:
+                rallies.append(record['rally'])
+                top_speeds.append(record['speed'])
+            elif (record['kind'] == PADDLE_HIT and
+                  record['speed'] is not None):
+                hit_speeds.append(record['speed'])
+    return rallies, top_speeds, hit_speeds, len(match_ids)
+
+
+def get_percentiles(values):
+    """Returns the PERCENTILES and maximum of some values."""
+    values = sorted(values)
+    if not values:
+        return [0] * (len(PERCENTILES) + 1)
+    return ([values[min(len(values) - 1, len(values) * percent // 100)]
+             for percent in PERCENTILES] + [values[-1]])
+
+
+def print_distribution(title, values):
+    """Prints the percentiles and a histogram of some whole numbers."""
+    print('{}: {} values, {}'.format(title, len(values), '  '.join(
+        '{} {}'.format(name, value) for name, value in zip(
+            ['p{}'.format(percent) for percent in PERCENTILES] + ['max'],
+            get_percentiles(values)))))
+    counts = {}
+    for value in values:
+        counts[value] = counts.get(value, 0) + 1
+    most = max(counts.values(), default=1)
+    for value in sorted(counts):
+        print('{:>6} {:>8} {}'.format(value, counts[value], '#' * max(
+            1, counts[value] * HISTOGRAM_BARS // most)))
+
+
+def query(paths):
+    """Prints rally length and ball speed distributions over files of
+       records."""
+    rallies = []
+    top_speeds = []
+    hit_speeds = []
+    matches = 0
+    for path in paths:
+        columns = load_columns(path)
+        rallies.extend(columns[0])
+        top_speeds.extend(columns[1])
+        hit_speeds.extend(columns[2])
+        matches += columns[3]
+    print('{} matches, {} rallies'.format(matches, len(rallies)))
+    print_distribution('Paddle hits per rally', rallies)
+    print_distribution('Fastest speed per rally', top_speeds)
+    print_distribution('Speed after paddle hits', hit_speeds)
+
+
+def simulate(path, count, seed=0):
+    """Records matches of the computer against itself to a file.
+
+        Returns how many records were made and how many seconds it took."""
+    rng = random.Random(seed)
+    difficulties = sorted(simulation.DIFFICULTIES)
+    telemetry = open_telemetry(path)
+    start = time.perf_counter()
+    for game in range(count):
+        # Player 1 is the computer too, at a level picked at random
+        bots = [simulation.InterceptAI.from_difficulty(rng.choice(
+            difficulties), random.Random(rng.random())) for side in (1, 2)]
+        match = simulation.Match(ai=bots[1])
+        bots[0].reset(match, match.player1)
+        while match.winner is None:
+            bots[0].steer(match, match.player1)
+            telemetry.record_events(match, match.step())
+    telemetry.close()
+    return telemetry.added, time.perf_counter() - start
+
+
+def main():
+    """Queries stored records, or records computer matches."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=('query', 'simulate'))
+    parser.add_argument('files', nargs='+',
+                        help='files of records, or the one to record to')
+    parser.add_argument('-n', '--matches', type=int, default=100,
+                        help='how many matches to simulate')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.command == 'query':
+        query(args.files)
+        return
+    records, elapsed = simulate(args.files[0], args.matches, args.seed)
+    print('Recorded {} matches, {} records, in {:.1f} s'.format(
+        args.matches, records, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#------------------------------------------------------------------------------
+# Name:           Plink Tournament
+#
+# Author:         Kurtis Dinelle
+#
+# Created:        20/05/2013
+# Copyright:      (c) Dinelle 2013
+# License:        MIT
+#------------------------------------------------------------------------------
+"""Plays paddle AIs against each other headless, across all CPU cores.
+
+Every pair of bots plays a number of matches, swapping sides every game.
+Each match is seeded from the tournament seed, its pair and its game number
+alone, and the results are put back in order before they are added up, so
+a tournament gives the same numbers however many workers play it.
+
+Bots are given as a name from BOTS, or a module.Class path for your own,
+optionally followed by parameters:
+    python3 tournament.py stock stock:maxspeed=8 stock:jitter=0.3 -g 200
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import math
+import multiprocessing
+import random
+import simulation
+from simulation import BALL_SIZE, COURT_TOP, COURT_BOTTOM, TICK_RATE
+
+MAX_TICKS = TICK_RATE * 60 * 5  # A match still going after this is a draw
+Z_95 = 1.959964  # For 95% confidence intervals
+
+
+# Bots
+class StockBot:
+    """The game's own computer player, simulation.handle_AI.
+
+       jitter is the chance each tick that it doesn't look at the ball and
+       keeps doing what it was doing."""
+    def __init__(self, rng, maxspeed=12, jitter=0.0):
+        self.rng = rng
+        self.maxspeed = int(maxspeed)
+        self.jitter = float(jitter)
+
+    def reset(self, match, paddle):
+        """Gets ready to play a match with a paddle."""
+        paddle.maxspeed = self.maxspeed
+        paddle.movespeed = self.maxspeed
+
+    def steer(self, match, paddle):
+        """Steers the paddle for the coming tick."""
+        if self.jitter and self.rng.random() < self.jitter:
+            return
+        simulation.handle_AI(match.ball, paddle)
+
+
+BOTS = {'stock': StockBot, 'intercept': simulation.InterceptAI}
+
+
+def make_bot(spec, rng):
+    """Creates a bot from a spec like 'stock:maxspeed=8,jitter=0.1'."""
+    name, _, params = spec.partition(':')
+    if name in BOTS:
+        bot_class = BOTS[name]
+    else:
+        module, _, class_name = name.rpartition('.')
+        if not module:
+            raise ValueError('Unknown bot {}'.format(name))
+        bot_class = getattr(importlib.import_module(module), class_name)
+    kwargs = {}
+    for param in filter(None, params.split(',')):
+        key, _, value = param.partition('=')
+        kwargs[key] = value
+    return bot_class(rng, **kwargs)
+
+
+# Matches
+def play_match(task):
+    """Plays one match between two bots.
+
+        task is (player 1's spec, player 2's spec, seed). The seed picks
+        where the first serve comes from and drives any randomness in the
+        bots. Returns (winner, hits per rally, ticks) with winner 1, 2, or
+        0 for a draw."""
+    spec1, spec2, seed = task
+    rng = random.Random(seed)
+    match = simulation.Match(numplayers=2)
+    bots = ((make_bot(spec1, random.Random(rng.random())), match.player1),
+            (make_bot(spec2, random.Random(rng.random())), match.player2))
+    for bot, paddle in bots:
+        bot.reset(match, paddle)
+    # Without this every match between two fixed bots would be identical
+    match.ball.ball_rect.y = rng.randrange(COURT_TOP, COURT_BOTTOM - BALL_SIZE)
+    match.ball.movey *= rng.choice((-1, 1))
+    rallies = []
+    hits = 0
+    while match.winner is None and match.ticks < MAX_TICKS:
+        for bot, paddle in bots:
+            bot.steer(match, paddle)
+        for event in match.step():
+            if event.kind == simulation.PADDLE_HIT:
+                hits += 1
+            elif event.kind == simulation.SCORE:
+                rallies.append(hits)
+                hits = 0
+    return match.winner or 0, rallies, match.ticks
+
+
+def make_tasks(specs, games, seed):
+    """Lists every match of a round robin between the bots.
+
+        Returns (pair, task) tuples, where pair is the index of the two bots
+        with the first one as player 1."""
+    tasks = []
+    for a, b in itertools.combinations(range(len(specs)), 2):
+        for game in range(games):
+            # Seeded from the tournament, pair and game only
+            game_seed = random.Random('{}:{}:{}:{}'.format(
+                seed, a, b, game)).getrandbits(64)
+            pair = (a, b) if game % 2 == 0 else (b, a)
+            tasks.append((pair, (specs[pair[0]], specs[pair[1]], game_seed)))
+    return tasks
+
+
+def run_tournament(specs, games=100, seed=0, workers=None):
+    """Plays a round robin and returns its results.
+
+        workers is how many processes to play on; all CPU cores if None,
+        and no pool at all if 1."""
+    tasks = make_tasks(specs, games, seed)
+    jobs = [task for pair, task in tasks]
+    if workers == 1:
+        outcomes = list(map(play_match, jobs))
+    else:
+        processes = workers or multiprocessing.cpu_count()
+        # A few chunks per process keeps them all busy to the end
+        chunksize = max(1, len(jobs) // (processes * 8))
+        with multiprocessing.Pool(processes) as pool:
+            outcomes = pool.map(play_match, jobs, chunksize)
+    return summarize(specs, tasks, outcomes)
+
+
+# Statistics
+def wilson_interval(wins, games):
+    """95% confidence interval of a win rate."""
+    if not games:
+        return 0.0, 1.0
+    rate = wins / games
+    spread = Z_95 * math.sqrt(rate * (1 - rate) / games +
+                              Z_95 ** 2 / (4 * games ** 2))
+    middle = rate + Z_95 ** 2 / (2 * games)
+    scale = 1 + Z_95 ** 2 / games
+    return (middle - spread) / scale, (middle + spread) / scale
+
+
+def mean_interval(values):
+    """Mean of some values with its 95% confidence interval."""
+    if not values:
+        return 0.0, 0.0, 0.0
+    mean = sum(values) / len(values)
+    if len(values) < 2:
+        return mean, mean, mean
+    variance = sum((value - mean) ** 2 for value in values) / (len(values) - 1)
+    spread = Z_95 * math.sqrt(variance / len(values))
+    return mean, mean - spread, mean + spread
+
+
+def summarize(specs, tasks, outcomes):
+    """Adds up match outcomes per bot and per pairing."""
+    bots = [{'bot': spec, 'games': 0, 'wins': 0, 'draws': 0, 'rallies': []}
+            for spec in specs]
+    pairs = {}
+    for (pair, task), (winner, rallies, ticks) in zip(tasks, outcomes):
+        key = tuple(sorted(pair))
+        record = pairs.setdefault(key, {'games': 0, 'wins': 0, 'draws': 0,
+                                        'rallies': [], 'ticks': []})
+        record['games'] += 1
+        record['rallies'].extend(rallies)
+        record['ticks'].append(ticks)
+        for side, bot in enumerate(pair, 1):
+            bots[bot]['games'] += 1
+            bots[bot]['rallies'].extend(rallies)
+            if winner == 0:
+                bots[bot]['draws'] += 1
+            elif winner == side:
+                bots[bot]['wins'] += 1
+        if winner == 0:
+            record['draws'] += 1
+        elif pair[winner - 1] == key[0]:
+            record['wins'] += 1
+    results = {'bots': [], 'pairs': []}
+    for record in bots:
+        results['bots'].append(finish_record(record))
+    for (a, b), record in sorted(pairs.items()):
+        record = finish_record(record)
+        record['bot'] = specs[a]
+        record['opponent'] = specs[b]
+        record['mean_ticks'] = mean_interval(record.pop('ticks'))[0]
+        results['pairs'].append(record)
+    return results
+
+
+def finish_record(record):
+    """Turns counts and rally lengths into rates and intervals."""
+    rallies = record.pop('rallies')
+    games = record['games']
+    record['win_rate'] = record['wins'] / games if games else 0.0
+    record['win_rate_95'] = wilson_interval(record['wins'], games)
+    mean, low, high = mean_interval(rallies)
+    record['rally_hits'] = mean
+    record['rally_hits_95'] = (low, high)
+    record['rallies'] = len(rallies)
+    return record
+
+
+def print_results(results):
+    """Prints a tournament's results as tables."""
+    print('{:<28} {:>6} {:>6} {:>6} {:>21} {:>12}'.format(
+        'Bot', 'Games', 'Wins', 'Draws', 'Win rate (95%)', 'Rally hits'))
+    for record in results['bots']:
+        low, high = record['win_rate_95']
+        print('{:<28} {:>6} {:>6} {:>6} {:>6.1%} ({:>5.1%}-{:>5.1%}) '
+              '{:>12.2f}'.format(record['bot'], record['games'],
+                                 record['wins'], record['draws'],
+                                 record['win_rate'], low, high,
+                                 record['rally_hits']))
+    print()
+    for record in results['pairs']:
+        low, high = record['win_rate_95']
+        print('{} vs {}: {:.1%} ({:.1%}-{:.1%}) over {} games, {:.2f} hits '
+              'per rally'.format(record['bot'], record['opponent'],
+                                 record['win_rate'], low, high,
+                                 record['games'], record['rally_hits']))
+
+
+def main():
+    """Runs a tournament from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('bots', nargs='+', help='bots to play, at least two')
+    parser.add_argument('-g', '--games', type=int, default=100,
+                        help='matches per pairing')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-w', '--workers', type=int,
+                        help='processes to use; all CPU cores by default')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+    if len(args.bots) < 2:
+        parser.error('A tournament needs at least two bots')
+    results = run_tournament(args.bots, args.games, args.seed, args.workers)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()